@@ -0,0 +1,276 @@
+"""
+Замеры скорости передачи файлов на локальной машине
+
+python benchmark.py tcp-send [размер_МБ] [повторы]
+    TCP клиент: sendfile (нулевое копирование) против цикла read/send по 4096 байт
+    и отправки с контрольной суммой blake2b (sendfile + хэширование в фоне)
+
+python benchmark.py tcp-workers [клиентов] [размер_МБ] [процессов]
+    TCP сервер: один процесс против TCPServerPool, клиенты отправляют одновременно
+
+python benchmark.py udp-fec [размер_МБ] [потери_% ...]
+    UDP через прокси, теряющий пакеты: полезная скорость без четности и с четностью
+    (1 пакет на 8 и на 4 блока) при разных долях потерь
+"""
+
+import contextlib
+import io
+import multiprocessing
+import os
+import random
+import select
+import socket
+import sys
+import tempfile
+import time
+
+
+def free_port():
+    """Свободный порт на localhost"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def make_test_file(directory, size):
+    """Файл со случайными данными заданного размера"""
+    path = os.path.join(directory, f"bench_{size}.bin")
+    block = os.urandom(1024 * 1024)
+    with open(path, 'wb') as f:
+        left = size
+        while left > 0:
+            f.write(block[:min(left, len(block))])
+            left -= len(block)
+    return path
+
+
+def clear_directory(directory):
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            os.remove(path)
+
+
+def wait_for_port(port, timeout=10.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+
+def _run_tcp_server(port, download_dir, workers=1):
+    """TCP сервер в отдельном процессе, без вывода в консоль"""
+    sys.stdout = open(os.devnull, 'w')
+    from tcp_server import TCPServerFixed, TCPServerPool
+    if workers > 1:
+        server = TCPServerPool(host='127.0.0.1', port=port, workers=workers, download_dir=download_dir)
+    else:
+        server = TCPServerFixed(host='127.0.0.1', port=port, download_dir=download_dir)
+    server.start()
+
+
+def _send_tcp_file(args):
+    """Отправка одного файла из процесса-клиента"""
+    port, file_path = args
+    sys.stdout = open(os.devnull, 'w')
+    from tcp_client import TCPClientSimple
+    client = TCPClientSimple('127.0.0.1', port)
+    ok = client.connect() and client.send_file(file_path)
+    client.disconnect()
+    return ok
+
+
+def _run_udp_server(port, work_dir):
+    """UDP сервер в отдельном процессе (файлы - в work_dir/received_files), без вывода в консоль"""
+    sys.stdout = open(os.devnull, 'w')
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.chdir(work_dir)
+    from udp_server import UDPServerSimple
+    UDPServerSimple(host='127.0.0.1', port=port).run()
+
+
+def _run_lossy_proxy(port, target_port, loss):
+    """UDP прокси: пересылает пакеты клиента серверу и обратно, теряя долю loss в каждую сторону"""
+    target = ('127.0.0.1', target_port)
+    listen = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    listen.bind(('127.0.0.1', port))
+    upstream = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    for s in (listen, upstream):
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+    client = None
+    while True:
+        readable, _, _ = select.select([listen, upstream], [], [])
+        for s in readable:
+            data, addr = s.recvfrom(65536)
+            if random.random() < loss:
+                continue
+            if s is listen:
+                client = addr
+                upstream.sendto(data, target)
+            elif client is not None:
+                listen.sendto(data, client)
+
+
+def bench_tcp_send(size_mb=256, repeats=3):
+    """sendfile против цикла read/send и отправки с контрольной суммой в TCPClientSimple.send_file"""
+    from tcp_client import TCPClientSimple
+
+    size = int(size_mb * 1024 * 1024)
+    with tempfile.TemporaryDirectory() as work:
+        download_dir = os.path.join(work, "downloads")
+        os.makedirs(download_dir)
+        file_path = make_test_file(work, size)
+
+        port = free_port()
+        server = multiprocessing.Process(target=_run_tcp_server, args=(port, download_dir), daemon=True)
+        server.start()
+        try:
+            if not wait_for_port(port):
+                print("Сервер не запустился")
+                return
+            print(f"TCP отправка файла {size_mb} МБ, повторов: {repeats}")
+            print(f"{'Режим':<10} {'МБ/с':>10} {'CPU клиента, с':>16}")
+            for mode in ('loop', 'sendfile', 'blake2b'):
+                speeds = []
+                cpu = []
+                for _ in range(repeats):
+                    client = TCPClientSimple('127.0.0.1', port, use_sendfile=(mode != 'loop'),
+                                             checksum=('blake2b' if mode == 'blake2b' else None), resume=False)
+                    if not client.connect():
+                        print("Не удалось подключиться")
+                        return
+                    wall_start = time.perf_counter()
+                    cpu_start = time.process_time()
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        ok = client.send_file(file_path)
+                    cpu.append(time.process_time() - cpu_start)
+                    elapsed = time.perf_counter() - wall_start
+                    client.disconnect()
+                    clear_directory(download_dir)
+                    if not ok:
+                        print(f"{mode}: ошибка передачи")
+                        return
+                    speeds.append(size / elapsed / (1024 * 1024))
+                print(f"{mode:<10} {max(speeds):>10.1f} {min(cpu):>16.3f}")
+        finally:
+            server.terminate()
+            server.join()
+
+
+def bench_tcp_workers(clients=16, size_mb=64, workers=None):
+    """Прием одновременных передач: один процесс против нескольких"""
+    workers = workers or os.cpu_count() or 1
+    size = int(size_mb * 1024 * 1024)
+    with tempfile.TemporaryDirectory() as work:
+        download_dir = os.path.join(work, "downloads")
+        os.makedirs(download_dir)
+        file_path = make_test_file(work, size)
+
+        print(f"TCP прием: {clients} клиентов по {size_mb} МБ одновременно")
+        print(f"{'Процессов':<10} {'МБ/с':>10} {'Время, с':>10}")
+        with multiprocessing.Pool(clients) as pool:
+            for count in sorted({1, workers}):
+                port = free_port()
+                server = multiprocessing.Process(target=_run_tcp_server, args=(port, download_dir, count),
+                                                 daemon=False)
+                server.start()
+                try:
+                    if not wait_for_port(port):
+                        print("Сервер не запустился")
+                        return
+                    start = time.perf_counter()
+                    results = pool.map(_send_tcp_file, [(port, file_path)] * clients)
+                    elapsed = time.perf_counter() - start
+                finally:
+                    server.terminate()
+                    server.join()
+                clear_directory(download_dir)
+                if not all(results):
+                    print(f"{count}: ошибка передачи")
+                    return
+                print(f"{count:<10} {clients * size / elapsed / (1024 * 1024):>10.1f} {elapsed:>10.2f}")
+
+
+def bench_udp_fec(size_mb=8, losses=(0, 1, 5, 10), chunk_size=8952, repeats=3):
+    """Полезная скорость UDP передачи (МБ файла в секунду) при потерях: повторы против четности
+
+    В таблице - медиана из repeats передач: потери случайны, и отдельные замеры сильно разбросаны
+    """
+    from udp_client import UDPClientSimple
+
+    size = int(size_mb * 1024 * 1024)
+    fec_modes = (0, 8, 4)
+    with tempfile.TemporaryDirectory() as work:
+        file_path = make_test_file(work, size)
+        download_dir = os.path.join(work, "received_files")
+        server_port = free_port()
+        server = multiprocessing.Process(target=_run_udp_server, args=(server_port, work), daemon=True)
+        server.start()
+        try:
+            # Пробная передача напрямую: сервер готов принимать
+            with contextlib.redirect_stdout(io.StringIO()):
+                ready = UDPClientSimple('127.0.0.1', server_port, chunk_size=chunk_size,
+                                        resume=False).send_file(make_test_file(work, 1024))
+            if not ready:
+                print("Сервер не запустился")
+                return
+            print(f"UDP отправка файла {size_mb} МБ через прокси с потерями, блок {chunk_size} байт")
+            print(f"{'Потери, %':<10}" + ''.join(f"{('без четности' if k == 0 else f'1 на {k}'):>14}"
+                                                 for k in fec_modes) + "   (МБ/с)")
+            for loss in losses:
+                proxy_port = free_port()
+                proxy = multiprocessing.Process(target=_run_lossy_proxy, args=(proxy_port, server_port, loss / 100),
+                                                daemon=True)
+                proxy.start()
+                time.sleep(0.3)  # Прокси успевает открыть порт
+                row = []
+                try:
+                    for fec in fec_modes:
+                        speeds = []
+                        for _ in range(repeats):
+                            client = UDPClientSimple('127.0.0.1', proxy_port, chunk_size=chunk_size, resume=False,
+                                                     fec=fec)
+                            start = time.perf_counter()
+                            with contextlib.redirect_stdout(io.StringIO()):
+                                ok = client.send_file(file_path)
+                            elapsed = time.perf_counter() - start
+                            time.sleep(0.2)  # Сервер дописывает файл после ответа
+                            clear_directory(download_dir)
+                            speeds.append(size / elapsed / (1024 * 1024) if ok else 0.0)
+                        speeds.sort()
+                        median = speeds[len(speeds) // 2]
+                        row.append(f"{median:>14.1f}" if median else f"{'ошибка':>14}")
+                finally:
+                    proxy.terminate()
+                    proxy.join()
+                print(f"{loss:<10g}" + ''.join(row))
+        finally:
+            server.terminate()
+            server.join()
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        return
+
+    command = sys.argv[1]
+    args = [float(a) for a in sys.argv[2:]]
+    if command == 'tcp-send':
+        bench_tcp_send(args[0] if args else 256, int(args[1]) if len(args) > 1 else 3)
+    elif command == 'tcp-workers':
+        bench_tcp_workers(int(args[0]) if args else 16, args[1] if len(args) > 1 else 64,
+                          int(args[2]) if len(args) > 2 else None)
+    elif command == 'udp-fec':
+        bench_udp_fec(args[0] if args else 8, args[1:] or (0, 1, 5, 10))
+    else:
+        print(f"Неизвестный замер: {command}")
+        print(__doc__)
+
+
+if __name__ == "__main__":
+    main()
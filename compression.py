@@ -0,0 +1,133 @@
+"""
+Сжатие данных на лету при передаче файлов
+Используется TCP и UDP клиентами и серверами
+
+Данные сжимаются независимыми блоками (TCP - по BLOCK_SIZE, UDP - каждый пакет),
+поэтому докачка и параллельные диапазоны работают так же, как без сжатия.
+Блок, который не уменьшился, отправляется как есть
+zlib - есть всегда; zstd и lz4 - быстрее, если установлены модули zstandard и lz4
+Несжимаемые файлы (фото, видео, архивы, PDF) определяются по пробам из файла
+и отправляются без сжатия - на них не тратится процессор
+"""
+
+import os
+import struct
+import zlib
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+AUTO = 'auto'                          # лучший алгоритм, который есть у обеих сторон
+PREFERRED = ('zstd', 'lz4', 'zlib')    # порядок выбора для AUTO
+BLOCK_SIZE = 256 * 1024
+BLOCK_HEADER = struct.Struct('!II')    # TCP: размер блока до сжатия, размер на проводе
+ZLIB_LEVEL = 1                         # быстрый уровень: сжатие не должно тормозить передачу
+
+SAMPLE_SIZE = 64 * 1024
+SAMPLE_COUNT = 3                       # пробы из начала, середины и конца файла
+MIN_SAVING = 0.1                       # сжимать, если пробы уменьшились хотя бы на 10%
+# Форматы, которые уже сжаты: их даже не пробуем
+INCOMPRESSIBLE_EXTENSIONS = frozenset((
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic',
+    '.mp3', '.aac', '.ogg', '.flac', '.mp4', '.mkv', '.avi', '.mov', '.webm',
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.7z', '.rar', '.zst', '.lz4',
+    '.pdf', '.docx', '.xlsx', '.pptx', '.jar', '.apk',
+))
+
+
+def _zlib_decompress(data, size):
+    decompressor = zlib.decompressobj()
+    result = decompressor.decompress(data, size)
+    if not decompressor.eof or decompressor.unconsumed_tail:
+        raise ValueError("блок zlib длиннее заявленного или оборван")
+    return result
+
+
+_ALGORITHMS = {
+    'zlib': (lambda data: zlib.compress(data, ZLIB_LEVEL), _zlib_decompress),
+}
+if zstandard is not None:
+    # Объекты zstandard нельзя делить между потоками - создаются на каждый блок
+    _ALGORITHMS['zstd'] = (
+        lambda data: zstandard.ZstdCompressor(level=1).compress(data),
+        lambda data, size: zstandard.ZstdDecompressor().decompress(data, max_output_size=size),
+    )
+if lz4 is not None:
+    _ALGORITHMS['lz4'] = (
+        lambda data: lz4.frame.compress(data),
+        lambda data, size: lz4.frame.decompress(data),
+    )
+
+
+def available_algorithms():
+    """Алгоритмы, доступные на этой машине"""
+    return list(_ALGORITHMS)
+
+
+def choose_algorithm(name, supported):
+    """Алгоритм для передачи: name (или лучший для AUTO), если его поддерживает другая сторона, иначе None"""
+    if name == AUTO:
+        for candidate in PREFERRED:
+            if candidate in supported and candidate in _ALGORITHMS:
+                return candidate
+        return None
+    if name and name in supported and name in _ALGORITHMS:
+        return name
+    return None
+
+
+def compress(name, data):
+    """Сжатый блок (может оказаться длиннее исходного - тогда блок отправляют как есть)"""
+    return _ALGORITHMS[name][0](data)
+
+
+def decompress(name, data, size):
+    """Распаковать блок, который до сжатия занимал size байт"""
+    try:
+        result = _ALGORITHMS[name][1](data, size)
+    except KeyError:
+        raise ValueError(f"неизвестный алгоритм сжатия: {name!r}") from None
+    except ValueError:
+        raise
+    except Exception as e:
+        # zlib.error, ошибки lz4/zstandard - поврежденный блок
+        raise ValueError(f"не удалось распаковать блок: {e}") from None
+    if len(result) != size:
+        raise ValueError(f"блок распаковался в {len(result)} байт вместо {size}")
+    return result
+
+
+def encode_block(name, data):
+    """TCP блок: заголовок BLOCK_HEADER + сжатые данные или исходные, если сжатие не помогло"""
+    packed = compress(name, data)
+    if len(packed) >= len(data):
+        packed = data
+    return BLOCK_HEADER.pack(len(data), len(packed)) + packed
+
+
+def is_compressible(path, name='zlib'):
+    """Стоит ли сжимать файл: известные сжатые форматы - нет, остальные - по пробам"""
+    if os.path.splitext(path)[1].lower() in INCOMPRESSIBLE_EXTENSIONS:
+        return False
+    size = os.path.getsize(path)
+    if size == 0:
+        return False
+    if size <= SAMPLE_SIZE * SAMPLE_COUNT:
+        offsets = [0]
+    else:
+        offsets = [i * (size - SAMPLE_SIZE) // (SAMPLE_COUNT - 1) for i in range(SAMPLE_COUNT)]
+    raw = packed = 0
+    with open(path, 'rb') as f:
+        for offset in offsets:
+            f.seek(offset)
+            sample = f.read(SAMPLE_SIZE if len(offsets) > 1 else SAMPLE_SIZE * SAMPLE_COUNT)
+            raw += len(sample)
+            packed += len(compress(name, sample))
+    return packed <= raw * (1 - MIN_SAVING)
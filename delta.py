@@ -0,0 +1,286 @@
+"""
+Передача изменений (как rsync): отправляются только отличия новой версии файла от
+той, что уже есть у сервера
+Используется TCP и UDP клиентами и серверами
+
+1. Сервер делит свою копию (основу) на блоки block_size и сообщает подписи блоков:
+   слабую сумму Adler-32 (ее можно сдвигать на байт за O(1)) и сильную blake2b (16 байт)
+2. Клиент ищет блоки основы в новом файле на любом смещении: сначала на границе блока
+   (неизмененные места - со скоростью zlib/hashlib), при промахе - скользящей суммой
+   байт за байтом, и выдает команды COPY (диапазон основы) и LITERAL (новые байты)
+3. Сервер собирает новую версию из основы и литералов и сверяет контрольную сумму всего файла
+
+Поток команд: COPY !BQQ смещение и длина в основе; LITERAL !BI длина + байты; END !B
+Основа - самая новая версия файла с тем же именем в папке загрузок (имя, имя_1, имя_2, ...)
+"""
+
+import hashlib
+import math
+import os
+import re
+import struct
+import zlib
+
+MIN_BLOCK_SIZE = 2 * 1024
+MAX_BLOCK_SIZE = 128 * 1024
+DELTA_MIN_SIZE = 1024 * 1024   # меньшие файлы быстрее отправить целиком
+STRONG_SIZE = 16
+SIGNATURE_ENTRY = struct.Struct(f'!I{STRONG_SIZE}s')  # слабая сумма, сильная сумма
+
+OP_END = 0
+OP_LITERAL = 1
+OP_COPY = 2
+OP_HEADER = struct.Struct('!B')
+LITERAL_HEADER = struct.Struct('!BI')
+COPY_HEADER = struct.Struct('!BQQ')
+MAX_LITERAL = 16 * 1024 * 1024  # длинный литерал делится на команды такого размера
+COPY_BUFFER = 1024 * 1024
+
+ADLER_MOD = 65521
+# Скользящий поиск байт за байтом идет на Python и дорог: после блока без совпадения
+# следующие промахи проверяются только на границе блока, пропуск удваивается до MAX_ROLL_SKIP
+MAX_ROLL_SKIP = 16
+
+
+def block_size_for(size):
+    """Размер блока подписи: около корня из размера файла, степень двойки"""
+    if size <= 0:
+        return MIN_BLOCK_SIZE
+    block = 1 << max(0, round(math.log2(math.sqrt(size))))
+    return max(MIN_BLOCK_SIZE, min(MAX_BLOCK_SIZE, block))
+
+
+def strong_checksum(data):
+    return hashlib.blake2b(data, digest_size=STRONG_SIZE).digest()
+
+
+def block_signatures(file, block_size, first=0, count=None):
+    """Подписи блоков основы first..first+count (все до конца файла, если count=None)"""
+    file.seek(first * block_size)
+    entries = []
+    while count is None or len(entries) < count:
+        block = file.read(block_size)
+        if not block:
+            break
+        entries.append(SIGNATURE_ENTRY.pack(zlib.adler32(block), strong_checksum(block)))
+    return b''.join(entries)
+
+
+def find_base(directory, safe_name):
+    """Самая новая версия файла safe_name в папке загрузок или None
+
+    Серверы не перезаписывают файлы: повторная загрузка получает имя имя_1, имя_2 и т.д.
+    """
+    stem, suffix = os.path.splitext(safe_name)
+    pattern = re.compile(re.escape(stem) + r'_\d+' + re.escape(suffix) + '$')
+    best = None
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return None
+    for name in names:
+        if name != safe_name and not pattern.match(name):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        if os.path.isfile(path) and (best is None or stat.st_mtime_ns > best[0]):
+            best = (stat.st_mtime_ns, name)
+    return best[1] if best else None
+
+
+class Signature:
+    """Подписи блоков основы для поиска совпадений"""
+    def __init__(self, block_size, base_size, entries):
+        self.block_size = block_size
+        self.base_size = base_size
+        self.strong = []
+        self.table = {}  # слабая сумма -> номера полных блоков
+        self.tail_index = None
+        count = len(entries) // SIGNATURE_ENTRY.size
+        for index in range(count):
+            weak, strong = SIGNATURE_ENTRY.unpack_from(entries, index * SIGNATURE_ENTRY.size)
+            self.strong.append(strong)
+            if (index + 1) * block_size <= base_size:
+                self.table.setdefault(weak, []).append(index)
+            else:
+                self.tail_index = index  # короткий последний блок основы
+        self.tail_size = base_size - self.tail_index * block_size if self.tail_index is not None else 0
+
+    def find(self, weak, window):
+        """Номер блока основы с содержимым window (слабая сумма уже посчитана) или None"""
+        candidates = self.table.get(weak)
+        if not candidates:
+            return None
+        strong = strong_checksum(window)
+        for index in candidates:
+            if self.strong[index] == strong:
+                return index
+        return None
+
+
+class DeltaEncoder:
+    """Команды, собирающие новый файл из основы: COPY где блоки совпали, LITERAL между ними
+
+    hasher - обновляется всеми байтами нового файла по порядку (сумма для сверки на сервере)
+    """
+    def __init__(self, signature, hasher=None):
+        self.signature = signature
+        self.hasher = hasher
+        self.literal_bytes = 0
+        self.copied_bytes = 0
+
+    def ops(self, data):
+        """Команды для data (bytes, mmap): (OP_COPY, смещение в основе, длина)
+        и (OP_LITERAL, смещение в data, длина)"""
+        sig = self.signature
+        block = sig.block_size
+        size = len(data)
+        pos = 0
+        literal_start = 0
+        pending_copy = None
+        roll_skip = 0    # сколько следующих промахов проверять только на границе блока
+        skip_left = 0
+
+        def flush_literal(end):
+            nonlocal pending_copy
+            if end > literal_start:
+                if pending_copy:
+                    yield (OP_COPY, *pending_copy)
+                    pending_copy = None
+                if self.hasher is not None:
+                    self.hasher.update(data[literal_start:end])
+                self.literal_bytes += end - literal_start
+                for start in range(literal_start, end, MAX_LITERAL):
+                    yield (OP_LITERAL, start, min(MAX_LITERAL, end - start))
+
+        def add_copy(index, length):
+            nonlocal pending_copy
+            offset = index * block
+            self.copied_bytes += length
+            if pending_copy and pending_copy[0] + pending_copy[1] == offset:
+                pending_copy = (pending_copy[0], pending_copy[1] + length)
+                return None
+            previous, pending_copy = pending_copy, (offset, length)
+            return previous
+
+        while pos + block <= size:
+            window = data[pos:pos + block]
+            weak = zlib.adler32(window)
+            index = sig.find(weak, window)
+            if index is None and skip_left == 0:
+                # Скользящий поиск: блок основы мог сдвинуться после вставки или удаления
+                a, b = weak & 0xffff, weak >> 16
+                end = min(size - block, pos + block)
+                k = pos
+                while k < end:
+                    out, inn = data[k], data[k + block]
+                    a = (a - out + inn) % ADLER_MOD
+                    b = (b - block * out + a - 1) % ADLER_MOD
+                    k += 1
+                    if ((b << 16) | a) in sig.table:
+                        window = data[k:k + block]
+                        index = sig.find((b << 16) | a, window)
+                        if index is not None:
+                            break
+                if index is None:
+                    pos = end
+                    roll_skip = min(MAX_ROLL_SKIP, roll_skip * 2 or 1)
+                    skip_left = roll_skip
+                    continue
+                pos = k
+            elif index is None:
+                skip_left -= 1
+                pos += block
+                continue
+
+            yield from flush_literal(pos)
+            if self.hasher is not None:
+                self.hasher.update(window)
+            previous = add_copy(index, block)
+            if previous:
+                yield (OP_COPY, *previous)
+            pos += block
+            literal_start = pos
+            roll_skip = skip_left = 0
+
+        # Короткий последний блок основы совпадает, только если новый файл кончается так же
+        if (sig.tail_index is not None and size - pos == sig.tail_size
+                and strong_checksum(data[pos:size]) == sig.strong[sig.tail_index]):
+            yield from flush_literal(pos)
+            if self.hasher is not None:
+                self.hasher.update(data[pos:size])
+            previous = add_copy(sig.tail_index, sig.tail_size)
+            if previous:
+                yield (OP_COPY, *previous)
+            pos = literal_start = size
+        yield from flush_literal(size)
+        if pending_copy:
+            yield (OP_COPY, *pending_copy)
+
+
+def pack_copy(offset, length):
+    return COPY_HEADER.pack(OP_COPY, offset, length)
+
+
+def pack_literal_header(length):
+    return LITERAL_HEADER.pack(OP_LITERAL, length)
+
+
+def copy_range(base, out, offset, length, base_size, hasher=None):
+    """Скопировать диапазон основы в конец собираемого файла (ValueError, если он вне основы)"""
+    if offset < 0 or length <= 0 or offset + length > base_size:
+        raise ValueError(f"диапазон основы {offset}+{length} вне файла размером {base_size}")
+    base.seek(offset)
+    while length > 0:
+        data = base.read(min(COPY_BUFFER, length))
+        if not data:
+            raise ValueError("основа короче, чем при расчете подписей")
+        if hasher is not None:
+            hasher.update(data)
+        out.write(data)
+        length -= len(data)
+
+
+def apply_delta(stream, base, out, base_size, size, hasher=None):
+    """Собрать новый файл размером size из основы и потока команд (файлы) -> ValueError при ошибке"""
+    written = 0
+    while True:
+        header = stream.read(OP_HEADER.size)
+        if not header:
+            raise ValueError("поток изменений оборван")
+        op = header[0]
+        if op == OP_END:
+            break
+        if op == OP_COPY:
+            rest = stream.read(COPY_HEADER.size - OP_HEADER.size)
+            if len(rest) != COPY_HEADER.size - OP_HEADER.size:
+                raise ValueError("поток изменений оборван")
+            _, offset, length = COPY_HEADER.unpack(header + rest)
+            if written + length > size:
+                raise ValueError("поток изменений длиннее файла")
+            copy_range(base, out, offset, length, base_size, hasher)
+        elif op == OP_LITERAL:
+            rest = stream.read(LITERAL_HEADER.size - OP_HEADER.size)
+            if len(rest) != LITERAL_HEADER.size - OP_HEADER.size:
+                raise ValueError("поток изменений оборван")
+            _, length = LITERAL_HEADER.unpack(header + rest)
+            if written + length > size:
+                raise ValueError("поток изменений длиннее файла")
+            left = length
+            while left > 0:
+                data = stream.read(min(COPY_BUFFER, left))
+                if not data:
+                    raise ValueError("поток изменений оборван")
+                if hasher is not None:
+                    hasher.update(data)
+                out.write(data)
+                left -= len(data)
+        else:
+            raise ValueError(f"неизвестная команда потока изменений: {op}")
+        written += length
+    if written != size:
+        raise ValueError(f"собрано {written} байт вместо {size}")
+    return written
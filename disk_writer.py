@@ -0,0 +1,386 @@
+"""
+Запись принятых файлов на диск в фоне
+Используется TCP и UDP серверами
+
+Прием не ждет диск: данные уходят в очередь FileWriter, а потоки DiskWriter пишут их
+по смещениям. Соседние куски очереди объединяются в одну запись (pwritev), поэтому диск
+получает крупные записи, даже если сеть отдает данные по несколько килобайт.
+Очередь файла ограничена (MAX_PENDING байт): если диск не успевает, прием ждет
+(обратное давление, wait_room) или, как UDP сервер, откладывает данные до повтора (full),
+а не копит их в памяти.
+Место под файл выделяется заранее (preallocate, posix_fallocate): одним куском,
+без роста файла на каждой записи, а нехватка места видна до приема
+
+Файл принимается под временным именем в папке .partial и появляется в папке загрузок
+только проверенным и целым (Committer: жесткая ссылка или переименование). Надежность:
+none - без fsync; file - fsync каждого файла; group - fsync пачкой раз в group_files
+файлов или group_ms мс. Ответ клиенту в file и group идет только после fsync и переноса:
+в пачке одновременные передачи ждут общую фиксацию, а не платят каждая за свою
+"""
+
+import errno
+import os
+import queue
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+DEFAULT_THREADS = 2
+MAX_PENDING = 16 * 1024 * 1024   # байт в очереди одного файла, дальше прием ждет
+MAX_COALESCE = 8 * 1024 * 1024   # байт в одной записи
+MAX_IOV = 64                     # кусков в одном pwritev
+
+# Надежность сохранения принятых файлов (Committer)
+SYNC_NONE = 'none'    # без fsync: после сбоя питания последние файлы могут пропасть
+SYNC_FILE = 'file'    # fsync каждого файла до переименования и папки после
+SYNC_GROUP = 'group'  # fsync пачкой файлов
+SYNC_POLICIES = (SYNC_NONE, SYNC_FILE, SYNC_GROUP)
+GROUP_FILES = 32      # файлов в пачке
+GROUP_MS = 50         # сколько первый файл пачки ждет остальные
+
+
+def preallocate(file, size):
+    """Выделить место под файл размером size (файл не укорачивается) -> OSError при нехватке места
+
+    Если файловая система не умеет fallocate, файл просто растягивается до size
+    """
+    fd = file.fileno()
+    if size <= os.fstat(fd).st_size:
+        return
+    if hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return
+        except OSError as e:
+            if e.errno in (errno.ENOSPC, errno.EFBIG, errno.EDQUOT):
+                raise
+    os.ftruncate(fd, size)
+
+
+def write_vector(file, offset, buffers):
+    """Записать подряд идущие куски с позиции offset одним вызовом, где это возможно"""
+    if hasattr(os, 'pwritev'):
+        fd = file.fileno()
+        buffers = [memoryview(b) for b in buffers]
+        while buffers:
+            written = os.pwritev(fd, buffers, offset)
+            if written <= 0:
+                raise OSError(errno.EIO, "запись на диск не продвигается")
+            offset += written
+            # Частичная запись: отбрасываем записанное и дописываем остаток
+            while buffers and written >= len(buffers[0]):
+                written -= len(buffers[0])
+                buffers.pop(0)
+            if buffers and written:
+                buffers[0] = buffers[0][written:]
+    elif hasattr(os, 'pwrite'):
+        fd = file.fileno()
+        for data in buffers:
+            view = memoryview(data)
+            while view:
+                written = os.pwrite(fd, view, offset)
+                offset += written
+                view = view[written:]
+    else:
+        # Windows: позиционной записи нет, запись идет только из потоков DiskWriter по очереди файла
+        file.seek(offset)
+        for data in buffers:
+            file.write(data)
+        file.flush()
+
+
+class DiskWriter:
+    """Фоновые потоки записи, общие для всех файлов сервера"""
+    def __init__(self, threads=DEFAULT_THREADS):
+        self.jobs = queue.Queue()
+        self.threads = []
+        for index in range(threads):
+            thread = threading.Thread(target=self.run, name=f"disk-writer-{index + 1}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def run(self):
+        while True:
+            writer = self.jobs.get()
+            if writer is None:
+                return
+            writer.drain()
+
+    def stop(self):
+        for _ in self.threads:
+            self.jobs.put(None)
+
+
+class FileWriter:
+    """Очередь записи одного файла
+
+    Файл пишет не больше одного потока DiskWriter за раз, куски - в порядке поступления.
+    pool=None - запись сразу в вызывающем потоке, без фона
+    Ошибка записи (OSError) запоминается и выбрасывается из следующего write/wait_room/flush
+    """
+    def __init__(self, file, pool=None, max_pending=MAX_PENDING):
+        self.file = file
+        self.pool = pool
+        self.max_pending = max_pending
+        self.cond = threading.Condition()
+        self.pending = deque()    # (смещение, данные, буфер для повторного использования или None)
+        self.pending_bytes = 0    # поставлено в очередь и еще не записано
+        self.scheduled = False    # файл ждет потока DiskWriter или пишется
+        self.error = None
+        self.spare = []           # записанные буферы приема, см. take_buffer
+
+    @property
+    def full(self):
+        return self.pending_bytes >= self.max_pending
+
+    def take_buffer(self, size):
+        """Буфер приема: записанный ранее или новый bytearray(size)"""
+        with self.cond:
+            while self.spare:
+                buffer = self.spare.pop()
+                if len(buffer) == size:
+                    return buffer
+        return bytearray(size)
+
+    def write(self, offset, data, buffer=None):
+        """Поставить запись data по смещению offset в очередь
+
+        data не должна меняться до записи. buffer (bytearray под data) вернется в take_buffer
+        """
+        if self.pool is None:
+            write_vector(self.file, offset, [data])
+            if buffer is not None:
+                self.spare.append(buffer)
+            return
+        with self.cond:
+            self.check_error()
+            self.pending.append((offset, data, buffer))
+            self.pending_bytes += len(data)
+            if not self.scheduled:
+                self.scheduled = True
+                self.pool.jobs.put(self)
+
+    def wait_room(self):
+        """Дождаться, пока очередь файла станет меньше max_pending (обратное давление)"""
+        with self.cond:
+            while self.pending_bytes >= self.max_pending and self.error is None:
+                self.cond.wait()
+            self.check_error()
+
+    def flush(self):
+        """Дождаться записи всей очереди"""
+        with self.cond:
+            while self.scheduled and self.error is None:
+                self.cond.wait()
+            self.check_error()
+
+    def check_error(self):
+        if self.error is not None:
+            raise self.error
+
+    def drain(self):
+        """Записать очередь файла (поток DiskWriter)"""
+        while True:
+            with self.cond:
+                if not self.pending or self.error is not None:
+                    self.scheduled = False
+                    self.cond.notify_all()
+                    return
+                # Подряд идущие куски - одной записью
+                offset, data, buffer = self.pending.popleft()
+                run, buffers, size = [data], [buffer], len(data)
+                while (self.pending and len(run) < MAX_IOV and size < MAX_COALESCE
+                       and self.pending[0][0] == offset + size):
+                    _, data, buffer = self.pending.popleft()
+                    run.append(data)
+                    buffers.append(buffer)
+                    size += len(data)
+            try:
+                write_vector(self.file, offset, run)
+            except OSError as e:
+                with self.cond:
+                    self.error = e
+                    self.pending.clear()
+                    self.pending_bytes = 0
+                    self.scheduled = False
+                    self.cond.notify_all()
+                return
+            with self.cond:
+                self.pending_bytes -= size
+                self.spare.extend(b for b in buffers if b is not None)
+                self.cond.notify_all()
+
+
+def sync_file(path):
+    """fsync файла по пути"""
+    fd = os.open(path, os.O_RDWR | getattr(os, 'O_BINARY', 0))
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def sync_directory(path):
+    """fsync папки: переименование в ней переживает сбой питания (на Windows не нужно)"""
+    try:
+        fd = os.open(path, os.O_RDONLY | getattr(os, 'O_DIRECTORY', 0))
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def link_unique(temp_path, directory, safe_name):
+    """Перенести принятый файл temp_path в папку directory под свободным именем -> итоговый путь
+
+    Имя занимается атомарно: os.link не заменяет существующий файл, поэтому одно имя
+    не достанется двум передачам, даже из разных процессов, а файл появляется в папке целым.
+    Без жестких ссылок имя занимается пустым файлом ('xb'), который заменяется принятым
+    """
+    directory = Path(directory)
+    stem, suffix = os.path.splitext(safe_name)
+    path = directory / safe_name
+    counter = 1
+    hardlinks = True
+    while True:
+        try:
+            if hardlinks:
+                os.link(temp_path, path)
+                os.unlink(temp_path)
+            else:
+                open(path, 'xb').close()
+                try:
+                    os.replace(temp_path, path)
+                except OSError:
+                    # Пустой файл, занявший имя, не остается в папке загрузок
+                    os.unlink(path)
+                    raise
+            return path
+        except FileExistsError:
+            path = directory / f"{stem}_{counter}{suffix}"
+            counter += 1
+        except OSError:
+            if not hardlinks:
+                raise
+            hardlinks = False
+
+
+class Committer:
+    """Перенос принятых файлов в папку загрузок по политике надежности (SYNC_*)
+
+    В пачке (SYNC_GROUP) поток фиксации делает fsync данных всех файлов пачки,
+    затем переносит файлы и делает fsync каждой папки один раз
+    """
+    def __init__(self, policy=SYNC_NONE, group_files=GROUP_FILES, group_ms=GROUP_MS):
+        if policy not in SYNC_POLICIES:
+            raise ValueError(f"неизвестная политика надежности: {policy!r}")
+        self.policy = policy
+        self.group_files = max(1, group_files)
+        self.group_delay = group_ms / 1000
+        self.cond = threading.Condition()
+        self.pending = []       # (временный путь, папка, имя, done)
+        self.first_at = 0.0     # когда пришел первый файл пачки
+        self.closing = False
+        self.thread = None
+        if policy == SYNC_GROUP:
+            self.thread = threading.Thread(target=self.run, name="group-commit", daemon=True)
+            self.thread.start()
+
+    def commit(self, temp_path, directory, safe_name):
+        """Перенести принятый файл temp_path в папку directory под свободным именем
+        и дождаться fsync по политике -> итоговый путь (OSError при ошибке)"""
+        finished = threading.Event()
+        result = []
+
+        def done(path, error):
+            result.append((path, error))
+            finished.set()
+        self.commit_async(temp_path, directory, safe_name, done)
+        finished.wait()
+        path, error = result[0]
+        if error is not None:
+            raise error
+        return path
+
+    def commit_async(self, temp_path, directory, safe_name, done):
+        """То же без ожидания: done(путь, None) или done(None, OSError)
+
+        none и file вызывают done сразу, group - из потока фиксации после fsync пачки,
+        поэтому done только передает результат владельцу (например, через очередь)
+        """
+        if self.policy == SYNC_GROUP:
+            with self.cond:
+                if not self.closing:
+                    if not self.pending:
+                        self.first_at = time.monotonic()
+                    self.pending.append((temp_path, directory, safe_name, done))
+                    self.cond.notify_all()
+                    return
+            # Поток фиксации уже остановлен - файл фиксируется сразу
+            self.commit_group([(temp_path, directory, safe_name, done)])
+            return
+        try:
+            if self.policy == SYNC_FILE:
+                sync_file(temp_path)
+            path = link_unique(temp_path, directory, safe_name)
+            if self.policy == SYNC_FILE:
+                sync_directory(directory)
+        except OSError as e:
+            done(None, e)
+            return
+        done(path, None)
+
+    def run(self):
+        while True:
+            with self.cond:
+                while True:
+                    if self.pending:
+                        left = self.first_at + self.group_delay - time.monotonic()
+                        if len(self.pending) >= self.group_files or left <= 0 or self.closing:
+                            break
+                        self.cond.wait(left)
+                    elif self.closing:
+                        return
+                    else:
+                        self.cond.wait()
+                batch, self.pending = self.pending, []
+            self.commit_group(batch)
+
+    def commit_group(self, batch):
+        """Зафиксировать пачку: fsync данных, перенос в папки, fsync папок"""
+        results = []
+        synced = []
+        for temp_path, directory, safe_name, done in batch:
+            try:
+                sync_file(temp_path)
+            except OSError as e:
+                results.append((done, None, e))
+                continue
+            synced.append((temp_path, directory, safe_name, done))
+        directories = set()
+        for temp_path, directory, safe_name, done in synced:
+            try:
+                path = link_unique(temp_path, directory, safe_name)
+            except OSError as e:
+                results.append((done, None, e))
+                continue
+            directories.add(str(directory))
+            results.append((done, path, None))
+        for directory in directories:
+            sync_directory(directory)
+        for done, path, error in results:
+            done(path, error)
+
+    def close(self):
+        """Зафиксировать ожидающие файлы и остановить поток фиксации (остановка сервера)"""
+        if self.thread is None:
+            return
+        with self.cond:
+            self.closing = True
+            self.cond.notify_all()
+        self.thread.join()
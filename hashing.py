@@ -0,0 +1,82 @@
+"""
+Контрольная сумма файла, которая считается по ходу передачи
+Используется TCP и UDP клиентами и серверами
+
+blake2b (32 байта) - по умолчанию: быстрее sha256 на 64-битных процессорах
+sha256, md5 - для сверки с внешними утилитами (sha256sum, md5sum)
+xxh64, xxh3_64, xxh128 - некриптографические и самые быстрые, если установлен модуль xxhash
+"""
+
+import hashlib
+import os
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+DEFAULT_ALGORITHM = 'blake2b'
+READ_BLOCK_SIZE = 1024 * 1024
+
+_ALGORITHMS = {
+    'blake2b': lambda: hashlib.blake2b(digest_size=32),
+    'sha256': hashlib.sha256,
+    'md5': hashlib.md5,
+}
+if xxhash is not None:
+    _ALGORITHMS['xxh64'] = xxhash.xxh64
+    _ALGORITHMS['xxh3_64'] = xxhash.xxh3_64
+    _ALGORITHMS['xxh128'] = xxhash.xxh128
+
+
+def available_algorithms():
+    """Алгоритмы, доступные на этой машине"""
+    return list(_ALGORITHMS)
+
+
+def new_hasher(name=DEFAULT_ALGORITHM):
+    """Новый объект контрольной суммы (update/digest/hexdigest, как в hashlib)"""
+    try:
+        return _ALGORITHMS[name]()
+    except KeyError:
+        raise ValueError(f"неизвестный алгоритм контрольной суммы: {name!r}") from None
+
+
+def choose_algorithm(name, supported):
+    """Алгоритм для передачи: name, если его поддерживает другая сторона, иначе None"""
+    if name and name in supported and name in _ALGORITHMS:
+        return name
+    return None
+
+
+def combine_digests(name, digests):
+    """Сумма файла, переданного частями: сумма сумм частей (hex) по порядку
+
+    Считается без чтения файла - по суммам, посчитанным при передаче частей
+    """
+    hasher = new_hasher(name)
+    for digest in digests:
+        hasher.update(bytes.fromhex(digest))
+    return hasher.hexdigest()
+
+
+def update_from_file(hasher, file, length):
+    """Добавить в контрольную сумму length байт файла с текущей позиции"""
+    while length > 0:
+        block = file.read(min(READ_BLOCK_SIZE, length))
+        if not block:
+            break
+        hasher.update(block)
+        length -= len(block)
+
+
+def update_at(hasher, fd, offset, length):
+    """Добавить в контрольную сумму length байт файла с позиции offset (pread, позиция файла
+    не меняется - пока сумма считается в фоне, тот же файл может уходить через sendfile)"""
+    while length > 0:
+        block = os.pread(fd, min(READ_BLOCK_SIZE, length), offset)
+        if not block:
+            break
+        hasher.update(block)
+        offset += len(block)
+        length -= len(block)
@@ -0,0 +1,127 @@
+"""
+Хранилище файлов по содержимому (без дубликатов) на стороне приема
+Используется TCP и UDP серверами (параметр dedup)
+
+Каждое уникальное содержимое хранится один раз: <папка загрузок>/.store/<алгоритм>/<aa>/<сумма>.
+Файлы в папке загрузок - жесткие ссылки на него, поэтому одинаковые загрузки под разными
+именами не занимают лишнего места, а число ссылок файла - счетчик использований.
+Содержимое без ссылок из папки загрузок удаляется при запуске сервера (collect_garbage)
+
+Файлы хранилища только для чтения: изменение одного имени на месте изменило бы все
+файлы с тем же содержимым. Если файловая система не поддерживает жесткие ссылки,
+файлы копируются - повторная загрузка все равно не передает данные, но место не экономится
+"""
+
+import os
+import shutil
+from pathlib import Path
+
+import hashing
+
+STORE_DIR = '.store'
+
+
+def file_digest(path, algorithm=hashing.DEFAULT_ALGORITHM):
+    """Контрольная сумма файла на диске (hex)"""
+    hasher = hashing.new_hasher(algorithm)
+    with open(path, 'rb') as f:
+        hashing.update_from_file(hasher, f, os.fstat(f.fileno()).st_size)
+    return hasher.hexdigest()
+
+
+class ContentStore:
+    """Содержимое файлов по контрольной сумме algorithm"""
+    def __init__(self, root, algorithm=hashing.DEFAULT_ALGORITHM):
+        self.algorithm = algorithm
+        self.root = Path(root) / algorithm
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.hardlinks = self.probe_hardlinks()
+
+    def probe_hardlinks(self):
+        """Поддерживает ли файловая система жесткие ссылки"""
+        probe = self.root / f".probe.{os.getpid()}"
+        probe_link = self.root / f".probe.{os.getpid()}.link"
+        try:
+            probe.touch()
+            os.link(probe, probe_link)
+            os.unlink(probe_link)
+            return True
+        except OSError:
+            return False
+        finally:
+            if probe.exists():
+                probe.unlink()
+
+    def blob_path(self, digest):
+        """Путь содержимого по сумме (ValueError, если сумма не hex)"""
+        digest = str(digest).lower()
+        if len(digest) < 8 or len(digest) > 128 or any(c not in '0123456789abcdef' for c in digest):
+            raise ValueError(f"некорректная контрольная сумма: {digest!r}")
+        return self.root / digest[:2] / digest
+
+    def lookup(self, digest, size):
+        """Путь содержимого с такой суммой и размером или None"""
+        try:
+            blob = self.blob_path(digest)
+            if blob.stat().st_size == size:
+                return blob
+        except (OSError, ValueError):
+            pass
+        return None
+
+    def link(self, blob, path):
+        """Сделать path (файл в папке загрузок, может уже существовать) ссылкой на содержимое"""
+        tmp_path = path.with_name(f".{path.name}.link")
+        if self.hardlinks:
+            os.link(blob, tmp_path)
+        else:
+            shutil.copyfile(blob, tmp_path)
+        os.replace(tmp_path, path)
+
+    def add(self, path, hasher=None):
+        """Добавить принятый файл в хранилище -> True, если такое содержимое уже было
+
+        hasher - сумма, посчитанная при приеме: если алгоритм тот же, файл не перечитывается.
+        Повторное содержимое заменяет файл ссылкой, и место его копии освобождается
+        """
+        if hasher is not None and getattr(hasher, 'name', None) == self.algorithm:
+            digest = hasher.hexdigest()
+        else:
+            digest = file_digest(path, self.algorithm)
+        blob = self.blob_path(digest)
+        size = path.stat().st_size
+        if self.lookup(digest, size) is not None:
+            self.link(blob, path)
+            return True
+
+        blob.parent.mkdir(exist_ok=True)
+        try:
+            if self.hardlinks:
+                os.link(path, blob)
+            else:
+                shutil.copyfile(path, blob)
+        except FileExistsError:
+            # То же содержимое одновременно добавил другой процесс TCPServerPool.
+            # Другой размер под той же суммой - поврежденное хранилище, файл остается сам по себе
+            if self.lookup(digest, size) is None:
+                return False
+            self.link(blob, path)
+            return True
+        os.chmod(blob, 0o444)
+        return False
+
+    def collect_garbage(self):
+        """Удалить содержимое, на которое не ссылается ни один файл -> сколько удалено"""
+        if not self.hardlinks:
+            # Копии не считают ссылки - неизвестно, что еще используется
+            return 0
+        removed = 0
+        for blob in self.root.glob('*/*'):
+            try:
+                if blob.stat().st_nlink == 1:
+                    os.chmod(blob, 0o644)
+                    blob.unlink()
+                    removed += 1
+            except OSError:
+                pass
+        return removed
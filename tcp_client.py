@@ -1,16 +1,79 @@
+import mmap
 import socket
-import struct
 import os
 import sys
+import threading
+from collections import deque
+
+import compression
+import delta
+import hashing
+import tcp_protocol as proto
+
+# Параллельная передача: файлы меньше streams * PARALLEL_MIN_RANGE идут одним потоком
+PARALLEL_MIN_RANGE = 4 * 1024 * 1024
+RANGE_ALIGN = 64 * 1024
+# Файлы от этого размера отправляются с докачкой (resume=True)
+RESUME_MIN_SIZE = 16 * 1024 * 1024
+# С progress_callback sendfile вызывается частями такого размера
+PROGRESS_STEP = 4 * 1024 * 1024
+# Блок чтения, когда данные по пути в сокет попадают в контрольную сумму
+HASH_BLOCK_SIZE = 256 * 1024
+# С контрольной суммой диапазоны докачки идут частями такого размера с границами, кратными ему:
+# сервер отмечает в журнале только сверенные части, при обрыве повторяется не больше части,
+# а сумма файла - сумма сумм частей (те же части при любой докачке)
+CHECKSUM_PIECE = 16 * 1024 * 1024
+# dedup: файлы меньше этого размера отправляются сразу - OFFER сэкономил бы меньше, чем стоит
+DEDUP_MIN_SIZE = 64 * 1024
+# delta: если новых данных больше этой доли файла, он отправляется целиком
+DELTA_MAX_LITERAL = 0.5
 
 class TCPClientSimple:
-    def __init__(self, server_host='localhost', server_port=8888):
+    def __init__(self, server_host='localhost', server_port=8888, use_sendfile=True,
+                 pipeline=32, hello_timeout=5.0, streams=1, progress_callback=None, resume=True,
+                 checksum=hashing.DEFAULT_ALGORITHM, compress=compression.AUTO, dedup=False, delta=False):
         self.server_host = server_host
         self.server_port = server_port
+        self.client_socket = None
+        # sendfile: ядро передает файл из кэша страниц прямо в сокет, без копий в Python.
+        # False - старый цикл read/send (для сравнения, см. benchmark.py)
+        self.use_sendfile = use_sendfile
+        # Сессия (send_files): сколько файлов отправляется, не дожидаясь их STATUS
+        self.pipeline = pipeline
+        # Сколько ждать ответа на HELLO, прежде чем считать сервер старым
+        self.hello_timeout = hello_timeout
+        # Число параллельных соединений для одного большого файла (1 - одно соединение)
+        self.streams = max(1, streams)
+        # Докачка больших файлов: после обрыва повторная отправка продолжает с принятого
+        self.resume = resume
+        # progress_callback(отправлено, всего) - вызывается по ходу отправки (из потоков отправки)
+        self.progress_callback = progress_callback
+        # Контрольная сумма файла (см. hashing.py), None - только проверка размера.
+        # Передается в сессии, если алгоритм есть у сервера; данные тогда читаются
+        # блоками и хэшируются по пути в сокет вместо sendfile
+        self.checksum = checksum
+        self.session_checksum = None  # алгоритм, согласованный в HELLO_ACK
+        # Сжатие на лету (см. compression.py): AUTO - лучший алгоритм, который есть у сервера,
+        # имя - только он, None - без сжатия. Несжимаемые файлы отправляются как есть
+        self.compress = compress
+        self.session_compression = None
+        self.server_caps = 0  # возможности сервера из HELLO_ACK (proto.CAP_*)
+        # Без дубликатов: перед отправкой файл хэшируется и сумма предлагается серверу
+        # с хранилищем (CAP_DEDUP). Файл, который у сервера уже есть, не передается.
+        # Стоит лишнего чтения файла, поэтому включается для повторяющихся загрузок
+        self.dedup = dedup
+        self.session_dedup = None  # алгоритм суммы хранилища сервера
+        # Передача изменений (delta.py): если у сервера есть прежняя версия файла с тем же
+        # именем, отправляются только новые данные и ссылки на блоки прежней версии.
+        # Стоит запроса подписей и лишнего чтения файла, поэтому включается для файлов,
+        # которые отправляются повторно с небольшими правками
+        self.delta = delta
     
     def connect(self):
         try:
             self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            # Кадры сессии маленькие и идут подряд (FILE, данные, DIGEST) - без задержки Нейгла
+            self.client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
             self.client_socket.connect((self.server_host, self.server_port))
             return True
         except Exception:
@@ -21,22 +84,38 @@ class TCPClientSimple:
             print(f"Файл не найден: {file_path}")
             return False
         
+        try:
+            file_size = os.path.getsize(file_path)
+            
+            if ((self.streams > 1 and file_size >= 2 * PARALLEL_MIN_RANGE)
+                    or (self.resume and file_size >= RESUME_MIN_SIZE)):
+                return self.send_file_ranges(file_path)
+            if (self.checksum or self.compress or self.dedup or self.delta
+                    or file_size > proto.MAX_LEGACY_FILE_SIZE):
+                # Контрольная сумма, сжатие, OFFER, изменения и файлы больше 4 ГБ - только в сессии
+                return self.send_files([file_path])[0]
+            return self.send_file_legacy(file_path)
+        
+        except Exception as e:
+            print(f"Ошибка: {e}")
+            return False
+    
+    def send_file_legacy(self, file_path):
+        """Один файл на соединение по старому протоколу (сервер проверяет только размер)"""
         try:
             file_name = os.path.basename(file_path)
             file_size = os.path.getsize(file_path)
             
             print(f"Отправка файла: {file_name} ({file_size} байт)")
             
-            header = struct.pack('I', file_size)
-            name_encoded = file_name.encode('utf-8').ljust(64, b'\0')
-            self.client_socket.send(header + name_encoded)
+            self.client_socket.sendall(proto.pack_legacy_header(file_size, file_name))
             
             with open(file_path, 'rb') as file:
-                while True:
-                    chunk = file.read(4096)
-                    if not chunk:
-                        break
-                    self.client_socket.send(chunk)
+                sent = self.send_body(file, file_size, report=self.progress_reporter(file_size))
+            
+            if sent != file_size:
+                print(f"Ошибка: отправлено {sent} из {file_size} байт")
+                return False
             
             response = self.client_socket.recv(1024)
             if response == b"SUCCESS":
@@ -50,20 +129,581 @@ class TCPClientSimple:
             print(f"Ошибка: {e}")
             return False
     
+    def send_file_ranges(self, file_path):
+        """Отправить файл диапазонами байт с докачкой, по streams параллельным соединениям
+        
+        Сначала сервер сообщает (QUERY), каких байт у него еще нет: после обрыва
+        повторная отправка того же файла продолжается с принятого. Недостающие
+        байты делятся между streams соединениями; сервер переносит файл в папку
+        загрузок, только когда получены все. Первый поток использует уже открытое
+        соединение; если сервер не поддерживает сессии, файл уходит по старому
+        протоколу одним потоком
+        """
+        file_name = os.path.basename(file_path)
+        stat = os.stat(file_path)
+        file_size = stat.st_size
+        transfer_id = proto.transfer_id_for(file_name, file_size, stat.st_mtime_ns)
+        
+        if not self.client_socket and not self.connect():
+            print("Не удалось подключиться к серверу")
+            return False
+        if not self.open_session():
+            print("Сервер не поддерживает сессии, отправка одним потоком")
+            self.disconnect()
+            if not self.connect():
+                return False
+            return self.send_file_legacy(file_path)
+        if not self.size_supported(file_size):
+            self.disconnect()
+            return False
+        
+        report = self.progress_reporter(file_size)
+        try:
+            if self.offer_file(file_path, file_name, file_size) or self.send_delta(file_path, file_name, file_size):
+                self.client_socket.sendall(proto.pack_frame(proto.FRAME_BYE))
+                if report:
+                    report(file_size)
+                return True
+            # С контрольной суммой сервер собирает файл по пустому диапазону с суммой всего
+            # файла (file_digest): ее дают суммы частей, посчитанные по ходу отправки
+            digests = {} if self.session_checksum else None
+            # MISSING содержит не больше MAX_MISSING_RANGES диапазонов - остальное следующим кругом,
+            # последний круг с суммой файла только собирает файл
+            for round_number in range(4):
+                query = {'tid': transfer_id, 'name': file_name, 'size': file_size}
+                if digests is not None:
+                    query['checksum'] = self.session_checksum  # принятыми считаются только сверенные части
+                self.client_socket.sendall(proto.pack_frame(proto.FRAME_QUERY, query))
+                frame = self.recv_frame()
+                if frame is None or frame[0] != proto.FRAME_MISSING:
+                    raise ConnectionError("сервер не ответил на запрос докачки")
+                have, missing = frame[1]['have'], frame[1]['missing']
+        
+                if round_number == 0:
+                    if have:
+                        print(f"Сервер уже получил {have} из {file_size} байт, докачка")
+                        if report:
+                            report(have)
+                    print(f"Отправка файла: {file_name} ({file_size} байт)")
+        
+                # Пустой диапазон: все уже принято, сервер только соберет файл
+                piece = CHECKSUM_PIECE if digests is not None else None
+                buckets = split_ranges(missing, self.streams, piece) or [[(0, 0)]]
+                if len(buckets) > 1:
+                    print(f"Параллельных соединений: {len(buckets)}")
+                results = self.send_buckets(file_path, transfer_id, file_size, buckets, report, digests)
+        
+                if 'committed' in results:
+                    self.client_socket.sendall(proto.pack_frame(proto.FRAME_BYE))
+                    print("Файл успешно отправлен")
+                    return True
+                if None in results:
+                    break
+        except Exception as e:
+            print(f"Ошибка: {e}")
+        
+        print("Ошибка при отправке (принятая сервером часть сохранена для докачки)")
+        return False
+    
+    def send_buckets(self, file_path, transfer_id, file_size, buckets, report, digests=None):
+        """Отправить группы диапазонов, каждую по своему соединению -> результаты send_range
+        
+        Диапазон, не дошедший с первого раза, отправляется повторно по новому соединению.
+        digests - словарь смещение -> сумма принятого сервером диапазона (см. send_range)
+        """
+        results = []
+        
+        def run_stream(index, pieces):
+            stream = self if index == 0 else TCPClientSimple(
+                self.server_host, self.server_port, use_sendfile=self.use_sendfile,
+                hello_timeout=self.hello_timeout, checksum=self.checksum, compress=self.compress)
+            for offset, length in pieces:
+                result = None
+                for attempt in range(2):
+                    try:
+                        if attempt > 0 or stream.client_socket is None:
+                            stream.disconnect()
+                            if not stream.connect() or not stream.open_session():
+                                continue
+                        result = stream.send_range(file_path, transfer_id, file_size, offset, length, report,
+                                                   digests)
+                        break
+                    except Exception as e:
+                        # Соединение брошено посреди данных диапазона - больше по нему ничего не шлем
+                        print(f"Ошибка потока {index + 1}: {e}")
+                        stream.disconnect()
+                results.append(result)
+                if result is None:
+                    break
+            if index > 0:
+                if stream.client_socket:
+                    try:
+                        stream.client_socket.sendall(proto.pack_frame(proto.FRAME_BYE))
+                    except OSError:
+                        pass
+                stream.disconnect()
+        
+        threads = [threading.Thread(target=run_stream, args=(i, pieces))
+                   for i, pieces in enumerate(buckets)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+    
+    def send_range(self, file_path, transfer_id, file_size, offset, length, report=None, digests=None):
+        """Отправить один диапазон по открытой сессии -> 'committed', 'ok' или None
+        
+        Сумма диапазона, принятого сервером, запоминается в digests[offset]. Пустой диапазон
+        с контрольной суммой просит сервер собрать файл: в DIGEST вместо суммы диапазона
+        идет сумма всего файла (file_digest)
+        """
+        with open(file_path, 'rb') as file:
+            body = {
+                'tid': transfer_id, 'name': os.path.basename(file_path),
+                'size': file_size, 'offset': offset, 'length': length,
+            }
+            hasher = self.start_checksum(body)
+            codec = self.start_compression(body, file_path)
+            self.client_socket.sendall(proto.pack_frame(proto.FRAME_RANGE, body))
+            sent = self.send_body(file, length, offset, report, hasher, codec)
+        if sent != length:
+            raise ConnectionError(f"отправлено {sent} из {length} байт диапазона")
+        if hasher is not None and not length and digests is not None:
+            digest = self.file_digest(file_path, file_size, digests)
+            self.client_socket.sendall(proto.pack_frame(proto.FRAME_DIGEST, {'digest': digest}))
+        else:
+            self.send_digest(hasher)
+        
+        frame = self.recv_frame()
+        if frame is None or frame[0] != proto.FRAME_STATUS:
+            raise ConnectionError("сервер закрыл сессию")
+        if frame[1].get('status') != 'SUCCESS':
+            return None
+        if hasher is not None and length and digests is not None:
+            digests[offset] = hasher.hexdigest()
+        return 'committed' if frame[1].get('committed') else 'ok'
+    
+    def send_body(self, file, file_size, offset=0, report=None, hasher=None, codec=None):
+        """Отправить file_size байт открытого файла начиная с offset -> число отправленных байт
+        
+        report(n) - вызывается после каждой отправленной части (см. progress_reporter).
+        hasher - обновляется отправленными данными (за то же чтение файла).
+        codec - алгоритм сжатия: данные идут блоками compression.encode_block
+        """
+        if codec is not None:
+            file.seek(offset)
+            sent = 0
+            while sent < file_size:
+                chunk = file.read(min(compression.BLOCK_SIZE, file_size - sent))
+                if not chunk:
+                    break
+                if hasher is not None:
+                    hasher.update(chunk)
+                self.client_socket.sendall(compression.encode_block(codec, chunk))
+                sent += len(chunk)
+                if report:
+                    report(len(chunk))
+            return sent
+        
+        if self.use_sendfile and hasher is None:
+            return self.send_with_sendfile(file, file_size, offset, report)
+        if self.use_sendfile and hasattr(os, 'pread'):
+            # Сумма той же части файла считается в фоне (pread), а данные все равно идут
+            # через sendfile, минуя Python. Компромисс: часть читается дважды - ядром для
+            # sendfile и pread для суммы, второе чтение обычно попадает в кэш страниц.
+            # use_sendfile=False - одно чтение на отправку и сумму
+            thread = threading.Thread(target=hashing.update_at, args=(hasher, file.fileno(), offset, file_size),
+                                      daemon=True)
+            thread.start()
+            try:
+                return self.send_with_sendfile(file, file_size, offset, report)
+            finally:
+                thread.join()
+        
+        file.seek(offset)
+        block_size = 4096 if hasher is None else HASH_BLOCK_SIZE
+        sent = 0
+        while sent < file_size:
+            chunk = file.read(min(block_size, file_size - sent))
+            if not chunk:
+                break
+            if hasher is not None:
+                hasher.update(chunk)
+            self.client_socket.sendall(chunk)
+            sent += len(chunk)
+            if report:
+                report(len(chunk))
+        return sent
+    
+    def send_with_sendfile(self, file, file_size, offset, report):
+        """Отправить часть файла через sendfile -> число отправленных байт"""
+        # socket.sendfile сам откатывается на send, если os.sendfile недоступен
+        if report is None:
+            return self.client_socket.sendfile(file, offset, file_size) if file_size else 0
+        sent = 0
+        while sent < file_size:
+            count = self.client_socket.sendfile(file, offset + sent, min(PROGRESS_STEP, file_size - sent))
+            if not count:
+                break
+            sent += count
+            report(count)
+        return sent
+    
+    def file_digest(self, file_path, file_size, digests):
+        """Сумма всего файла для сборки из диапазонов: сумма сумм частей по CHECKSUM_PIECE
+        
+        digests - суммы частей, отправленных в этой попытке (посчитаны по ходу отправки).
+        Части, принятые сервером в прошлых попытках, сейчас не отправлялись - они читаются здесь
+        """
+        starts = range(0, file_size, CHECKSUM_PIECE)
+        with open(file_path, 'rb') as file:
+            for start in starts:
+                if start not in digests:
+                    hasher = hashing.new_hasher(self.session_checksum)
+                    file.seek(start)
+                    hashing.update_from_file(hasher, file, min(CHECKSUM_PIECE, file_size - start))
+                    digests[start] = hasher.hexdigest()
+        return hashing.combine_digests(self.session_checksum, [digests[start] for start in starts])
+    
+    def start_checksum(self, body):
+        """Отметить в теле кадра FILE/RANGE алгоритм контрольной суммы -> объект суммы или None"""
+        if not self.session_checksum:
+            return None
+        body['checksum'] = self.session_checksum
+        return hashing.new_hasher(self.session_checksum)
+    
+    def start_compression(self, body, file_path):
+        """Отметить в теле кадра FILE/RANGE алгоритм сжатия -> алгоритм или None
+        
+        Сжимаются только файлы, пробы которых сжимаются (не фото, видео, архивы)
+        """
+        if not self.session_compression or not compression.is_compressible(file_path, self.session_compression):
+            return None
+        body['compression'] = self.session_compression
+        return self.session_compression
+    
+    def send_digest(self, hasher):
+        """Кадр DIGEST после данных файла или диапазона"""
+        if hasher is not None:
+            self.client_socket.sendall(proto.pack_frame(proto.FRAME_DIGEST, {'digest': hasher.hexdigest()}))
+    
+    def progress_reporter(self, total):
+        """Функция report(n) для send_body, передающая общий прогресс в progress_callback
+        
+        Одна функция может вызываться из нескольких потоков (параллельная передача)
+        """
+        if self.progress_callback is None:
+            return None
+        lock = threading.Lock()
+        done = [0]
+        
+        def report(count):
+            with lock:
+                done[0] = min(total, done[0] + count)
+                value = done[0]
+            self.progress_callback(value, total)
+        return report
+    
+    def send_files(self, file_paths):
+        """Отправить несколько файлов по одному соединению -> список True/False по файлам
+        
+        Файлы идут друг за другом без ожидания ответа на каждый (не больше
+        pipeline неподтвержденных), сервер отвечает STATUS на каждый файл.
+        Старый сервер без поддержки сессий получает файлы по одному на соединение
+        """
+        results = [False] * len(file_paths)
+        if not self.client_socket and not self.connect():
+            print("Не удалось подключиться к серверу")
+            return results
+        
+        if not self.open_session():
+            print("Сервер не поддерживает сессии, отправка по одному файлу на соединение")
+            self.disconnect()
+            for index, file_path in enumerate(file_paths):
+                if self.connect():
+                    results[index] = self.send_file_legacy(file_path)
+                self.disconnect()
+            return results
+        
+        waiting = deque()  # (номер, имя) файлов, для которых ждем STATUS
+        report = self.progress_reporter(sum(os.path.getsize(p) for p in file_paths if os.path.isfile(p)))
+        try:
+            for index, file_path in enumerate(file_paths):
+                if not os.path.isfile(file_path):
+                    print(f"Файл не найден: {file_path}")
+                    continue
+                file_size = os.path.getsize(file_path)
+                if not self.size_supported(file_size):
+                    continue
+                if (self.offer_file(file_path, os.path.basename(file_path), file_size, waiting, results)
+                        or self.send_delta(file_path, os.path.basename(file_path), file_size, waiting, results, report)):
+                    results[index] = True
+                    if report:
+                        report(file_size)
+                    continue
+                
+                while len(waiting) >= self.pipeline:
+                    self.read_status(waiting, results)
+                
+                with open(file_path, 'rb') as file:
+                    file_name = os.path.basename(file_path)
+                    file_size = os.fstat(file.fileno()).st_size
+                    print(f"Отправка файла: {file_name} ({file_size} байт)")
+                    
+                    body = {'name': file_name, 'size': file_size}
+                    hasher = self.start_checksum(body)
+                    codec = self.start_compression(body, file_path)
+                    if codec:
+                        print(f"  Сжатие: {codec}")
+                    self.client_socket.sendall(proto.pack_frame(proto.FRAME_FILE, body))
+                    sent = self.send_body(file, file_size, report=report, hasher=hasher, codec=codec)
+                
+                if sent != file_size:
+                    # Сервер ждет ровно file_size байт - продолжать сессию нельзя
+                    raise ConnectionError(f"отправлено {sent} из {file_size} байт")
+                self.send_digest(hasher)
+                waiting.append((index, file_name))
+            
+            while waiting:
+                self.read_status(waiting, results)
+            self.client_socket.sendall(proto.pack_frame(proto.FRAME_BYE))
+        except Exception as e:
+            print(f"Ошибка: {e}")
+        finally:
+            self.disconnect()
+        
+        print(f"Отправлено файлов: {sum(results)}/{len(file_paths)}")
+        return results
+    
+    def open_session(self):
+        """HELLO -> HELLO_ACK. False, если сервер не ответил (старый протокол)"""
+        try:
+            self.client_socket.sendall(proto.pack_hello(proto.SUPPORTED_CAPS))
+            self.client_socket.settimeout(self.hello_timeout)
+            try:
+                frame = self.recv_frame()
+            finally:
+                self.client_socket.settimeout(None)
+        except (socket.timeout, OSError, ValueError):
+            return False
+        if frame is None or frame[0] != proto.FRAME_HELLO_ACK:
+            return False
+        self.server_caps = frame[1].get('caps', 0)
+        self.session_dedup = None
+        if self.dedup and self.server_caps & proto.CAP_DEDUP:
+            self.session_dedup = hashing.choose_algorithm(frame[1].get('dedup'), hashing.available_algorithms())
+        self.session_checksum = hashing.choose_algorithm(self.checksum, frame[1].get('checksums', ()))
+        self.session_compression = compression.choose_algorithm(self.compress, frame[1].get('compression', ()))
+        return True
+    
+    def offer_file(self, file_path, file_name, file_size, waiting=None, results=None):
+        """OFFER: есть ли у сервера файл с такой суммой -> True, если данные отправлять не нужно
+        
+        Ответ приходит после STATUS уже отправленных файлов (waiting), поэтому они дочитываются
+        """
+        if self.session_dedup is None or file_size < DEDUP_MIN_SIZE:
+            return False
+        hasher = hashing.new_hasher(self.session_dedup)
+        with open(file_path, 'rb') as file:
+            hashing.update_from_file(hasher, file, file_size)
+        self.client_socket.sendall(proto.pack_frame(proto.FRAME_OFFER, {
+            'name': file_name, 'size': file_size, 'checksum': self.session_dedup, 'digest': hasher.hexdigest(),
+        }))
+        while waiting:
+            self.read_status(waiting, results)
+        frame = self.recv_frame()
+        if frame is None or frame[0] != proto.FRAME_OFFER_ACK:
+            raise ConnectionError("сервер не ответил на OFFER")
+        if frame[1].get('have'):
+            print(f"Файл уже есть на сервере, данные не отправлялись: {file_name} ({file_size} байт)")
+            return True
+        return False
+    
+    def send_delta(self, file_path, file_name, file_size, waiting=None, results=None, report=None):
+        """Отправить только изменения относительно версии на сервере -> True, если файл собран сервером
+        
+        False - прежней версии нет, изменений слишком много или сервер не собрал файл:
+        тогда файл отправляется как обычно по той же сессии
+        """
+        if not self.delta or not self.server_caps & proto.CAP_DELTA or file_size < delta.DELTA_MIN_SIZE:
+            return False
+        self.client_socket.sendall(proto.pack_frame(proto.FRAME_SIGNATURE_REQ, {'name': file_name}))
+        while waiting:
+            self.read_status(waiting, results)
+        frame = self.recv_frame()
+        if frame is None or frame[0] != proto.FRAME_SIGNATURE:
+            raise ConnectionError("сервер не ответил на запрос подписей")
+        info = frame[1]
+        if not info.get('base'):
+            return False
+        entries = self.recv_exact(info['count'] * delta.SIGNATURE_ENTRY.size)
+        if entries is None:
+            raise ConnectionError("сервер закрыл сессию")
+        signature = delta.Signature(info['block'], info['size'], entries)
+        
+        body = {'name': file_name, 'size': file_size, 'base': info['base'],
+                'base_size': info['size'], 'tag': info['tag']}
+        hasher = self.start_checksum(body)
+        with open(file_path, 'rb') as file:
+            # Сначала команды считаются целиком: отправлять изменения стоит, только если их мало
+            encoder = delta.DeltaEncoder(signature, hasher)
+            with mmap.mmap(file.fileno(), file_size, access=mmap.ACCESS_READ) as data:
+                ops = list(encoder.ops(data))
+            if encoder.literal_bytes > file_size * DELTA_MAX_LITERAL:
+                print(f"Файл {file_name} сильно изменился, отправка целиком")
+                return False
+            codec = self.start_compression(body, file_path) if encoder.literal_bytes else None
+            print(f"Отправка изменений: {file_name} ({file_size} байт), новых данных "
+                  f"{encoder.literal_bytes} байт, остальное из {info['base']}")
+            self.client_socket.sendall(proto.pack_frame(proto.FRAME_DELTA, body))
+            pending = bytearray()  # команды COPY копятся и уходят вместе
+            for op, offset, length in ops:
+                if op == delta.OP_COPY:
+                    pending += delta.pack_copy(offset, length)
+                    if report:
+                        report(length)
+                    continue
+                pending += delta.pack_literal_header(length)
+                self.client_socket.sendall(pending)
+                pending.clear()
+                sent = self.send_body(file, length, offset, report, None, codec)
+                if sent != length:
+                    raise ConnectionError(f"отправлено {sent} из {length} байт изменений")
+            pending += delta.OP_HEADER.pack(delta.OP_END)
+            self.client_socket.sendall(pending)
+        self.send_digest(hasher)
+        
+        frame = self.recv_frame()
+        if frame is None or frame[0] != proto.FRAME_STATUS:
+            raise ConnectionError("сервер закрыл сессию")
+        if frame[1].get('status') == 'SUCCESS':
+            print(f"Файл успешно отправлен: {file_name}")
+            return True
+        print(f"Сервер не собрал {file_name} из изменений, отправка целиком")
+        return False
+    
+    def size_supported(self, file_size):
+        """Примет ли сервер сессии файл такого размера (больше 4 ГБ - только с CAP_LARGE_FILES)"""
+        if file_size <= proto.MAX_LEGACY_FILE_SIZE or self.server_caps & proto.CAP_LARGE_FILES:
+            return True
+        print(f"Сервер не поддерживает файлы больше 4 ГБ ({file_size} байт)")
+        return False
+    
+    def read_status(self, waiting, results):
+        """Дождаться STATUS самого старого неподтвержденного файла"""
+        frame = self.recv_frame()
+        if frame is None or frame[0] != proto.FRAME_STATUS:
+            raise ConnectionError("сервер закрыл сессию")
+        index, file_name = waiting.popleft()
+        if frame[1].get('status') == 'SUCCESS':
+            results[index] = True
+            print(f"Файл успешно отправлен: {file_name}")
+        else:
+            print(f"Ошибка при отправке: {file_name}")
+    
+    def recv_frame(self):
+        """Кадр сессии -> (тип, тело) или None, если соединение закрыто"""
+        header = self.recv_exact(proto.FRAME_HEADER.size)
+        if header is None:
+            return None
+        kind, length = proto.FRAME_HEADER.unpack(header)
+        if length > proto.MAX_FRAME_BODY:
+            raise ValueError(f"слишком длинный кадр: {length} байт")
+        payload = self.recv_exact(length) if length else b''
+        if payload is None:
+            return None
+        return kind, proto.parse_frame_body(payload)
+    
+    def recv_exact(self, n):
+        """Получить точно n байт (None, если соединение закрыто)"""
+        data = bytearray()
+        while len(data) < n:
+            chunk = self.client_socket.recv(n - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return bytes(data)
+    
     def disconnect(self):
         if self.client_socket:
             self.client_socket.close()
+            self.client_socket = None
+
+def split_ranges(missing, streams, max_piece=None):
+    """Недостающие диапазоны [start, end) -> группы (смещение, длина), по одной на соединение
+    
+    Соединений не больше streams и не больше, чем по PARALLEL_MIN_RANGE байт на каждое.
+    max_piece - диапазоны не длиннее и не пересекают границ, кратных max_piece (части
+    одни и те же при любой докачке); соединение отправляет свои подряд
+    """
+    total = sum(end - start for start, end in missing)
+    if not total:
+        return []
+    count = max(1, min(streams, total // PARALLEL_MIN_RANGE))
+    piece_size = -(-total // count)
+    piece_size = -(-piece_size // RANGE_ALIGN) * RANGE_ALIGN
+    if max_piece:
+        piece_size = max_piece
+    
+    pieces = []
+    for start, end in missing:
+        while start < end:
+            length = min(piece_size - start % piece_size if max_piece else piece_size, end - start)
+            pieces.append((start, length))
+            start += length
+    return [pieces[i::count] for i in range(min(count, len(pieces)))]
+
+def collect_files(paths):
+    """Пути файлов и папок -> список файлов (из папки берутся файлы верхнего уровня)"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                         if os.path.isfile(os.path.join(path, name)))
+        else:
+            files.append(path)
+    return files
+
+def menu(client):
+    """Интерактивное меню отправки"""
+    while True:
+        print("\n1. Отправить файл")
+        print("2. Отправить несколько файлов или папку (одно соединение)")
+        print("3. Выход")
+        choice = input("Выбор: ")
+        
+        if choice == "1":
+            file_path = input("Путь к файлу: ")
+            if client.connect():
+                client.send_file(file_path)
+                client.disconnect()
+            else:
+                print("Не удалось подключиться")
+        
+        elif choice == "2":
+            paths = input("Пути через ';' (файлы или папки): ").split(';')
+            files = collect_files([p.strip() for p in paths if p.strip()])
+            if files:
+                client.send_files(files)
+            else:
+                print("Нет файлов для отправки")
+        
+        elif choice == "3":
+            break
 
 def main():
-    if len(sys.argv) == 4:
-        # Использование: python tcp_client_simple.py сервер порт файл
+    if len(sys.argv) >= 4:
+        # Использование: python tcp_client_simple.py сервер порт файл [файл или папка ...]
         host = sys.argv[1]
         port = int(sys.argv[2])
-        file_path = sys.argv[3]
+        files = collect_files(sys.argv[3:])
         
         client = TCPClientSimple(server_host=host, server_port=port)
-        if client.connect():
-            client.send_file(file_path)
+        if len(files) > 1:
+            client.send_files(files)
+        elif client.connect():
+            client.send_file(files[0] if files else sys.argv[3])
             client.disconnect()
         else:
             print("Не удалось подключиться к серверу")
@@ -74,46 +714,18 @@ def main():
         port = int(sys.argv[2])
         
         client = TCPClientSimple(server_host=host, server_port=port)
-        
-        while True:
-            print("\n1. Отправить файл")
-            print("2. Выход")
-            choice = input("Выбор: ")
-            
-            if choice == "1":
-                file_path = input("Путь к файлу: ")
-                if client.connect():
-                    client.send_file(file_path)
-                    client.disconnect()
-                else:
-                    print("Не удалось подключиться")
-            
-            elif choice == "2":
-                break
+        menu(client)
     
     else:
         # Интерактивный режим
         host = input("Адрес сервера [localhost]: ").strip() or "localhost"
         port_input = input("Порт [8888]: ").strip()
         port = int(port_input) if port_input else 8888
+        streams_input = input("Параллельных соединений для больших файлов [1]: ").strip()
+        streams = int(streams_input) if streams_input else 1
         
-        client = TCPClientSimple(server_host=host, server_port=port)
-        
-        while True:
-            print("\n1. Отправить файл")
-            print("2. Выход")
-            choice = input("Выбор: ")
-            
-            if choice == "1":
-                file_path = input("Путь к файлу: ")
-                if client.connect():
-                    client.send_file(file_path)
-                    client.disconnect()
-                else:
-                    print("Не удалось подключиться")
-            
-            elif choice == "2":
-                break
+        client = TCPClientSimple(server_host=host, server_port=port, streams=streams)
+        menu(client)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,134 @@
+"""
+Общие константы и форматы TCP протокола
+Используется и клиентом (tcp_client.py), и сервером (tcp_server.py)
+
+Старый протокол: один файл на соединение, не больше 4 ГБ
+    клиент -> 68 байт: размер '<I' + имя (64 байта, дополнено нулями), затем данные
+    сервер -> b'SUCCESS' или b'ERROR'
+
+Сессия (протокол v2): много файлов по одному соединению
+    клиент -> 68 байт HELLO (маркер 0xFFFFFFFF на месте размера + сигнатура)
+    сервер -> кадр HELLO_ACK
+    клиент -> кадр FILE {name, size}, затем size байт данных   (повторяется)
+    сервер -> кадр STATUS {status, name} на каждый файл, по порядку
+    клиент -> кадр BYE
+    Возможности (caps): клиент перечисляет свои биты CAP_* в HELLO, сервер возвращает
+    в HELLO_ACK {caps} те, что поддерживает сам. Размеры в кадрах - числа JSON без
+    ограничения, но файлы больше 4 ГБ клиент отправляет только при CAP_LARGE_FILES
+Параллельная передача: файл делится на диапазоны, каждый идет по своей сессии
+    клиент -> кадр RANGE {tid, name, size, offset, length}, затем length байт
+    сервер -> кадр STATUS {status, committed} (committed - файл собран целиком)
+Докачка: id передачи вычисляется из имени, размера и времени изменения файла
+    клиент -> кадр QUERY {tid, name, size}
+    сервер -> кадр MISSING {have, missing: [[start, end], ...]} - каких байт еще нет
+    клиент -> кадры RANGE только для недостающих диапазонов
+Контрольная сумма: сервер перечисляет алгоритмы в HELLO_ACK {checksums}, клиент
+    указывает выбранный в FILE/RANGE {checksum} и после данных отправляет кадр DIGEST.
+    Сервер сверяет сумму, посчитанную при приеме, до ответа STATUS
+Сжатие: сервер перечисляет алгоритмы в HELLO_ACK {compression}, клиент указывает выбранный
+    в FILE/RANGE {compression}, и данные идут блоками: !II размер до сжатия, размер на проводе +
+    блок (если размеры равны - блок не сжат). Сумма DIGEST считается по несжатым данным
+Без дубликатов (CAP_DEDUP, сервер с хранилищем storage.py): HELLO_ACK {dedup} называет алгоритм
+    суммы хранилища; клиент перед данными отправляет кадр OFFER {name, size, checksum, digest},
+    сервер отвечает OFFER_ACK {have}. have=true - файл уже сохранен под этим именем, данные не нужны
+Изменения (CAP_DELTA, delta.py): клиент запрашивает подписи прежней версии файла у сервера
+    клиент -> кадр SIGNATURE_REQ {name}
+    сервер -> кадр SIGNATURE {base, size, tag, block, count}, затем count подписей блоков
+              (base=null - прежней версии нет)
+    клиент -> кадр DELTA {name, size, base, base_size, tag}, затем поток команд COPY/LITERAL/END
+              (литералы - сжатыми блоками, если указан compression), затем DIGEST
+    сервер -> кадр STATUS: файл собран из основы base и литералов и сохранен под новым именем.
+              ERROR без разрыва сессии - основа изменилась или сумма не совпала, клиент шлет FILE
+Кадр: !BI тип и длина тела + тело в JSON
+"""
+
+import hashlib
+import json
+import struct
+
+LEGACY_HEADER_SIZE = 68
+LEGACY_NAME_SIZE = 64
+# Старые клиенты писали размер в порядке байт машины ('I'); все они работали на x86,
+# поэтому порядок закреплен little-endian - одинаково на любой архитектуре
+LEGACY_HEADER = struct.Struct('<I')
+MAX_LEGACY_FILE_SIZE = 0xFFFFFFFE  # 0xFFFFFFFF - маркер сессии
+
+# Старый сервер прочитает HELLO как заголовок файла размером 4 ГБ - 1 байт,
+# поэтому клиент ждет HELLO_ACK с таймаутом и при его отсутствии
+# переходит на старый протокол
+SESSION_MARKER = b'\xff\xff\xff\xff'
+SESSION_MAGIC = b'FTXS'
+PROTOCOL_VERSION = 3
+HELLO = struct.Struct('!4s4sBI')  # маркер, сигнатура, версия, возможности (caps)
+
+# Возможности (биты caps)
+CAP_LARGE_FILES = 0x1  # файлы больше 4 ГБ (64-битные размеры и смещения)
+CAP_DEDUP = 0x2        # OFFER: сервер хранит файлы по содержимому (только с dedup=True)
+CAP_DELTA = 0x4        # SIGNATURE_REQ/DELTA: передача только изменений файла
+SUPPORTED_CAPS = CAP_LARGE_FILES | CAP_DEDUP | CAP_DELTA
+
+# Кадры сессии
+FRAME_HELLO_ACK = 1  # сервер: {version, caps, checksums, compression}
+FRAME_FILE = 2       # клиент: {name, size}, за кадром идут данные файла
+FRAME_STATUS = 3     # сервер: {status: SUCCESS/ERROR, name}
+FRAME_BYE = 4        # клиент: конец сессии
+FRAME_RANGE = 5      # клиент: {tid, name, size, offset, length}, за кадром идут байты диапазона
+FRAME_QUERY = 6      # клиент: {tid, name, size} - сколько уже принято?
+FRAME_MISSING = 7    # сервер: {have, missing} - принято байт и недостающие диапазоны
+FRAME_DIGEST = 8     # клиент: {digest} - контрольная сумма отправленных данных (hex)
+FRAME_OFFER = 9      # клиент: {name, size, checksum, digest} - нужен ли серверу этот файл?
+FRAME_OFFER_ACK = 10 # сервер: {have} - true, если файл уже сохранен по содержимому
+FRAME_SIGNATURE_REQ = 11  # клиент: {name} - подписи прежней версии файла
+FRAME_SIGNATURE = 12      # сервер: {base, size, tag, block, count}, за кадром идут подписи блоков
+FRAME_DELTA = 13          # клиент: {name, size, base, base_size, tag}, за кадром идет поток команд
+
+FRAME_HEADER = struct.Struct('!BI')
+MAX_FRAME_BODY = 64 * 1024
+MAX_MISSING_RANGES = 1024  # остальные недостающие диапазоны клиент узнает следующим QUERY
+
+
+def transfer_id_for(file_name, file_size, mtime_ns):
+    """Постоянный id передачи: тот же файл при повторной отправке получает тот же id"""
+    key = f"{file_name}\0{file_size}\0{mtime_ns}".encode('utf-8')
+    return hashlib.sha256(key).hexdigest()[:32]
+
+
+def pack_legacy_header(file_size, file_name):
+    """Заголовок старого протокола (ValueError, если файл больше 4 ГБ)"""
+    if not 0 <= file_size <= MAX_LEGACY_FILE_SIZE:
+        raise ValueError(f"файл {file_size} байт не передается по старому протоколу (больше 4 ГБ)")
+    name_encoded = file_name.encode('utf-8')[:LEGACY_NAME_SIZE].ljust(LEGACY_NAME_SIZE, b'\0')
+    return LEGACY_HEADER.pack(file_size) + name_encoded
+
+
+def parse_legacy_header(header):
+    """Разбор заголовка старого протокола -> (размер, имя файла)"""
+    file_size = LEGACY_HEADER.unpack_from(header)[0]
+    file_name = header[4:LEGACY_HEADER_SIZE].split(b'\0')[0].decode('utf-8', errors='ignore')
+    return file_size, file_name
+
+
+def pack_hello(caps=0):
+    """Первые 68 байт сессии"""
+    return HELLO.pack(SESSION_MARKER, SESSION_MAGIC, PROTOCOL_VERSION, caps).ljust(LEGACY_HEADER_SIZE, b'\0')
+
+
+def parse_hello(header):
+    """(версия, возможности), если заголовок - HELLO сессии, иначе None"""
+    marker, magic, version, caps = HELLO.unpack_from(header)
+    if marker != SESSION_MARKER or magic != SESSION_MAGIC:
+        return None
+    return version, caps
+
+
+def pack_frame(kind, body=None):
+    """Кадр сессии"""
+    payload = json.dumps(body, separators=(',', ':')).encode('utf-8') if body is not None else b''
+    return FRAME_HEADER.pack(kind, len(payload)) + payload
+
+
+def parse_frame_body(payload):
+    """Тело кадра -> словарь"""
+    if not payload:
+        return {}
+    return json.loads(payload.decode('utf-8'))
@@ -3,34 +3,110 @@ TCP СЕРВЕР для приема файлов
 Создает папку downloads РЯДОМ с этим скриптом
 """
 
+import asyncio
+import functools
+import multiprocessing
 import socket
-import struct
 import os
+import tempfile
 import threading
 import time
 from pathlib import Path
 
+import compression
+import delta
+import disk_writer
+import hashing
+import storage
+import tcp_protocol as proto
+
+# Операции ввода-вывода, которые запрашивает протокол соединения (connection_protocol)
+OP_RECV = 'recv'            # получить ровно n байт -> bytes или None, если клиент отключился
+OP_RECV_INTO = 'recv_into'  # получить данные в memoryview -> число байт (0 - клиент отключился)
+OP_SEND = 'send'            # отправить все данные
+OP_BLOCK = 'block'          # вызвать блокирующую функцию (ожидание диска) -> ее результат
+
+ENGINES = ('threads', 'asyncio')
+
+# Папка частично принятых файлов параллельной передачи (внутри папки загрузок)
+PARTIAL_DIR = '.partial'
+PARTIAL_TTL = 24 * 3600  # незавершенные передачи старше суток удаляются при запуске
+JOURNAL_STEP = 64 * 1024 * 1024  # как часто диапазон отмечается в журнале во время приема
+SIGNATURE_PAGE = 4096  # подписей блоков в одной отправке ответа SIGNATURE
+
+
+# Счетчики статистики сервера (индексы в массиве stats)
+STAT_CONNECTIONS = 0
+STAT_FILES = 1
+STAT_ERRORS = 2
+STAT_BYTES = 3
+STATS_FIELDS = 4
+
 class TCPServerFixed:
-    def __init__(self, host='0.0.0.0', port=8888):
+    def __init__(self, host='0.0.0.0', port=8888, download_dir=None, buffer_size=1024 * 1024,
+                 engine='threads', backlog=128, max_connections=256,
+                 stats=None, reuse_port=False, listen_socket=None, worker_id=None, dedup=False,
+                 background_write=True, durability=disk_writer.SYNC_NONE,
+                 group_files=disk_writer.GROUP_FILES, group_ms=disk_writer.GROUP_MS):
         self.host = host
         self.port = port
+        # Движок: 'threads' - поток на соединение, 'asyncio' - одно событийное кольцо
+        # на все соединения, не больше max_connections одновременно
+        self.engine = engine if engine in ENGINES else 'threads'
+        self.backlog = backlog
+        self.max_connections = max_connections
+        # Размер буфера приема: данные читаются recv_into прямо в него
+        # и пишутся на диск срезами, без промежуточных объектов bytes
+        self.buffer_size = buffer_size
+        # Запись на диск в фоне (disk_writer.py): прием следующего буфера идет,
+        # пока пишется предыдущий. False - запись в потоке соединения
+        self.disk_writer = disk_writer.DiskWriter() if background_write else None
+        # Файл принимается во временный в .partial и переносится в папку загрузок проверенным.
+        # durability - fsync при переносе: 'none', 'file' или 'group' (пачкой, см. disk_writer.py)
+        self.committer = disk_writer.Committer(durability, group_files, group_ms)
         
-        script_dir = Path(__file__).parent.absolute()
-        self.download_dir = script_dir / "server_downloads"
+        if download_dir is None:
+            script_dir = Path(__file__).parent.absolute()
+            self.download_dir = script_dir / "server_downloads"
+        else:
+            self.download_dir = Path(download_dir)
         
         self.download_dir.mkdir(exist_ok=True)
         
-        print("="*70)
-        print("  TCP ФАЙЛОВЫЙ СЕРВЕР ")
-        print("="*70)
-        print(f" Файлы сохраняются в: {self.download_dir}")
-        print(f" Адрес: {host}:{port}")
-        print(f" Абсолютный путь: {self.download_dir.absolute()}")
-        print("="*70)
+        # Хранилище по содержимому (storage.py): одинаковые файлы хранятся один раз,
+        # а клиент с той же суммой (OFFER) не передает данные вовсе
+        self.store = storage.ContentStore(self.download_dir / storage.STORE_DIR) if dedup else None
+        
+        # Счетчики STAT_*: список или общий для процессов массив (TCPServerPool)
+        self.stats = stats if stats is not None else [0] * STATS_FIELDS
+        self.stats_lock = threading.Lock()
+        
+        # Режим процесса-обработчика TCPServerPool: порт занимается с SO_REUSEPORT
+        # или используется готовый слушающий сокет от супервизора
+        self.reuse_port = reuse_port
+        self.listen_socket = listen_socket
+        self.worker_id = worker_id
+        
+        if worker_id is None:
+            print("="*70)
+            print("  TCP ФАЙЛОВЫЙ СЕРВЕР ")
+            print("="*70)
+            print(f" Файлы сохраняются в: {self.download_dir}")
+            print(f" Адрес: {host}:{port}")
+            print(f" Движок: {self.engine}")
+            if durability != disk_writer.SYNC_NONE:
+                print(f" Надежность записи: {durability}")
+            if self.store is not None:
+                print(f" Хранилище без дубликатов: {self.store.algorithm}"
+                      f"{'' if self.store.hardlinks else ' (без жестких ссылок - копии)'}")
+            print(f" Абсолютный путь: {self.download_dir.absolute()}")
+            print("="*70)
         
         self.server_socket = None
         self.running = False
         self.client_counter = 0
+        self.loop = None
+        self.accept_task = None
     
     def show_downloads_content(self):
         """Показать содержимое папки downloads"""
@@ -39,7 +115,7 @@ class TCPServerFixed:
             print("   Папка не существует!")
             return
         
-        files = list(self.download_dir.iterdir())
+        files = [f for f in self.download_dir.iterdir() if f.is_file()]
         if not files:
             print("Папка пуста")
         else:
@@ -48,45 +124,57 @@ class TCPServerFixed:
                 print(f"   {file.name} ({size:,} байт)")
         print()
     
+    def count(self, field, value=1):
+        """Увеличить счетчик статистики"""
+        with self.stats_lock:
+            self.stats[field] += value
+    
+    def create_listen_socket(self):
+        """Слушающий сокет сервера"""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port:
+            # Несколько процессов слушают один порт, ядро распределяет соединения между ними
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind((self.host, self.port))
+        sock.listen(self.backlog)
+        return sock
+    
     def start(self):
         """Запуск сервера"""
-        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.server_socket.bind((self.host, self.port))
-        self.server_socket.listen(5)
+        if self.listen_socket is not None:
+            self.server_socket = self.listen_socket
+        else:
+            self.server_socket = self.create_listen_socket()
         self.server_socket.settimeout(1.0)
         
         self.running = True
         
-        print("\n Сервер запущен и готов принимать файлы!")
-        print(" Ожидание подключений... (Ctrl+C для остановки)\n")
+        if self.worker_id in (None, 1):
+            self.cleanup_partials()
+            if self.store is not None:
+                removed = self.store.collect_garbage()
+                if removed:
+                    print(f" Хранилище: удалено содержимое удаленных файлов ({removed})")
         
-        # Показываем что сейчас в папке
-        self.show_downloads_content()
+        if self.worker_id is None:
+            print("\n Сервер запущен и готов принимать файлы!")
+            print(" Ожидание подключений... (Ctrl+C для остановки)\n")
+            
+            # Показываем что сейчас в папке
+            self.show_downloads_content()
+        else:
+            print(f" Процесс-обработчик #{self.worker_id} (pid {os.getpid()}) принимает подключения")
         
         try:
-            while self.running:
-                try:
-                    # Ждем подключения
-                    client_socket, client_address = self.server_socket.accept()
-                    self.client_counter += 1
-                    client_id = self.client_counter
-                    
-                    print(f"Подключение #{client_id} от {client_address[0]}:{client_address[1]}")
-                    
-                    # Обрабатываем клиента в отдельном потоке
-                    thread = threading.Thread(
-                        target=self.handle_client,
-                        args=(client_socket, client_address, client_id)
-                    )
-                    thread.daemon = True
-                    thread.start()
-                    
-                except socket.timeout:
-                    continue
-                    
+            if self.engine == 'asyncio':
+                asyncio.run(self.serve_asyncio())
+            else:
+                self.serve_threads()
+        
         except KeyboardInterrupt:
-            print("\n Остановка сервера...")
+            if self.worker_id is None:
+                print("\n Остановка сервера...")
         except Exception as e:
             print(f"\n Ошибка: {e}")
         finally:
@@ -94,93 +182,877 @@ class TCPServerFixed:
             if self.server_socket:
                 self.server_socket.close()
             
+            if self.worker_id is not None:
+                return
+            
             print("\n" + "="*70)
             print(" ИТОГИ РАБОТЫ СЕРВЕРА:")
             print(f" Папка с файлами: {self.download_dir}")
             self.show_downloads_content()
             print(" Сервер остановлен")
     
+    def serve_threads(self):
+        """Цикл приема соединений: поток на каждого клиента"""
+        while self.running:
+            try:
+                # Ждем подключения
+                client_socket, client_address = self.server_socket.accept()
+                self.client_counter += 1
+                self.count(STAT_CONNECTIONS)
+                client_id = self.client_counter
+                
+                print(f"Подключение #{client_id} от {client_address[0]}:{client_address[1]}")
+                
+                # Обрабатываем клиента в отдельном потоке
+                thread = threading.Thread(
+                    target=self.handle_client,
+                    args=(client_socket, client_address, client_id)
+                )
+                thread.daemon = True
+                thread.start()
+            
+            except socket.timeout:
+                continue
+            except BlockingIOError:
+                # Общий слушающий сокет: соединение забрал другой процесс
+                continue
+    
+    async def serve_asyncio(self):
+        """Цикл приема соединений на asyncio с ограничением числа клиентов"""
+        self.loop = asyncio.get_running_loop()
+        self.server_socket.setblocking(False)
+        limit = asyncio.Semaphore(self.max_connections)
+        tasks = set()
+        
+        while self.running:
+            # Пока заняты все слоты, новые клиенты ждут в очереди ядра (backlog)
+            await limit.acquire()
+            self.accept_task = asyncio.ensure_future(self.loop.sock_accept(self.server_socket))
+            try:
+                client_socket, client_address = await self.accept_task
+            except asyncio.CancelledError:
+                limit.release()
+                break
+            
+            self.client_counter += 1
+            self.count(STAT_CONNECTIONS)
+            client_id = self.client_counter
+            print(f"Подключение #{client_id} от {client_address[0]}:{client_address[1]}")
+            
+            task = asyncio.ensure_future(
+                self.handle_client_async(client_socket, client_address, client_id, limit)
+            )
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        
+        # Даем активным передачам завершиться
+        if tasks:
+            await asyncio.wait(tasks, timeout=5.0)
+    
     def handle_client(self, client_socket, client_address, client_id):
-        """Обработка клиента"""
+        """Обработка клиента (движок threads)"""
         try:
-            header_data = self.receive_all(client_socket, 68)
-            if not header_data or len(header_data) < 68:
+            self.run_protocol(self.connection_protocol(client_id), client_socket)
+        except Exception as e:
+            print(f" Клиент #{client_id}: Ошибка обработки: {e}")
+        finally:
+            try:
+                client_socket.close()
+            except:
+                pass
+    
+    async def handle_client_async(self, client_socket, client_address, client_id, limit):
+        """Обработка клиента (движок asyncio)"""
+        try:
+            await self.run_protocol_async(self.connection_protocol(client_id), client_socket)
+        except Exception as e:
+            print(f" Клиент #{client_id}: Ошибка обработки: {e}")
+        finally:
+            client_socket.close()
+            limit.release()
+    
+    def run_protocol(self, protocol, sock):
+        """Выполнять операции протокола на блокирующем сокете"""
+        try:
+            op = next(protocol)
+            while True:
+                kind, arg = op
+                try:
+                    if kind == OP_RECV:
+                        result = self.receive_all(sock, arg)
+                    elif kind == OP_RECV_INTO:
+                        result = sock.recv_into(arg)
+                    elif kind == OP_BLOCK:
+                        result = arg()
+                    else:
+                        result = sock.sendall(arg)
+                except OSError as e:
+                    op = protocol.throw(e)
+                else:
+                    op = protocol.send(result)
+        except StopIteration:
+            pass
+        finally:
+            protocol.close()
+    
+    async def run_protocol_async(self, protocol, sock):
+        """Выполнять операции протокола через событийное кольцо asyncio"""
+        loop = asyncio.get_running_loop()
+        try:
+            op = next(protocol)
+            while True:
+                kind, arg = op
+                try:
+                    if kind == OP_RECV:
+                        result = await self.receive_all_async(loop, sock, arg)
+                    elif kind == OP_RECV_INTO:
+                        result = await loop.sock_recv_into(sock, arg)
+                    elif kind == OP_BLOCK:
+                        # Ожидание диска не должно останавливать остальные соединения
+                        result = await loop.run_in_executor(None, arg)
+                    else:
+                        result = await loop.sock_sendall(sock, arg)
+                except OSError as e:
+                    op = protocol.throw(e)
+                else:
+                    op = protocol.send(result)
+        except StopIteration:
+            pass
+        finally:
+            protocol.close()
+    
+    def connection_protocol(self, client_id):
+        """Протокол одного соединения.
+        
+        Генератор не работает с сокетом сам: он выдает операции (OP_RECV,
+        OP_RECV_INTO, OP_SEND, OP_BLOCK) и получает их результат. Поэтому один и тот же
+        протокол обслуживают оба движка - потоки и asyncio.
+        """
+        session = False
+        try:
+            header_data = yield (OP_RECV, proto.LEGACY_HEADER_SIZE)
+            if not header_data or len(header_data) < proto.LEGACY_HEADER_SIZE:
                 print(f" Клиент #{client_id}: Неполный заголовок")
                 return
             
-            file_size = struct.unpack('I', header_data[:4])[0]
-            file_name_encoded = header_data[4:68]
-            file_name = file_name_encoded.split(b'\0')[0].decode('utf-8', errors='ignore')
+            hello = proto.parse_hello(header_data)
+            if hello is not None:
+                session = True
+                yield from self.session_protocol(client_id, *hello)
+                return
+            
+            # Старый протокол: один файл на соединение
+            file_size, file_name = proto.parse_legacy_header(header_data)
             
             if not file_name:
                 file_name = f"file_{client_id}"
             
-            print(f"\n Клиент #{client_id} отправляет:")
-            print(f"    Файл: {file_name}")
-            print(f"    Размер: {file_size:,} байт")
-            print(f"    Сохраняю в: {self.download_dir}")
-            
-            safe_name = self.make_safe_filename(file_name)
-            save_path = self.download_dir / safe_name
-            
-            counter = 1
-            while save_path.exists():
-                name_stem = save_path.stem
-                suffix = save_path.suffix
-                save_path = self.download_dir / f"{name_stem}_{counter}{suffix}"
-                counter += 1
-            
-            received = 0
-            with open(save_path, 'wb') as file:
-                while received < file_size:
-                    chunk_size = min(4096, file_size - received)
-                    chunk = self.receive_all(client_socket, chunk_size)
-                    if not chunk:
-                        print(f" Клиент #{client_id}: Соединение прервано")
-                        break
-                    
-                    file.write(chunk)
-                    received += len(chunk)
-                    
-                    if file_size > 0:
-                        progress = (received / file_size) * 100
-                        if int(progress) % 25 == 0 and progress > 0:
-                            print(f"   ⏳ {int(progress)}%...")
-            
-            if received == file_size:
-                print(f" Клиент #{client_id}: Файл успешно сохранен!")
-                print(f"   Путь: {save_path}")
-                print(f"   Размер на диске: {save_path.stat().st_size:,} байт")
-                client_socket.send(b"SUCCESS")
+            ok = yield from self.receive_file(client_id, file_name, file_size)
+            if ok:
+                yield (OP_SEND, b"SUCCESS")
                 
                 self.show_downloads_content()
             else:
-                print(f" Клиент #{client_id}: Ошибка! Получено {received:,}/{file_size:,} байт")
-                if save_path.exists():
-                    save_path.unlink()
-                client_socket.send(b"ERROR")
-                
+                yield (OP_SEND, b"ERROR")
+        
         except Exception as e:
+            self.count(STAT_ERRORS)
             print(f" Клиент #{client_id}: Ошибка обработки: {e}")
             try:
-                client_socket.send(b"ERROR")
-            except:
+                if session:
+                    yield (OP_SEND, proto.pack_frame(proto.FRAME_STATUS, {'status': 'ERROR', 'error': str(e)}))
+                else:
+                    yield (OP_SEND, b"ERROR")
+            except Exception:
                 pass
+    
+    def session_protocol(self, client_id, version, caps):
+        """Сессия (v2 и новее): много файлов по одному соединению, ответ STATUS на каждый"""
+        print(f" Клиент #{client_id}: сессия протокола v{version}")
+        hello = {
+            'version': proto.PROTOCOL_VERSION, 'caps': caps & proto.SUPPORTED_CAPS,
+            'checksums': hashing.available_algorithms(), 'compression': compression.available_algorithms(),
+        }
+        if self.store is None:
+            hello['caps'] &= ~proto.CAP_DEDUP
+        elif hello['caps'] & proto.CAP_DEDUP:
+            hello['dedup'] = self.store.algorithm
+        yield (OP_SEND, proto.pack_frame(proto.FRAME_HELLO_ACK, hello))
+        
+        files = 0
+        while True:
+            frame = yield from self.receive_frame()
+            if frame is None:
+                print(f" Клиент #{client_id}: Соединение закрыто без BYE")
+                break
+            
+            kind, body = frame
+            if kind == proto.FRAME_BYE:
+                break
+            if kind == proto.FRAME_OFFER:
+                have = self.accept_offer(client_id, body)
+                yield (OP_SEND, proto.pack_frame(proto.FRAME_OFFER_ACK, {'have': have}))
+                if have:
+                    files += 1
+                continue
+            if kind == proto.FRAME_QUERY:
+                yield (OP_SEND, proto.pack_frame(proto.FRAME_MISSING, self.query_transfer(client_id, body)))
+                continue
+            if kind == proto.FRAME_SIGNATURE_REQ:
+                yield from self.send_signature(client_id, body)
+                continue
+            if kind == proto.FRAME_DELTA:
+                ok = yield from self.receive_delta(client_id, body)
+                yield (OP_SEND, proto.pack_frame(proto.FRAME_STATUS, {
+                    'status': 'SUCCESS' if ok else 'ERROR', 'name': body.get('name')}))
+                if ok:
+                    files += 1
+                continue
+            if kind == proto.FRAME_RANGE:
+                ok, committed = yield from self.receive_range(client_id, body)
+                status = 'SUCCESS' if ok else 'ERROR'
+                yield (OP_SEND, proto.pack_frame(proto.FRAME_STATUS, {'status': status, 'committed': committed}))
+                if not ok:
+                    break
+                continue
+            if kind != proto.FRAME_FILE:
+                raise ValueError(f"неожиданный кадр {kind}")
+            
+            file_name = str(body.get('name') or f"file_{client_id}_{files + 1}")
+            file_size = int(body['size'])
+            ok = yield from self.receive_file(client_id, file_name, file_size, self.checksum_for(body),
+                                              self.codec_for(body))
+            status = 'SUCCESS' if ok else 'ERROR'
+            yield (OP_SEND, proto.pack_frame(proto.FRAME_STATUS, {'status': status, 'name': file_name}))
+            if not ok:
+                # Данные файла не дошли или повреждены - сессия завершается
+                break
+            files += 1
+        
+        print(f" Клиент #{client_id}: сессия завершена, принято файлов: {files}")
+        if files:
+            self.show_downloads_content()
+    
+    def receive_frame(self):
+        """Прочитать кадр сессии -> (тип, тело) или None, если клиент отключился"""
+        header = yield (OP_RECV, proto.FRAME_HEADER.size)
+        if not header:
+            return None
+        kind, length = proto.FRAME_HEADER.unpack(header)
+        if length > proto.MAX_FRAME_BODY:
+            raise ValueError(f"слишком длинный кадр: {length} байт")
+        payload = b''
+        if length:
+            payload = yield (OP_RECV, length)
+            if payload is None:
+                return None
+        return kind, proto.parse_frame_body(payload)
+    
+    def checksum_for(self, body):
+        """Объект контрольной суммы по полю checksum кадра FILE/RANGE или None"""
+        name = body.get('checksum')
+        return hashing.new_hasher(str(name)) if name else None
+    
+    def codec_for(self, body):
+        """Алгоритм сжатия данных по полю compression кадра FILE/RANGE или None"""
+        name = body.get('compression')
+        if not name:
+            return None
+        if str(name) not in compression.available_algorithms():
+            raise ValueError(f"неизвестный алгоритм сжатия: {name!r}")
+        return str(name)
+    
+    def receive_digest(self, client_id, hasher):
+        """Прочитать кадр DIGEST и сверить с суммой принятых данных -> True, если совпала"""
+        frame = yield from self.receive_frame()
+        if frame is None or frame[0] != proto.FRAME_DIGEST:
+            raise ValueError("после данных ожидался кадр DIGEST")
+        if str(frame[1].get('digest', '')).lower() == hasher.hexdigest():
+            return True
+        print(f" Клиент #{client_id}: Контрольная сумма не совпала!")
+        return False
+    
+    def accept_offer(self, client_id, body):
+        """Ответ на OFFER: есть ли файл с такой суммой в хранилище -> True, если сохранен под новым именем"""
+        if self.store is None or body.get('checksum') != self.store.algorithm:
+            return False
+        file_name = str(body.get('name') or f"file_{client_id}")
+        file_size = int(body['size'])
+        blob = self.store.lookup(body.get('digest'), file_size)
+        if blob is None:
+            return False
+        
+        # Ссылка на содержимое готовится в .partial и появляется в папке загрузок
+        # сразу целой, под атомарно занятым именем (link_unique)
+        file, temp_path = self.create_temp_file()
+        file.close()
+        try:
+            self.store.link(blob, temp_path)
+            save_path = disk_writer.link_unique(temp_path, self.download_dir, self.make_safe_filename(file_name))
+        except OSError as e:
+            # Клиент отправит данные как обычно
+            print(f" Клиент #{client_id}: Ошибка хранилища: {e}")
+            if temp_path.exists():
+                temp_path.unlink()
+            return False
+        self.count(STAT_FILES)
+        print(f" Клиент #{client_id}: {file_name} ({file_size:,} байт) уже есть в хранилище, данные не нужны")
+        print(f"   Путь: {save_path}")
+        return True
+    
+    def store_file(self, client_id, save_path, hasher=None):
+        """Добавить принятый файл в хранилище (если оно включено); ошибка хранилища не отменяет прием"""
+        if self.store is None:
+            return
+        try:
+            if self.store.add(save_path, hasher):
+                print(f" Клиент #{client_id}: такое содержимое уже было, файл - ссылка на него")
+        except OSError as e:
+            print(f" Клиент #{client_id}: Ошибка хранилища: {e}")
+    
+    def send_signature(self, client_id, body):
+        """Ответ на SIGNATURE_REQ: подписи блоков самой новой версии файла (основы)"""
+        safe_name = self.make_safe_filename(str(body.get('name') or ''))
+        base_name = delta.find_base(self.download_dir, safe_name)
+        if base_name is None:
+            yield (OP_SEND, proto.pack_frame(proto.FRAME_SIGNATURE, {'base': None}))
+            return
+        
+        with open(self.download_dir / base_name, 'rb') as base:
+            stat = os.fstat(base.fileno())
+            block = delta.block_size_for(stat.st_size)
+            count = -(-stat.st_size // block)
+            print(f" Клиент #{client_id}: подписи {base_name} ({count} блоков по {block} байт)")
+            yield (OP_SEND, proto.pack_frame(proto.FRAME_SIGNATURE, {
+                'base': base_name, 'size': stat.st_size, 'tag': stat.st_mtime_ns, 'block': block, 'count': count,
+            }))
+            for first in range(0, count, SIGNATURE_PAGE):
+                page = min(SIGNATURE_PAGE, count - first)
+                entries = delta.block_signatures(base, block, first, page)
+                # Файл укоротился во время чтения - клиент все равно ждет count подписей,
+                # а DELTA с этой основой сервер отклонит по tag
+                yield (OP_SEND, entries.ljust(page * delta.SIGNATURE_ENTRY.size, b'\0'))
+    
+    def receive_delta(self, client_id, body):
+        """Принять поток изменений (DELTA) и собрать новую версию файла -> True, если файл сохранен
+        
+        Если основа изменилась после SIGNATURE, поток все равно дочитывается,
+        чтобы сессия продолжилась и клиент отправил файл целиком
+        """
+        file_name = str(body.get('name') or f"file_{client_id}")
+        file_size = int(body['size'])
+        base_size = int(body['base_size'])
+        hasher = self.checksum_for(body)
+        codec = self.codec_for(body)
+        base_path = self.download_dir / self.make_safe_filename(str(body.get('base') or ''))
+        print(f"\n Клиент #{client_id} отправляет изменения:")
+        print(f"    Файл: {file_name}")
+        print(f"    Размер: {file_size:,} байт, основа: {base_path.name}")
+        
+        base = None
+        try:
+            base = open(base_path, 'rb')
+            stat = os.fstat(base.fileno())
+            if stat.st_size != base_size or stat.st_mtime_ns != body.get('tag'):
+                base.close()
+                base = None
+        except OSError:
+            pass
+        if base is None:
+            print(f" Клиент #{client_id}: основа {base_path.name} изменилась, изменения пропускаются")
+            file, temp_path = open(os.devnull, 'wb'), None
+        else:
+            file, temp_path = self.create_temp_file()
+        
+        written = literal_bytes = 0
+        try:
+            with file:
+                if temp_path is not None:
+                    disk_writer.preallocate(file, file_size)
+                while True:
+                    header = yield (OP_RECV, delta.OP_HEADER.size)
+                    if not header:
+                        raise ConnectionError("клиент отключился посреди изменений")
+                    op = header[0]
+                    if op == delta.OP_END:
+                        break
+                    if op == delta.OP_COPY:
+                        rest = yield (OP_RECV, delta.COPY_HEADER.size - delta.OP_HEADER.size)
+                        if not rest:
+                            raise ConnectionError("клиент отключился посреди изменений")
+                        _, offset, length = delta.COPY_HEADER.unpack(header + rest)
+                        if written + length > file_size:
+                            raise ValueError("поток изменений длиннее файла")
+                        if base is not None:
+                            delta.copy_range(base, file, offset, length, base_size, hasher)
+                    elif op == delta.OP_LITERAL:
+                        rest = yield (OP_RECV, delta.LITERAL_HEADER.size - delta.OP_HEADER.size)
+                        if not rest:
+                            raise ConnectionError("клиент отключился посреди изменений")
+                        _, length = delta.LITERAL_HEADER.unpack(header + rest)
+                        if written + length > file_size:
+                            raise ValueError("поток изменений длиннее файла")
+                        received = yield from self.receive_to_file(file, length, hasher=hasher, codec=codec,
+                                                                   progress=False)
+                        if received < length:
+                            raise ConnectionError("клиент отключился посреди изменений")
+                        literal_bytes += length
+                    else:
+                        raise ValueError(f"неизвестная команда потока изменений: {op}")
+                    written += length
+            if written != file_size:
+                raise ValueError(f"собрано {written} байт вместо {file_size}")
+        except Exception:
+            self.count(STAT_ERRORS)
+            if temp_path is not None:
+                temp_path.unlink()
+            raise
         finally:
+            if base is not None:
+                base.close()
+        
+        verified = True
+        if hasher is not None:
+            verified = yield from self.receive_digest(client_id, hasher)
+        if temp_path is None or not verified:
+            self.count(STAT_ERRORS)
+            if temp_path is not None:
+                temp_path.unlink()
+            return False
+        
+        self.count(STAT_BYTES, literal_bytes)
+        print(f" Клиент #{client_id}: Файл собран из {base_path.name}, принято новых данных {literal_bytes:,} байт")
+        return (yield from self.commit_file(client_id, temp_path, file_name, hasher))
+    
+    def receive_file(self, client_id, file_name, file_size, hasher=None, codec=None):
+        """Принять данные одного файла в папку загрузок -> True, если файл получен целиком
+        
+        hasher - контрольная сумма считается при приеме и сверяется с кадром DIGEST.
+        codec - данные идут сжатыми блоками (compression.py)
+        """
+        print(f"\n Клиент #{client_id} отправляет:")
+        print(f"    Файл: {file_name}")
+        print(f"    Размер: {file_size:,} байт")
+        print(f"    Сохраняю в: {self.download_dir}")
+        
+        file, temp_path = self.create_temp_file()
+        try:
+            with file:
+                # Место под весь файл выделяется сразу: нехватка места видна до приема
+                disk_writer.preallocate(file, file_size)
+                received = yield from self.receive_to_file(file, file_size, hasher=hasher, codec=codec)
+                if received < file_size:
+                    print(f" Клиент #{client_id}: Соединение прервано")
+        except (ValueError, OSError):
+            # Поврежденный сжатый блок или ошибка диска - недописанный файл удаляется
+            self.count(STAT_ERRORS)
+            temp_path.unlink()
+            raise
+        
+        verified = True
+        if received == file_size and hasher is not None:
+            verified = yield from self.receive_digest(client_id, hasher)
+        
+        if received == file_size and verified:
+            self.count(STAT_BYTES, received)
+            print(f" Клиент #{client_id}: Файл успешно принят!")
+            return (yield from self.commit_file(client_id, temp_path, file_name, hasher))
+        
+        self.count(STAT_ERRORS)
+        if verified:
+            print(f" Клиент #{client_id}: Ошибка! Получено {received:,}/{file_size:,} байт")
+        if temp_path.exists():
+            temp_path.unlink()
+        return False
+    
+    def create_temp_file(self):
+        """Создать временный файл приема в .partial -> (файл, путь)
+        
+        Читатели папки загрузок не видят недописанный файл: он появится там
+        целым и проверенным (commit_file)
+        """
+        partial_dir = self.download_dir / PARTIAL_DIR
+        partial_dir.mkdir(exist_ok=True)
+        fd, path = tempfile.mkstemp(suffix='.tmp', prefix='recv_', dir=partial_dir)
+        return open(fd, 'wb'), Path(path)
+    
+    def commit_file(self, client_id, temp_path, file_name, hasher=None):
+        """Перенести принятый файл в папку загрузок под свободным именем -> False при ошибке
+        
+        fsync по политике надежности идет через OP_BLOCK и не останавливает остальные
+        соединения. В пачке (group) соединение ждет fsync своей пачки, общей
+        с одновременными передачами, и только потом отвечает клиенту
+        """
+        try:
+            save_path = yield (OP_BLOCK, functools.partial(self.committer.commit, temp_path, self.download_dir,
+                                                           self.make_safe_filename(file_name)))
+        except OSError as e:
+            self.count(STAT_ERRORS)
+            print(f" Клиент #{client_id}: Ошибка сохранения {file_name}: {e}")
+            if temp_path.exists():
+                temp_path.unlink()
+            return False
+        self.count(STAT_FILES)
+        print(f" Клиент #{client_id}: Файл сохранен: {save_path}")
+        print(f"   Размер на диске: {save_path.stat().st_size:,} байт")
+        self.store_file(client_id, save_path, hasher)
+        return True
+    
+    def check_transfer_id(self, body):
+        """id передачи из кадра (становится частью имени файла)"""
+        transfer_id = str(body['tid'])
+        if not transfer_id.isalnum() or len(transfer_id) > 64:
+            raise ValueError(f"некорректный id передачи: {transfer_id!r}")
+        return transfer_id
+    
+    def query_transfer(self, client_id, body):
+        """Ответ на QUERY: сколько байт передачи уже принято и каких диапазонов не хватает"""
+        transfer_id = self.check_transfer_id(body)
+        file_size = int(body['size'])
+        partial_dir = self.download_dir / PARTIAL_DIR
+        
+        part_path = partial_dir / f"{transfer_id}.part"
+        if part_path.exists() and part_path.stat().st_size != file_size:
+            # Под этим id лежит другой файл - начинаем заново
+            for path in partial_dir.glob(f"{transfer_id}.*"):
+                path.unlink()
+        
+        # Клиент с контрольной суммой повторяет части, не сверенные при приеме
+        verified = bool(body.get('checksum'))
+        received = self.received_ranges(partial_dir, transfer_id, verified) if part_path.exists() else []
+        have = sum(end - start for start, end in received)
+        missing = []
+        position = 0
+        for start, end in received + [(file_size, file_size)]:
+            if start > position:
+                missing.append([position, start])
+            position = max(position, end)
+        
+        if have:
+            print(f" Клиент #{client_id}: докачка {body.get('name')} [{transfer_id}], "
+                  f"уже принято {have:,} из {file_size:,} байт")
+        return {'have': have, 'missing': missing[:proto.MAX_MISSING_RANGES]}
+    
+    def receive_range(self, client_id, body):
+        """Принять диапазон байт передачи -> (принят, файл собран)
+        
+        Каждое соединение пишет свой диапазон в общий файл .partial/<tid>.part
+        по своему смещению и ведет журнал диапазона .partial/<tid>.<начало>.journal
+        с концом принятой части. Журнал обновляется после fsync данных -
+        раз в JOURNAL_STEP байт и при обрыве соединения, поэтому принятое
+        не теряется и передачу можно продолжить (QUERY). Состояние хранится
+        на диске, поэтому диапазоны одной передачи могут попасть в разные
+        процессы TCPServerPool. Соединение, закрывшее последний диапазон,
+        переименовывает файл в папку загрузок
+        
+        С контрольной суммой в журнал попадает только диапазон, сверенный с DIGEST,
+        вместе с его суммой, а файл собирается по пустому диапазону с суммой всего
+        файла (commit_ranges)
+        """
+        transfer_id = self.check_transfer_id(body)
+        file_name = str(body.get('name') or f"file_{client_id}")
+        file_size = int(body['size'])
+        offset = int(body['offset'])
+        length = int(body['length'])
+        if offset < 0 or length < 0 or offset + length > file_size:
+            raise ValueError(f"диапазон {offset}+{length} вне файла размером {file_size}")
+        
+        print(f" Клиент #{client_id}: {file_name} [{transfer_id}], "
+              f"байты {offset:,}-{offset + length:,} из {file_size:,}")
+        
+        partial_dir = self.download_dir / PARTIAL_DIR
+        partial_dir.mkdir(exist_ok=True)
+        part_path = partial_dir / f"{transfer_id}.part"
+        hasher = self.checksum_for(body)
+        codec = self.codec_for(body)
+        if hasher is not None and not length:
+            return (yield from self.commit_ranges(client_id, transfer_id, file_name, file_size, str(body['checksum'])))
+        
+        fd = os.open(part_path, os.O_RDWR | os.O_CREAT | getattr(os, 'O_BINARY', 0), 0o644)
+        with open(fd, 'r+b', buffering=0) as file:
+            # Файл сразу получает итоговый размер, диапазоны пишутся на свои места
+            disk_writer.preallocate(file, file_size)
+            
+            def checkpoint(received):
+                # Диапазон с контрольной суммой отмечается только целиком, после сверки:
+                # при обрыве он повторяется с начала (клиент шлет их частями по CHECKSUM_PIECE)
+                if hasher is None:
+                    self.write_journal(partial_dir, transfer_id, file, offset, offset + received)
+            
+            received = yield from self.receive_to_file(file, length, offset, checkpoint, hasher, codec)
+            
+            self.count(STAT_BYTES, received)
+            if received < length:
+                self.count(STAT_ERRORS)
+                print(f" Клиент #{client_id}: Соединение прервано, получено {received:,}/{length:,} байт диапазона"
+                      f" (сохранено для докачки)")
+                return False, False
+            
+            if hasher is not None:
+                if not (yield from self.receive_digest(client_id, hasher)):
+                    self.count(STAT_ERRORS)
+                    return False, False
+                yield (OP_BLOCK, functools.partial(self.write_journal, partial_dir, transfer_id, file,
+                                                   offset, offset + length, hasher.hexdigest()))
+                # Файл соберет пустой диапазон с суммой всего файла
+                return True, False
+        
+        temp_path = self.claim_ranges(partial_dir, transfer_id, file_size)
+        committed = False
+        if temp_path is not None:
+            print(f" Клиент #{client_id}: Файл {file_name} собран из диапазонов!")
+            # Суммы диапазонов не дают сумму файла - хранилище читает собранный файл
+            committed = yield from self.commit_file(client_id, temp_path, file_name)
+            self.show_downloads_content()
+        return True, committed
+    
+    def commit_ranges(self, client_id, transfer_id, file_name, file_size, checksum):
+        """Собрать файл из диапазонов со сверкой суммы всего файла -> (принят, файл собран)
+        
+        Каждый диапазон сверен при приеме и записан в журнал со своей суммой. Сумма всего
+        файла - сумма сумм диапазонов по порядку (hashing.combine_digests): она проверяет,
+        что файл собран ровно из сверенных частей, и не требует читать собранный файл.
+        При несовпадении принятое удаляется - следующая попытка отправит файл заново
+        """
+        frame = yield from self.receive_frame()
+        if frame is None or frame[0] != proto.FRAME_DIGEST:
+            raise ValueError("после данных ожидался кадр DIGEST")
+        partial_dir = self.download_dir / PARTIAL_DIR
+        if not (partial_dir / f"{transfer_id}.part").exists():
+            return True, False
+        
+        digests = []
+        position = 0
+        for start, end, digest in self.journal_entries(partial_dir, transfer_id):
+            if digest is None:
+                continue  # принято без контрольной суммы
+            if start != position:
+                break
+            digests.append(digest)
+            position = end
+        expected = hashing.combine_digests(checksum, digests)
+        if position != file_size or str(frame[1].get('digest', '')).lower() != expected:
+            print(f" Клиент #{client_id}: Контрольная сумма файла {file_name} не совпала!")
+            self.count(STAT_ERRORS)
+            for path in partial_dir.glob(f"{transfer_id}.*"):
+                path.unlink()
+            return False, False
+        
+        temp_path = self.claim_ranges(partial_dir, transfer_id, file_size)
+        if temp_path is None:
+            return True, False
+        print(f" Клиент #{client_id}: Файл {file_name} собран из диапазонов!")
+        # Сумма сумм - не сумма файла: хранилище, если оно включено, прочитает файл само
+        committed = yield from self.commit_file(client_id, temp_path, file_name)
+        self.show_downloads_content()
+        return True, committed
+    
+    def write_journal(self, partial_dir, transfer_id, file, start, end, digest=None):
+        """Отметить в журнале, что байты [start, end) записаны на диск (блокирует на fsync - через OP_BLOCK)
+        
+        digest - сумма сверенного диапазона (hex), записывается после конца
+        """
+        if end <= start:
+            return
+        os.fsync(file.fileno())
+        path = partial_dir / f"{transfer_id}.{start}.journal"
+        tmp_path = partial_dir / f"{transfer_id}.{start}.tmp"
+        tmp_path.write_text(f"{end} {digest}" if digest else str(end))
+        os.replace(tmp_path, path)
+    
+    def journal_entries(self, partial_dir, transfer_id):
+        """Журналы передачи -> отсортированные (start, end, сумма или None)"""
+        entries = []
+        for path in partial_dir.glob(f"{transfer_id}.*.journal"):
             try:
-                client_socket.close()
-            except:
+                start = int(path.name.split('.')[1])
+                fields = path.read_text().split()
+                end = int(fields[0]) if fields else start
+            except (OSError, ValueError):
+                continue
+            if end > start:
+                entries.append((start, end, fields[1] if len(fields) > 1 else None))
+        return sorted(entries)
+    
+    def received_ranges(self, partial_dir, transfer_id, verified=False):
+        """Принятые диапазоны передачи по журналам -> отсортированные непересекающиеся [start, end)
+        
+        verified - только диапазоны, сверенные по контрольной сумме
+        """
+        merged = []
+        for start, end, digest in self.journal_entries(partial_dir, transfer_id):
+            if verified and digest is None:
+                continue
+            if merged and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+        return merged
+    
+    def claim_ranges(self, partial_dir, transfer_id, file_size):
+        """Готовы ли все диапазоны -> временный путь собранного файла, если его
+        переносит это соединение, иначе None
+        
+        Файл уходит из <tid>.part под своим временным именем, журналы передачи
+        удаляются: повторная отправка того же файла, пока этот еще фиксируется,
+        начнет новый <tid>.part, а не допишет переносимый
+        """
+        received = self.received_ranges(partial_dir, transfer_id)
+        if file_size and received != [(0, file_size)]:
+            return None
+        
+        # Собрать файл должно ровно одно соединение
+        try:
+            os.close(os.open(partial_dir / f"{transfer_id}.commit", os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            return None
+        
+        fd, temp_path = tempfile.mkstemp(suffix='.tmp', prefix='recv_', dir=partial_dir)
+        os.close(fd)
+        os.replace(partial_dir / f"{transfer_id}.part", temp_path)
+        for path in partial_dir.glob(f"{transfer_id}.*"):
+            path.unlink()
+        return Path(temp_path)
+    
+    def cleanup_partials(self):
+        """Удалить заброшенные незавершенные параллельные передачи"""
+        partial_dir = self.download_dir / PARTIAL_DIR
+        if not partial_dir.exists():
+            return
+        now = time.time()
+        for path in partial_dir.iterdir():
+            try:
+                if now - path.stat().st_mtime > PARTIAL_TTL:
+                    path.unlink()
+            except OSError:
                 pass
     
     def receive_all(self, sock, n):
         """Получить точно n байт"""
-        data = b''
-        while len(data) < n:
-            packet = sock.recv(n - len(data))
-            if not packet:
+        data = bytearray(n)
+        view = memoryview(data)
+        received = 0
+        while received < n:
+            count = sock.recv_into(view[received:])
+            if not count:
+                return None
+            received += count
+        return bytes(data)
+    
+    async def receive_all_async(self, loop, sock, n):
+        """Получить точно n байт (asyncio)"""
+        data = bytearray(n)
+        view = memoryview(data)
+        received = 0
+        while received < n:
+            count = await loop.sock_recv_into(sock, view[received:])
+            if not count:
                 return None
-            data += packet
-        return data
+            received += count
+        return bytes(data)
+    
+    def receive_to_file(self, file, size, offset=None, checkpoint=None, hasher=None, codec=None, progress=True):
+        """Принять size байт в файл, запись на диск идет в фоне (disk_writer.py)
+        
+        Данные читаются recv_into в буферы по buffer_size, полный буфер уходит
+        в очередь записи, а прием продолжается в следующий (буферы переиспользуются).
+        Если очередь файла заполнена, прием ждет диск (OP_BLOCK).
+        offset - писать позиционно с этого смещения, иначе с текущей позиции.
+        checkpoint(принято) - вызывается каждые JOURNAL_STEP байт и в конце,
+        в том числе при обрыве соединения, когда принятое уже записано.
+        Он, как и ожидание записи, идет через OP_BLOCK (fsync журнала не должен
+        останавливать остальные соединения).
+        hasher - обновляется теми же данными.
+        codec - данные идут сжатыми блоками: в файл и сумму попадают распакованные.
+        progress=False - без вывода процентов (литералы потока изменений)
+        """
+        writer = disk_writer.FileWriter(file, self.disk_writer)
+        if offset is None:
+            # Запись идет по смещениям: буферизованный файл сбрасывается, а в конце
+            # его позиция переводится за принятые данные
+            file.flush()
+            start = file.tell()
+        else:
+            start = offset
+        buffer_size = min(self.buffer_size, max(size, 1))
+        buffer = None
+        filled = 0
+        received = 0
+        next_report = 25
+        next_checkpoint = JOURNAL_STEP
+        
+        def finish():
+            # При обрыве дописывается и неполный буфер: журнал отмечает только записанное
+            if buffer is not None and filled:
+                writer.write(start + received - filled, view[:filled], buffer)
+            writer.flush()
+            if offset is None:
+                file.seek(start + received)
+            if checkpoint:
+                checkpoint(received)
+        
+        try:
+            while received < size:
+                if writer.full:
+                    yield (OP_BLOCK, writer.wait_room)
+                if codec is None:
+                    if buffer is None:
+                        buffer = writer.take_buffer(buffer_size)
+                        view = memoryview(buffer)
+                        filled = 0
+                    count = yield (OP_RECV_INTO, view[filled:min(len(buffer), filled + size - received)])
+                    if not count:
+                        break
+                    data = view[filled:filled + count]
+                    filled += count
+                else:
+                    data = yield from self.receive_block(codec, size - received)
+                    if data is None:
+                        break
+                    count = len(data)
+                if hasher is not None:
+                    hasher.update(data)
+                received += count
+                if codec is not None:
+                    writer.write(start + received - count, data)
+                elif filled == len(buffer) or received == size:
+                    writer.write(start + received - filled, view[:filled], buffer)
+                    buffer = None
+                
+                if checkpoint and buffer is None and received >= next_checkpoint:
+                    yield (OP_BLOCK, writer.flush)
+                    yield (OP_BLOCK, functools.partial(checkpoint, received))
+                    next_checkpoint = received + JOURNAL_STEP
+                
+                percent = received * 100 // size
+                if progress and percent >= next_report:
+                    print(f"   ⏳ {percent - percent % 25}%...")
+                    next_report = percent - percent % 25 + 25
+        except Exception:
+            # Ошибка посреди приема: принятое все равно дописывается и отмечается в журнале
+            yield (OP_BLOCK, finish)
+            raise
+        except BaseException:
+            # GeneratorExit - движок закрывает протокол, ждать через OP_BLOCK уже нельзя
+            finish()
+            raise
+        yield (OP_BLOCK, finish)
+        return received
+    
+    def receive_block(self, codec, left):
+        """Один блок сжатого потока -> распакованные данные или None, если клиент отключился"""
+        header = yield (OP_RECV, compression.BLOCK_HEADER.size)
+        if not header:
+            return None
+        raw_size, stored_size = compression.BLOCK_HEADER.unpack(header)
+        if not 0 < raw_size <= min(left, compression.BLOCK_SIZE) or not 0 < stored_size <= raw_size:
+            raise ValueError(f"неверный заголовок сжатого блока: {raw_size}/{stored_size} байт")
+        payload = yield (OP_RECV, stored_size)
+        if payload is None:
+            return None
+        if stored_size == raw_size:
+            return payload  # блок не сжимался
+        return compression.decompress(codec, payload, raw_size)
     
     def make_safe_filename(self, filename):
         """Создать безопасное имя файла"""
@@ -189,7 +1061,7 @@ class TCPServerFixed:
         safe = safe.replace('?', '_').replace('"', '_')
         safe = safe.replace('<', '_').replace('>', '_')
         safe = safe.replace('|', '_')
-
+        
         if not safe:
             safe = "unnamed_file"
         
@@ -199,6 +1071,168 @@ class TCPServerFixed:
         
         return safe
     
+    def stop(self):
+        """Остановка сервера"""
+        self.running = False
+        # Движок asyncio ждет в sock_accept - прерываем ожидание из любого потока
+        if self.loop and self.accept_task:
+            try:
+                self.loop.call_soon_threadsafe(self.accept_task.cancel)
+            except RuntimeError:
+                pass
+
+
+def _run_worker(worker_id, host, port, options, stats, stop_flag, supervisor_pid, listen_socket):
+    """Процесс-обработчик TCPServerPool"""
+    server = TCPServerFixed(host=host, port=port, stats=stats, worker_id=worker_id,
+                            reuse_port=listen_socket is None, listen_socket=listen_socket,
+                            **options)
+    
+    # Супервизор просит завершиться через общий флаг. Флаг опрашивается, а не
+    # ждется на multiprocessing.Event: убитый обработчик оставил бы Event
+    # в несогласованном состоянии. Если супервизор умер - тоже завершаемся
+    def wait_stop():
+        while not stop_flag.value and os.getppid() == supervisor_pid:
+            time.sleep(0.5)
+        server.stop()
+    threading.Thread(target=wait_stop, daemon=True).start()
+    
+    server.start()
+
+
+class TCPServerPool:
+    """Несколько процессов TCPServerFixed на одном порту.
+    
+    Каждый процесс принимает соединения сам и не делит GIL с остальными.
+    Если есть SO_REUSEPORT, каждый обработчик открывает свой слушающий сокет
+    и соединения распределяет ядро; иначе супервизор открывает один сокет
+    и передает его обработчикам. Супервизор перезапускает упавшие процессы
+    и печатает общую статистику.
+    """
+    def __init__(self, host='0.0.0.0', port=8888, workers=None, download_dir=None,
+                 reuse_port=None, stats_interval=5.0, **options):
+        self.host = host
+        self.port = port
+        self.workers = workers or os.cpu_count() or 1
+        if reuse_port is None:
+            reuse_port = hasattr(socket, 'SO_REUSEPORT')
+        self.reuse_port = reuse_port
+        self.stats_interval = stats_interval
+        
+        if download_dir is None:
+            download_dir = Path(__file__).parent.absolute() / "server_downloads"
+        self.download_dir = Path(download_dir)
+        self.download_dir.mkdir(exist_ok=True)
+        options['download_dir'] = str(self.download_dir)
+        self.options = options
+        
+        # Счетчики каждого слота живут дольше процесса и переживают перезапуск
+        self.stats = [multiprocessing.Array('q', STATS_FIELDS, lock=False) for _ in range(self.workers)]
+        self.processes = [None] * self.workers
+        self.started_at = [0.0] * self.workers
+        self.restarts = 0
+        self.stop_flag = multiprocessing.RawValue('b', 0)
+        self.listen_socket = None
+        self.running = False
+        
+        print("="*70)
+        print("  TCP ФАЙЛОВЫЙ СЕРВЕР (несколько процессов)")
+        print("="*70)
+        print(f" Файлы сохраняются в: {self.download_dir}")
+        print(f" Адрес: {host}:{port}")
+        print(f" Процессов: {self.workers}")
+        print(f" Распределение: {'SO_REUSEPORT' if self.reuse_port else 'общий слушающий сокет'}")
+        print(f" Движок: {options.get('engine', 'threads')}")
+        if options.get('dedup'):
+            print(" Хранилище без дубликатов: включено")
+        if options.get('durability', disk_writer.SYNC_NONE) != disk_writer.SYNC_NONE:
+            print(f" Надежность записи: {options['durability']}")
+        print("="*70)
+    
+    def spawn(self, index):
+        """Запустить обработчик в слоте index"""
+        process = multiprocessing.Process(
+            target=_run_worker,
+            args=(index + 1, self.host, self.port, self.options, self.stats[index],
+                  self.stop_flag, os.getpid(), self.listen_socket)
+        )
+        process.daemon = True
+        process.start()
+        self.processes[index] = process
+        self.started_at[index] = time.time()
+    
+    def totals(self):
+        """Сумма счетчиков всех процессов"""
+        return [sum(stats[field] for stats in self.stats) for field in range(STATS_FIELDS)]
+    
+    def print_stats(self):
+        connections, files, errors, received = self.totals()
+        alive = sum(1 for p in self.processes if p is not None and p.is_alive())
+        print(f" Статистика: процессов {alive}/{self.workers}, подключений {connections}, "
+              f"файлов {files}, ошибок {errors}, принято {received / (1024 * 1024):.1f} МБ, "
+              f"перезапусков {self.restarts}")
+    
+    def start(self):
+        """Запуск обработчиков и наблюдение за ними"""
+        if not self.reuse_port:
+            self.listen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self.listen_socket.bind((self.host, self.port))
+            self.listen_socket.listen(self.options.get('backlog', 128))
+        
+        self.running = True
+        for index in range(self.workers):
+            self.spawn(index)
+        
+        print("\n Сервер запущен и готов принимать файлы!")
+        print(" Ожидание подключений... (Ctrl+C для остановки)\n")
+        
+        last_report = time.time()
+        last_totals = self.totals()
+        try:
+            while self.running:
+                time.sleep(0.5)
+                
+                # Перезапуск упавших обработчиков; тот, что падает сразу
+                # после старта, перезапускается не чаще раза в секунду
+                for index, process in enumerate(self.processes):
+                    if process.is_alive() or not self.running:
+                        continue
+                    if time.time() - self.started_at[index] < 1.0:
+                        continue
+                    print(f" Процесс-обработчик #{index + 1} завершился (код {process.exitcode}), перезапуск")
+                    self.restarts += 1
+                    self.spawn(index)
+                
+                if time.time() - last_report >= self.stats_interval:
+                    last_report = time.time()
+                    totals = self.totals()
+                    if totals != last_totals:
+                        last_totals = totals
+                        self.print_stats()
+        except KeyboardInterrupt:
+            print("\n Остановка сервера...")
+        finally:
+            self.running = False
+            self.stop_flag.value = 1
+            for process in self.processes:
+                if process is not None:
+                    process.join(5.0)
+                    if process.is_alive():
+                        process.terminate()
+                        process.join()
+            if self.listen_socket:
+                self.listen_socket.close()
+            
+            print("\n" + "="*70)
+            print(" ИТОГИ РАБОТЫ СЕРВЕРА:")
+            for index, stats in enumerate(self.stats):
+                print(f"   Процесс #{index + 1}: подключений {stats[STAT_CONNECTIONS]}, "
+                      f"файлов {stats[STAT_FILES]}, ошибок {stats[STAT_ERRORS]}")
+            self.print_stats()
+            print(f" Папка с файлами: {self.download_dir}")
+            print(" Сервер остановлен")
+    
     def stop(self):
         """Остановка сервера"""
         self.running = False
@@ -213,6 +1247,18 @@ if __name__ == "__main__":
     port_input = input("Порт [8888]: ").strip()
     port = int(port_input) if port_input else 8888
     
+    engine = input("Движок [threads/asyncio] (threads): ").strip() or "threads"
+    workers_input = input(f"Процессов [1, все ядра - {os.cpu_count()}]: ").strip()
+    workers = int(workers_input) if workers_input else 1
+    dedup = input("Хранить одинаковые файлы один раз [y/N]: ").strip().lower() in ('y', 'yes', 'д', 'да')
+    durability = input("Надежность записи [none/file/group] (none): ").strip() or disk_writer.SYNC_NONE
+    if durability not in disk_writer.SYNC_POLICIES:
+        durability = disk_writer.SYNC_NONE
+    
     # Запускаем
-    server = TCPServerFixed(host=host, port=port)
+    if workers > 1:
+        server = TCPServerPool(host=host, port=port, workers=workers, engine=engine, dedup=dedup,
+                               durability=durability)
+    else:
+        server = TCPServerFixed(host=host, port=port, engine=engine, dedup=dedup, durability=durability)
     server.start()
\ No newline at end of file
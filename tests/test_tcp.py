@@ -0,0 +1,182 @@
+"""
+Проверки TCP клиента и сервера через loopback
+Обычная передача, докачка после обрыва, несовпадение контрольной суммы,
+файл из хранилища (dedup), передача изменений (delta) и фиксация пачкой (durability='group')
+
+python -m unittest discover tests
+"""
+
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import types
+import unittest
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import disk_writer
+import hashing
+import tcp_client
+import tcp_server
+
+
+def free_port():
+    """Свободный порт на loopback"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class BadDigest:
+    """Контрольная сумма, которая не совпадет с суммой сервера"""
+    def __init__(self, hasher):
+        self.hasher = hasher
+        self.name = getattr(hasher, 'name', None)
+
+    def update(self, data):
+        self.hasher.update(data)
+
+    def digest(self):
+        return bytes(len(self.hasher.digest()))
+
+    def hexdigest(self):
+        return self.digest().hex()
+
+
+def bad_hashing():
+    """Модуль hashing для клиента, у которого все суммы неверные"""
+    module = types.SimpleNamespace(**vars(hashing))
+    module.new_hasher = lambda *args: BadDigest(hashing.new_hasher(*args))
+    return module
+
+
+class ServerCase:
+    """Сервер в потоке на время класса проверок"""
+    durability = disk_writer.SYNC_NONE
+
+    @classmethod
+    def setUpClass(cls):
+        # print сервера и клиента идет из многих потоков - заглушается в самих модулях
+        cls.quiet = [mock.patch.object(module, 'print', lambda *args, **kwargs: None, create=True)
+                     for module in (tcp_server, tcp_client)]
+        for patch in cls.quiet:
+            patch.start()
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.download_dir = Path(cls.tmp.name) / 'downloads'
+        cls.source_dir = Path(cls.tmp.name) / 'source'
+        cls.source_dir.mkdir()
+        cls.port = free_port()
+        cls.server = tcp_server.TCPServerFixed('127.0.0.1', cls.port, download_dir=cls.download_dir,
+                                               dedup=True, durability=cls.durability)
+        cls.thread = threading.Thread(target=cls.server.start, daemon=True)
+        cls.thread.start()
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(('127.0.0.1', cls.port), timeout=1).close()
+                break
+            except OSError:
+                time.sleep(0.05)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        cls.thread.join(5)
+        cls.tmp.cleanup()
+        for patch in cls.quiet:
+            patch.stop()
+
+    def make_file(self, name, data):
+        path = self.source_dir / name
+        path.write_bytes(data)
+        return str(path)
+
+    def send(self, path, **options):
+        client = tcp_client.TCPClientSimple('127.0.0.1', self.port, **options)
+        try:
+            return client.connect() and client.send_file(path)
+        finally:
+            client.disconnect()
+
+    def received_bytes(self):
+        return self.server.stats[tcp_server.STAT_BYTES]
+
+
+class TCPTransferTest(ServerCase, unittest.TestCase):
+    def test_plain_transfer(self):
+        data = os.urandom(1024 * 1024 + 7)
+        self.assertTrue(self.send(self.make_file('plain.bin', data)))
+        self.assertEqual((self.download_dir / 'plain.bin').read_bytes(), data)
+
+    def test_resume_after_interruption(self):
+        data = os.urandom(tcp_client.RESUME_MIN_SIZE * 2 + 5)
+        path = self.make_file('resume.bin', data)
+
+        def interrupt(done, total):
+            if done > total // 2:
+                raise ConnectionError("обрыв (тест)")
+        self.assertFalse(self.send(path, progress_callback=interrupt))
+        self.assertFalse((self.download_dir / 'resume.bin').exists())
+
+        before = self.received_bytes()
+        self.assertTrue(self.send(path))
+        self.assertEqual((self.download_dir / 'resume.bin').read_bytes(), data)
+        # Повторная отправка передала только то, чего у сервера не было
+        self.assertLess(self.received_bytes() - before, len(data))
+
+    def test_checksum_mismatch(self):
+        path = self.make_file('mismatch.bin', os.urandom(200000))
+        with mock.patch.object(tcp_client, 'hashing', bad_hashing()):
+            self.assertFalse(self.send(path))
+        self.assertFalse((self.download_dir / 'mismatch.bin').exists())
+
+    def test_dedup_hit(self):
+        data = os.urandom(256 * 1024)
+        self.assertTrue(self.send(self.make_file('dedup.bin', data), dedup=True))
+
+        before = self.received_bytes()
+        self.assertTrue(self.send(self.make_file('dedup_copy.bin', data), dedup=True))
+        self.assertEqual(self.received_bytes(), before)
+        self.assertEqual((self.download_dir / 'dedup_copy.bin').read_bytes(), data)
+
+    def test_delta_round_trip(self):
+        base = os.urandom(4 * 1024 * 1024)
+        path = self.make_file('delta.bin', base)
+        self.assertTrue(self.send(path, delta=True))
+
+        changed = bytearray(base)
+        changed[1000:1010] = b'0123456789'
+        Path(path).write_bytes(changed)
+        before = self.received_bytes()
+        self.assertTrue(self.send(path, delta=True))
+        self.assertLess(self.received_bytes() - before, len(base) // 10)
+        self.assertEqual((self.download_dir / 'delta_1.bin').read_bytes(), changed)
+
+
+class TCPGroupCommitTest(ServerCase, unittest.TestCase):
+    durability = disk_writer.SYNC_GROUP
+
+    def test_reply_after_group_commit(self):
+        files = {f'group_{i}.bin': os.urandom(300000 + i) for i in range(4)}
+        results = {}
+
+        def send(name):
+            ok = self.send(self.make_file(name, files[name]))
+            # SUCCESS приходит после переноса и fsync пачки - файл уже на месте
+            results[name] = ok and (self.download_dir / name).read_bytes() == files[name]
+        threads = [threading.Thread(target=send, args=(name,)) for name in files]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, {name: True for name in files})
+        self.assertEqual(list(self.download_dir.glob('.partial/*')), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
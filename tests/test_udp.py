@@ -0,0 +1,194 @@
+"""
+Проверки UDP клиента и сервера через loopback
+Обычная передача, докачка после обрыва, несовпадение контрольной суммы,
+файл из хранилища (dedup), передача изменений (delta) и фиксация пачкой (durability='group')
+
+python -m unittest discover tests
+"""
+
+import contextlib
+import io
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import types
+import unittest
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import disk_writer
+import hashing
+import udp_client
+import udp_server
+
+
+def free_port():
+    """Свободный порт на loopback"""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class BadDigest:
+    """Контрольная сумма, которая не совпадет с суммой сервера"""
+    def __init__(self, hasher):
+        self.hasher = hasher
+        self.name = getattr(hasher, 'name', None)
+
+    def update(self, data):
+        self.hasher.update(data)
+
+    def digest(self):
+        return bytes(len(self.hasher.digest()))
+
+    def hexdigest(self):
+        return self.digest().hex()
+
+
+def bad_hashing():
+    """Модуль hashing для клиента, у которого все суммы неверные"""
+    module = types.SimpleNamespace(**vars(hashing))
+    module.new_hasher = lambda *args: BadDigest(hashing.new_hasher(*args))
+    return module
+
+
+def stop_loop():
+    """Вместо приема пакетов - выход из цикла сервера, как по Ctrl+C"""
+    raise KeyboardInterrupt
+
+
+class ServerCase:
+    """Сервер в потоке на время класса проверок. Папка received_files у сервера
+    относительная, поэтому проверки идут во временной рабочей папке"""
+    durability = disk_writer.SYNC_NONE
+
+    @classmethod
+    def setUpClass(cls):
+        cls.cwd = os.getcwd()
+        cls.tmp = tempfile.TemporaryDirectory()
+        os.chdir(cls.tmp.name)
+        cls.download_dir = Path(cls.tmp.name) / 'received_files'
+        cls.source_dir = Path(cls.tmp.name) / 'source'
+        cls.source_dir.mkdir()
+        cls.port = free_port()
+        cls.server_output = io.StringIO()
+        with contextlib.redirect_stdout(cls.server_output):
+            cls.server = udp_server.UDPServerSimple('127.0.0.1', cls.port, dedup=True,
+                                                    durability=cls.durability)
+        cls.thread = threading.Thread(target=cls.run_server, daemon=True)
+        cls.thread.start()
+
+    @classmethod
+    def run_server(cls):
+        with contextlib.redirect_stdout(cls.server_output):
+            cls.server.run()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.io.recv_batch = stop_loop
+        cls.thread.join(5)
+        os.chdir(cls.cwd)
+        cls.tmp.cleanup()
+
+    def make_file(self, name, data):
+        path = self.source_dir / name
+        path.write_bytes(data)
+        return str(path)
+
+    def send(self, path, max_retries=3, **options):
+        """Отправка новым клиентом; возвращает (успех, вывод клиента)"""
+        client = udp_client.UDPClientSimple('127.0.0.1', self.port, **options)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            ok = client.send_file(path, max_retries=max_retries)
+        return ok, output.getvalue()
+
+    def received(self, name):
+        return (self.download_dir / name).read_bytes()
+
+
+class UDPTransferTest(ServerCase, unittest.TestCase):
+    def test_plain_transfer(self):
+        data = os.urandom(1024 * 1024 + 7)
+        ok, _ = self.send(self.make_file('plain.bin', data))
+        self.assertTrue(ok)
+        self.assertEqual(self.received('plain.bin'), data)
+
+    def test_resume_after_interruption(self):
+        data = os.urandom(8 * 1024 * 1024 + 5)
+        path = self.make_file('resume.bin', data)
+
+        def interrupt(done, total):
+            if done > total // 2:
+                raise ConnectionError("обрыв (тест)")
+        ok, _ = self.send(path, max_retries=1, progress_callback=interrupt)
+        self.assertFalse(ok)
+        self.assertFalse((self.download_dir / 'resume.bin').exists())
+
+        # Новый клиент получает принятую часть, когда старая передача замолчала
+        time.sleep(udp_server.RESUME_IDLE * 1.5)
+        ok, output = self.send(path)
+        self.assertTrue(ok)
+        self.assertIn("докачка", output)
+        self.assertEqual(self.received('resume.bin'), data)
+
+    def test_checksum_mismatch(self):
+        path = self.make_file('mismatch.bin', os.urandom(200000))
+        with mock.patch.object(udp_client, 'hashing', bad_hashing()):
+            ok, _ = self.send(path, max_retries=1)
+        self.assertFalse(ok)
+        self.assertFalse((self.download_dir / 'mismatch.bin').exists())
+
+    def test_dedup_hit(self):
+        data = os.urandom(256 * 1024)
+        ok, _ = self.send(self.make_file('dedup.bin', data), dedup=True)
+        self.assertTrue(ok)
+
+        ok, output = self.send(self.make_file('dedup_copy.bin', data), dedup=True)
+        self.assertTrue(ok)
+        self.assertIn("Файл уже есть на сервере", output)
+        self.assertEqual(self.received('dedup_copy.bin'), data)
+
+    def test_delta_round_trip(self):
+        base = os.urandom(4 * 1024 * 1024)
+        path = self.make_file('delta.bin', base)
+        ok, _ = self.send(path, delta=True)
+        self.assertTrue(ok)
+
+        changed = bytearray(base)
+        changed[1000:1010] = b'0123456789'
+        Path(path).write_bytes(changed)
+        ok, output = self.send(path, delta=True)
+        self.assertTrue(ok)
+        self.assertIn("Изменения: новых данных", output)
+        self.assertEqual(self.received('delta_1.bin'), changed)
+
+
+class UDPGroupCommitTest(ServerCase, unittest.TestCase):
+    durability = disk_writer.SYNC_GROUP
+
+    def test_reply_after_group_commit(self):
+        files = {f'group_{i}.bin': os.urandom(300000 + i) for i in range(4)}
+        paths = {name: self.make_file(name, data) for name, data in files.items()}
+        results = {}
+
+        def send(name):
+            ok, _ = self.send(paths[name])
+            # Подтверждение приходит после переноса и fsync пачки - файл уже на месте
+            results[name] = ok and self.received(name) == files[name]
+        threads = [threading.Thread(target=send, args=(name,)) for name in files]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, {name: True for name in files})
+        self.assertEqual(list(self.download_dir.glob('.partial/*')), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,207 @@
+"""
+Пакетный ввод-вывод датаграмм для UDP клиента и сервера
+Linux: sendmmsg/recvmmsg через ctypes - много пакетов за один системный вызов
+Остальные ОС: цикл recvfrom_into по заранее выделенному кольцу буферов
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import socket
+import struct
+import sys
+
+
+class _IOVec(ctypes.Structure):
+    _fields_ = [('iov_base', ctypes.c_void_p), ('iov_len', ctypes.c_size_t)]
+
+
+class _MsgHdr(ctypes.Structure):
+    _fields_ = [
+        ('msg_name', ctypes.c_void_p),
+        ('msg_namelen', ctypes.c_uint32),
+        ('msg_iov', ctypes.POINTER(_IOVec)),
+        ('msg_iovlen', ctypes.c_size_t),
+        ('msg_control', ctypes.c_void_p),
+        ('msg_controllen', ctypes.c_size_t),
+        ('msg_flags', ctypes.c_int),
+    ]
+
+
+class _MMsgHdr(ctypes.Structure):
+    _fields_ = [('msg_hdr', _MsgHdr), ('msg_len', ctypes.c_uint)]
+
+
+def _load_libc():
+    """libc с sendmmsg/recvmmsg или None, если их нет"""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+        libc.sendmmsg.restype = ctypes.c_int
+        libc.recvmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+        libc.recvmmsg.restype = ctypes.c_int
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+_libc = _load_libc()
+HAVE_MMSG = _libc is not None
+
+MSG_DONTWAIT = getattr(socket, 'MSG_DONTWAIT', 0x40)
+SOCKADDR_SIZE = 128  # sizeof(struct sockaddr_storage)
+_RETRY_ERRORS = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR)
+
+
+class BatchSocket:
+    """Обертка над UDP сокетом: отправка и прием пачками датаграмм"""
+    def __init__(self, sock, batch_size=64, buffer_size=65536, use_mmsg=True):
+        self.sock = sock
+        self.batch_size = batch_size
+        self.buffer_size = buffer_size
+        self.use_mmsg = use_mmsg and HAVE_MMSG and sock.family == socket.AF_INET
+
+        # Кольцо буферов приема выделяется один раз. Датаграммы из recv_batch
+        # ссылаются на эти буферы и действительны до следующего вызова
+        self.buffers = [bytearray(buffer_size) for _ in range(batch_size)]
+        self.views = [memoryview(buf) for buf in self.buffers]
+        self._addr_cache = {}
+        self._sockaddr_cache = {}
+
+        if self.use_mmsg:
+            self._setup_vectors()
+
+    def _setup_vectors(self):
+        """Заранее построенные структуры mmsghdr для recvmmsg и sendmmsg"""
+        n = self.batch_size
+        self._recv_iov = (_IOVec * n)()
+        self._recv_names = [ctypes.create_string_buffer(SOCKADDR_SIZE) for _ in range(n)]
+        self._recv_vec = (_MMsgHdr * n)()
+        self._recv_data = []
+        for i, buf in enumerate(self.buffers):
+            cbuf = (ctypes.c_char * self.buffer_size).from_buffer(buf)
+            self._recv_data.append(cbuf)
+            self._recv_iov[i].iov_base = ctypes.addressof(cbuf)
+            self._recv_iov[i].iov_len = self.buffer_size
+            hdr = self._recv_vec[i].msg_hdr
+            hdr.msg_name = ctypes.addressof(self._recv_names[i])
+            hdr.msg_iov = ctypes.pointer(self._recv_iov[i])
+            hdr.msg_iovlen = 1
+
+        self._send_iov = (_IOVec * n)()
+        self._send_vec = (_MMsgHdr * n)()
+        for i in range(n):
+            hdr = self._send_vec[i].msg_hdr
+            hdr.msg_iov = ctypes.pointer(self._send_iov[i])
+            hdr.msg_iovlen = 1
+
+    def _wait(self, writing=False):
+        """Дождаться готовности сокета с учетом его таймаута"""
+        timeout = self.sock.gettimeout()
+        if timeout == 0:
+            return
+        if writing:
+            ready = select.select([], [self.sock], [], timeout)[1]
+        else:
+            ready = select.select([self.sock], [], [], timeout)[0]
+        if not ready:
+            raise socket.timeout('timed out')
+
+    def _parse_addr(self, name):
+        """sockaddr_in -> (ip, порт), с кэшем"""
+        key = name.raw[2:8]
+        addr = self._addr_cache.get(key)
+        if addr is None:
+            port = struct.unpack_from('!H', key, 0)[0]
+            addr = (socket.inet_ntoa(key[2:6]), port)
+            if len(self._addr_cache) > 4096:
+                self._addr_cache.clear()
+            self._addr_cache[key] = addr
+        return addr
+
+    def _sockaddr(self, addr):
+        """(хост, порт) -> буфер struct sockaddr_in, с кэшем"""
+        buf = self._sockaddr_cache.get(addr)
+        if buf is None:
+            ip = socket.gethostbyname(addr[0])
+            raw = struct.pack('=H', socket.AF_INET) + struct.pack('!H', addr[1])
+            raw += socket.inet_aton(ip) + bytes(8)
+            buf = ctypes.create_string_buffer(raw, len(raw))
+            self._sockaddr_cache[addr] = buf
+        return buf
+
+    def recv_batch(self):
+        """Принять до batch_size датаграмм -> список (memoryview, адрес)
+
+        Ждет первую датаграмму не дольше таймаута сокета (socket.timeout),
+        остальные забирает без ожидания
+        """
+        if self.use_mmsg:
+            self._wait()
+            for i in range(self.batch_size):
+                hdr = self._recv_vec[i].msg_hdr
+                hdr.msg_namelen = SOCKADDR_SIZE
+                hdr.msg_flags = 0
+            count = _libc.recvmmsg(self.sock.fileno(), self._recv_vec, self.batch_size, MSG_DONTWAIT, None)
+            if count < 0:
+                err = ctypes.get_errno()
+                if err in _RETRY_ERRORS:
+                    return []
+                raise OSError(err, os.strerror(err))
+            return [(self.views[i][:self._recv_vec[i].msg_len], self._parse_addr(self._recv_names[i]))
+                    for i in range(count)]
+
+        # Запасной путь: recvfrom_into по кольцу буферов
+        nbytes, addr = self.sock.recvfrom_into(self.buffers[0])
+        packets = [(self.views[0][:nbytes], addr)]
+        timeout = self.sock.gettimeout()
+        self.sock.settimeout(0)
+        try:
+            for i in range(1, self.batch_size):
+                try:
+                    nbytes, addr = self.sock.recvfrom_into(self.buffers[i])
+                except (BlockingIOError, InterruptedError):
+                    break
+                packets.append((self.views[i][:nbytes], addr))
+        finally:
+            self.sock.settimeout(timeout)
+        return packets
+
+    def send_batch(self, items):
+        """Отправить список (данные, адрес) минимальным числом системных вызовов"""
+        if not self.use_mmsg or len(items) == 1:
+            for data, addr in items:
+                self.sock.sendto(data, addr)
+            return
+
+        for start in range(0, len(items), self.batch_size):
+            part = items[start:start + self.batch_size]
+            keep = []  # ссылки на буферы до конца вызова
+            for i, (data, addr) in enumerate(part):
+                if not isinstance(data, bytes):
+                    data = bytes(data)
+                keep.append(data)
+                name = self._sockaddr(addr)
+                self._send_iov[i].iov_base = ctypes.cast(ctypes.c_char_p(data), ctypes.c_void_p).value
+                self._send_iov[i].iov_len = len(data)
+                hdr = self._send_vec[i].msg_hdr
+                hdr.msg_name = ctypes.addressof(name)
+                hdr.msg_namelen = ctypes.sizeof(name)
+
+            sent = 0
+            while sent < len(part):
+                offset = sent * ctypes.sizeof(_MMsgHdr)
+                count = _libc.sendmmsg(self.sock.fileno(), ctypes.byref(self._send_vec, offset),
+                                       len(part) - sent, 0)
+                if count < 0:
+                    err = ctypes.get_errno()
+                    if err in _RETRY_ERRORS:
+                        # Буфер отправки полон - ждем, как обычный sendto
+                        self._wait(writing=True)
+                        continue
+                    raise OSError(err, os.strerror(err))
+                sent += count
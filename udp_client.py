@@ -4,20 +4,117 @@ import struct
 import os
 import sys
 import time
+import random
+import mmap
+import tempfile
+
+import compression
+import delta
+import hashing
+import udp_protocol as proto
+import udp_batch
+import udp_congestion
+
+# delta: если новых данных больше этой доли файла, он отправляется целиком
+DELTA_MAX_LITERAL = 0.5
+# Запросов подписей в полете; сервер читает и хэширует страницу основы - ответ дольше RTT
+SIGNATURE_WINDOW = 4
+SIGNATURE_WAIT = 0.5
+SIGNATURE_RETRIES = 5
+SIGNATURE_FIRST_RETRIES = 2  # пока сервер не ответил ни разу (старый сервер молчит)
 
 class UDPClientSimple:
-    def __init__(self, server_host='127.0.0.1', server_port=9999):
+    def __init__(self, server_host='127.0.0.1', server_port=9999, windowed=True, window_size=64,
+                 chunk_size=None, batch_io=True, progress_callback=None, resume=True,
+                 checksum=hashing.DEFAULT_ALGORITHM, chunk_crc=True, fec=0, rate_control='aimd',
+                 rate_limit=None, compress=compression.AUTO, dedup=False, delta=False):
         self.server_host = server_host
         self.server_port = server_port
         self.sock = None
-        self.timeout = 10.0  # Увеличиваем таймаут
+        self.timeout = 10.0  # Сколько ждать сервер, который совсем не отвечает
+        # Таймауты повтора по измеренному RTT (RFC 6298, см. udp_congestion.py): общие для всех
+        # файлов этого клиента, поэтому следующая передача сразу начинает с известного RTT
+        self.rtt = udp_congestion.RtoEstimator()
+        # id передачи одного файла: повторные попытки идут с тем же id, и сервер
+        # сразу отдает им докачку, не дожидаясь, пока прошлая попытка замолчит
+        self.transfer_id = None
+        
+        # Оконный режим (selective repeat): много блоков в полете,
+        # сервер подтверждает по номерам блоков, повторяются только потерянные
+        self.windowed = windowed
+        self.window_size = window_size
+        self.max_chunk_retries = 20    # Сколько раз можно повторить один блок
+        
+        # Размер блока: None - подобрать пробными пакетами (до jumbo/loopback),
+        # число - использовать как есть. Передается серверу в метаданных
+        self.chunk_size = chunk_size
+        self.max_chunk_size = proto.MAX_CHUNK_SIZE
+        self.max_in_flight_bytes = 4 * 1024 * 1024  # Не переполнять буфер приема сервера
+        self.last_chunk_size = None
+        
+        # Пачки пакетов за один системный вызов (sendmmsg/recvmmsg на Linux)
+        self.batch_io = batch_io
+        
+        # progress_callback(отправлено, всего) - вызывается по ходу отправки
+        self.progress_callback = progress_callback
+        
+        # Докачка (оконный режим): сервер хранит принятые блоки, и повторная
+        # попытка или перезапущенный клиент отправляют только недостающие
+        self.resume = resume
+        
+        # Контрольная сумма файла (оконный режим, см. hashing.py), None - только проверка размера
+        self.checksum = checksum
+        # CRC32 каждого блока: сервер просит повторить (NAK) только поврежденный блок
+        self.chunk_crc = chunk_crc
+        # Упреждающая коррекция (оконный режим): пакет четности на каждые fec блоков,
+        # потерю одного блока группы сервер исправляет без повтора. 0 - выключена,
+        # 8 - избыточность 12.5%, 4 - 25% (для каналов с большими потерями)
+        self.fec = fec
+        
+        # Управление скоростью (оконный режим, см. udp_congestion.py): 'aimd', 'ledbat',
+        # 'fixed' (постоянная скорость rate_limit) или None - без окна перегрузки.
+        # rate_limit - предел скорости в байтах в секунду для любого алгоритма
+        self.rate_control = rate_control
+        self.rate_limit = rate_limit
+        self.last_controller = None
         
+        # Сжатие блоков (оконный режим, см. compression.py): AUTO - лучший общий с сервером
+        # алгоритм, имя - только он, None - без сжатия. Несжимаемые файлы идут как есть
+        self.compress = compress
+        
+        # Метаданные v2 с 64-битным размером (файлы больше 4 ГБ). True - сервер их
+        # не понял и ответил на старый формат: следующие файлы сразу идут в старом
+        self.legacy_metadata = False
+    
+        # Без дубликатов (оконный режим): сумма всего файла (алгоритм checksum) идет в метаданных,
+        # и файл, который уже есть в хранилище сервера, не передается. Стоит лишнего чтения файла
+        self.dedup = dedup
+        self.file_digest = None
+    
+        # Передача изменений (оконный режим, см. delta.py): если у сервера есть прежняя версия
+        # файла с тем же именем, вместо файла идет поток команд - новые данные и ссылки на блоки
+        # прежней версии. Поток готовится во временном файле один раз на все попытки
+        self.delta = delta
+        self.delta_stream = None       # (путь потока, параметры 'delta'), False - без изменений
+        self.delta_unsupported = False # сервер не ответил на запрос подписей (старый)
+    
     def create_socket(self):
         """Создание нового сокета"""
         if self.sock:
             self.sock.close()
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         self.sock.settimeout(self.timeout)
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 4 * 1024 * 1024)
+        except OSError:
+            pass
+        # Запрет фрагментации (Linux): пакет больше MTU пути не дойдет,
+        # поэтому пробные пакеты честно показывают допустимый размер
+        if self.windowed and hasattr(socket, 'IP_MTU_DISCOVER'):
+            try:
+                self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MTU_DISCOVER, socket.IP_PMTUDISC_DO)
+            except OSError:
+                pass
         
     def send_file(self, file_path, max_retries=3):
         """Отправка файла с повторными попытками"""
@@ -25,19 +122,41 @@ class UDPClientSimple:
             print(f"Ошибка: файл '{file_path}' не найден")
             return False
         
-        for attempt in range(max_retries):
-            print(f"\nПопытка {attempt + 1}/{max_retries}")
-            if self._send_single_attempt(file_path):
-                return True
-            if attempt < max_retries - 1:
-                print("Повторная попытка через 3 секунды...")
-                time.sleep(3)
+        self.transfer_id = random.getrandbits(32)
+        # Сумма для хранилища сервера считается один раз на все попытки
+        self.file_digest = None
+        if self.dedup and self.windowed and self.checksum:
+            hasher = hashing.new_hasher(self.checksum)
+            with open(file_path, 'rb') as f:
+                hashing.update_from_file(hasher, f, os.path.getsize(file_path))
+            self.file_digest = hasher.hexdigest()
+        self.delta_stream = None
+        try:
+            for attempt in range(max_retries):
+                print(f"\nПопытка {attempt + 1}/{max_retries}")
+                if self._send_single_attempt(file_path):
+                    return True
+                if self.chunk_size is None and self.last_chunk_size:
+                    # Большие пакеты могли теряться - в следующий раз пробуем меньше
+                    self.max_chunk_size = max(proto.DEFAULT_CHUNK_SIZE, self.last_chunk_size - 1)
+                if attempt < max_retries - 1:
+                    delay = self.rtt.retry_delay(attempt)
+                    print(f"Повторная попытка через {delay:.2f} сек...")
+                    time.sleep(delay)
+        finally:
+            self.discard_delta_stream()
         
         print("\n✗ Не удалось отправить файл после всех попыток")
         return False
     
     def _send_single_attempt(self, file_path):
         """Одна попытка отправки файла"""
+        if self.windowed:
+            return self._send_windowed(file_path)
+        return self._send_stop_and_wait(file_path)
+    
+    def _send_stop_and_wait(self, file_path):
+        """Старый режим: каждый блок ждет свой ACK"""
         try:
             # Создаем сокет
             self.create_socket()
@@ -50,20 +169,16 @@ class UDPClientSimple:
             print(f"Сервер: {self.server_host}:{self.server_port}")
             print("-" * 40)
             
+            if file_size > proto.MAX_LEGACY_FILE_SIZE:
+                print("Ошибка: в режиме stop-and-wait файлы больше 4 ГБ не передаются")
+                return False
+            
             # Шаг 1: Отправляем метаданные
             filename_encoded = file_name.encode('utf-8')
             metadata = struct.pack('!BI', 1, file_size) + filename_encoded
             
             print("Отправка метаданных...")
-            self.sock.sendto(metadata, (self.server_host, self.server_port))
-            
-            # Ждем подтверждения метаданных
-            try:
-                data, _ = self.sock.recvfrom(1024)
-                if data != b'OK':
-                    print(f"Ошибка: сервер не подтвердил метаданные ({data})")
-                    return False
-            except socket.timeout:
+            if self._exchange(metadata, (b'OK',)) is None:
                 print("Ошибка: таймаут ожидания подтверждения метаданных")
                 return False
             
@@ -84,48 +199,25 @@ class UDPClientSimple:
                     packet = struct.pack('!BI', 2, chunk_id) + chunk
                     chunk_id += 1
                     
-                    # Отправляем пакет с попытками
-                    max_retries = 3
-                    for attempt in range(max_retries):
-                        try:
-                            self.sock.sendto(packet, (self.server_host, self.server_port))
-                            
-                            # Ждем подтверждения с меньшим таймаутом для ACK
-                            self.sock.settimeout(2.0)
-                            data, _ = self.sock.recvfrom(1024)
-                            self.sock.settimeout(self.timeout)
-                            
-                            if data == b'ACK':
-                                sent += len(chunk)
-                                break
-                            elif attempt == max_retries - 1:
-                                print(f"Ошибка: неверное подтверждение для блока {chunk_id}: {data}")
-                                return False
-                                
-                        except socket.timeout:
-                            if attempt == max_retries - 1:
-                                print(f"Ошибка: таймаут отправки блока {chunk_id}")
-                                return False
-                            print(f"  Повтор блока {chunk_id}, попытка {attempt + 1}")
-                            continue
+                    # Отправляем пакет, пока не придет ACK (повтор по таймауту RTO)
+                    if self._exchange(packet, (b'ACK',)) is None:
+                        print(f"Ошибка: таймаут отправки блока {chunk_id}")
+                        return False
+                    sent += len(chunk)
                     
                     # Показываем прогресс
                     if chunk_id % 10 == 0 or sent == file_size:
                         progress = (sent / file_size) * 100
                         print(f"\rПрогресс: {progress:.1f}% ({sent:,}/{file_size:,} байт)", end="")
+                        if self.progress_callback:
+                            self.progress_callback(sent, file_size)
             
             print(f"\nФайл отправлен, жду завершения...")
             
-            # Шаг 3: Отправляем сигнал завершения
+            # Шаг 3: Отправляем сигнал завершения и ждем финальное подтверждение
             end_packet = struct.pack('!B', 3)
-            self.sock.sendto(end_packet, (self.server_host, self.server_port))
-            
-            # Ждем финальное подтверждение
-            try:
-                self.sock.settimeout(5.0)
-                data, _ = self.sock.recvfrom(1024)
-                self.sock.settimeout(self.timeout)
-                
+            data = self._exchange(end_packet, (b'DONE', b'ERROR'))
+            if data is not None:
                 if data == b'DONE':
                     total_time = time.time() - start_time
                     speed = (file_size / total_time / 1024) if total_time > 0 else 0
@@ -136,9 +228,9 @@ class UDPClientSimple:
                     print(f"  Блоков отправлено: {chunk_id}")
                     return True
                 else:
-                    print(f"\nОшибка: неверный ответ от сервера: {data}")
+                    print(f"\nОшибка: сервер отклонил файл")
                     return False
-            except socket.timeout:
+            else:
                 print(f"\nОшибка: таймаут ожидания завершения")
                 # Проверяем, может файл уже получен сервером
                 print("  Возможно файл был получен, но подтверждение потеряно")
@@ -154,6 +246,649 @@ class UDPClientSimple:
                 self.sock.close()
                 self.sock = None
     
+    def _send_windowed(self, file_path):
+        """Оконный режим: selective repeat с выборочными подтверждениями"""
+        try:
+            self.create_socket()
+            server = (self.server_host, self.server_port)
+            
+            file_size = os.path.getsize(file_path)
+            file_name = os.path.basename(file_path)
+            
+            print(f"Отправка файла: {file_name}")
+            print(f"Размер: {file_size:,} байт")
+            print(f"Сервер: {self.server_host}:{self.server_port} (окно {self.window_size} блоков)")
+            print("-" * 40)
+            
+            chunk_size = self.chunk_size
+            if chunk_size is None:
+                chunk_size = self.probe_chunk_size()
+                print(f"Размер блока по результатам проверки пути: {chunk_size} байт")
+            self.last_chunk_size = chunk_size
+            
+            # Изменения: вместо файла отправляется поток команд, имя остается прежним
+            original_path, original_size = file_path, file_size
+            if self.delta and not self.delta_unsupported and file_size >= delta.DELTA_MIN_SIZE:
+                if self.delta_stream is None:
+                    self.delta_stream = self.prepare_delta(file_path, file_name, file_size, chunk_size) or False
+                if self.delta_stream:
+                    file_path = self.delta_stream[0]
+                    file_size = os.path.getsize(file_path)
+            
+            # Шаг 1: Метаданные с параметрами оконного режима
+            transfer_id = self.transfer_id if self.transfer_id is not None else random.getrandbits(32)
+            options = {
+                'mode': 'window',
+                'tid': transfer_id,
+                'chunk': chunk_size,
+                'window': self.window_size,
+            }
+            if self.resume:
+                options['key'] = proto.resume_key(file_name, file_size, os.stat(file_path).st_mtime_ns)
+            if self.checksum:
+                options['checksum'] = self.checksum
+            if self.chunk_crc:
+                options['crc'] = True
+            if self.fec:
+                options['fec'] = self.fec
+            if self.compress and file_size and compression.is_compressible(file_path):
+                offered = compression.available_algorithms() if self.compress == compression.AUTO else [self.compress]
+                options['compression'] = offered
+            if self.file_digest:
+                options['digest'] = self.file_digest
+            if file_path != original_path:
+                options['delta'] = self.delta_stream[1]
+            large = file_size > proto.MAX_LEGACY_FILE_SIZE
+            if (file_size + chunk_size - 1) // chunk_size > proto.MAX_CHUNK_COUNT:
+                print(f"Ошибка: слишком много блоков по {chunk_size} байт, нужен блок больше")
+                return False
+            
+            # Сначала метаданные v2, старый сервер их не знает - тогда старый формат
+            formats = [] if self.legacy_metadata else [proto.SUPPORTED_CAPS]
+            if not large:
+                formats.append(None)
+            
+            print("Отправка метаданных...")
+            params = None
+            for caps in formats:
+                metadata = proto.pack_metadata(file_size, file_name, options, caps)
+                for attempt in range(3):
+                    sent_at = time.monotonic()
+                    self.sock.sendto(metadata, server)
+                    params = self._wait_meta_ack(transfer_id, self.rtt.timeout())
+                    if params is not None:
+                        if attempt == 0:
+                            self.rtt.sample(time.monotonic() - sent_at)
+                        break
+                    self.rtt.backoff()
+                if params is not None:
+                    if caps is None and formats[0] is not None:
+                        print("Сервер не поддерживает метаданные v2, дальше старый формат")
+                        self.legacy_metadata = True
+                    break
+                self.rtt.reset_backoff()
+            
+            if large and not (params or {}).get('caps', 0) & proto.CAP_LARGE_FILES:
+                print("Ошибка: сервер не поддерживает файлы больше 4 ГБ")
+                return False
+            
+            if params is None:
+                # Старый сервер не понимает расширенные метаданные
+                print("Сервер не поддерживает оконный режим, переключаюсь на stop-and-wait")
+                self.sock.close()
+                self.sock = None
+                return self._send_stop_and_wait(original_path)
+            
+            if params.get('stored'):
+                print("\n✓ Файл уже есть на сервере, данные не отправлялись")
+                if self.progress_callback:
+                    self.progress_callback(original_size, original_size)
+                return True
+            
+            if 'delta' in options and not params.get('delta'):
+                print("Сервер не принял изменения (прежняя версия изменилась), отправка целиком")
+                self.discard_delta_stream()
+                self.sock.close()
+                self.sock = None
+                return self._send_windowed(original_path)
+            
+            chunk_size = params.get('chunk', chunk_size)
+            window = max(1, min(self.window_size, params.get('window', self.window_size)))
+            window = max(1, min(window, self.max_in_flight_bytes // chunk_size))
+            # Окно перегрузки и равномерный выпуск пакетов
+            controller = udp_congestion.make_controller(self.rate_control, chunk_size, self.rate_limit)
+            if controller is not None:
+                controller.max_cwnd = window * chunk_size
+            self.last_controller = controller
+            pacer = udp_congestion.TokenBucket()
+            # Сумма считается при чтении блоков для отправки, если сервер ее поддерживает
+            hasher = None
+            if self.checksum and params.get('checksum') == self.checksum:
+                hasher = hashing.new_hasher(self.checksum)
+            use_crc = self.chunk_crc and params.get('crc')
+            fec = params.get('fec', 0) if self.fec else 0
+            codec = params.get('compression')
+            if codec not in options.get('compression', ()):
+                codec = None
+            print("Метаданные подтверждены, отправляю файл...")
+            
+            io = udp_batch.BatchSocket(self.sock, batch_size=64, buffer_size=2048, use_mmsg=self.batch_io)
+            
+            # Шаг 2: Отправка блоков окном
+            chunk_count = (file_size + chunk_size - 1) // chunk_size
+            acked = bytearray(chunk_count)  # 1 - блок подтвержден сервером
+            sent = 0
+            missing = params.get('missing')
+            if missing is not None:
+                # Сервер уже принял часть файла - отправляем только недостающие блоки
+                acked = bytearray(b'\x01') * chunk_count
+                for start, end in missing:
+                    acked[start:end] = bytes(max(0, min(end, chunk_count) - start))
+                sent = params.get('have', 0)
+                if sent:
+                    print(f"Сервер уже получил {sent:,} байт, докачка")
+            acked_count = chunk_count - acked.count(0)
+            in_flight = {}  # номер блока -> [пакет, время отправки, повторы, быстрый повтор]
+            next_chunk = 0
+            cumulative = 0
+            retransmits = 0
+            corrupted = 0
+            parity_group = -1  # Группа, для которой копится четность
+            parity = parity_count = 0
+            parity_sent = 0
+            # Группы, четность которых ушла: одиночную потерю в них сервер восстановит сам
+            protected = bytearray((chunk_count + fec - 1) // fec) if fec else None
+            raw_bytes = packed_bytes = 0  # Блоки при первой отправке: до сжатия и на проводе
+            start_time = time.time()
+            last_scan = last_reply = time.monotonic()
+            
+            with open(file_path, 'rb') as f:
+                while acked_count < chunk_count:
+                    # Заполняем окно новыми блоками и отправляем их одной пачкой
+                    batch = []
+                    now = time.monotonic()
+                    paced = False  # Окно не заполнено только из-за выравнивания скорости
+                    if controller is not None:
+                        pacer.set_rate(controller.pacing_rate, chunk_size)
+                    while next_chunk < chunk_count and len(in_flight) < window:
+                        if acked[next_chunk]:
+                            # Блок уже есть у сервера (докачка)
+                            skip_to = acked.find(0, next_chunk)
+                            if skip_to < 0:
+                                skip_to = chunk_count
+                            if hasher is not None:
+                                # Сумма нужна по всему файлу: принятые блоки только читаются
+                                f.seek(next_chunk * chunk_size)
+                                hashing.update_from_file(hasher, f, min(file_size, skip_to * chunk_size)
+                                                         - next_chunk * chunk_size)
+                            next_chunk = skip_to
+                            continue
+                        if controller is not None and not controller.can_send(len(in_flight) * chunk_size):
+                            break
+                        if not pacer.try_take(chunk_size, now):
+                            paced = True
+                            break
+                        if f.tell() != next_chunk * chunk_size:
+                            f.seek(next_chunk * chunk_size)
+                        chunk = f.read(chunk_size)
+                        if hasher is not None:
+                            hasher.update(chunk)
+                        raw_bytes += len(chunk)
+                        packed = compression.compress(codec, chunk) if codec else None
+                        if packed is not None and len(packed) < len(chunk):
+                            packet = proto.pack_wdata_z(transfer_id, next_chunk, packed)
+                            packed_bytes += len(packed)
+                        elif use_crc:
+                            packet = proto.pack_wdata_crc(transfer_id, next_chunk, chunk)
+                            packed_bytes += len(chunk)
+                        else:
+                            packet = proto.WDATA_HEADER.pack(proto.PKT_WDATA, transfer_id, next_chunk) + chunk
+                            packed_bytes += len(chunk)
+                        batch.append((packet, server))
+                        in_flight[next_chunk] = [packet, now, 0, False]
+                        if fec:
+                            # Четность отправляется, только если вся группа ушла в этой попытке
+                            group = next_chunk // fec
+                            if group != parity_group:
+                                parity_group, parity, parity_count = group, 0, 0
+                            parity = proto.xor_into(parity, chunk)
+                            parity_count += 1
+                            if parity_count == min(fec, chunk_count - group * fec):
+                                batch.append((proto.pack_fec(transfer_id, group, parity, chunk_size), server))
+                                pacer.take(chunk_size)
+                                parity_sent += 1
+                                protected[group] = 1
+                        next_chunk += 1
+                    if batch:
+                        io.send_batch(batch)
+                    
+                    # Ждем подтверждений, но не дольше, чем до следующего разрешенного пакета
+                    if paced:
+                        self.sock.settimeout(max(0.0001, min(pacer.wait_time(chunk_size), self.rtt.rto / 2)))
+                    else:
+                        self.sock.settimeout(self.rtt.rto / 2)
+                    try:
+                        replies = io.recv_batch()
+                    except socket.timeout:
+                        replies = []
+                    except ConnectionResetError:
+                        # ICMP "порт недоступен" на Windows - сервер временно недоступен
+                        replies = []
+                    
+                    for data, _ in replies:
+                        if data[0] == proto.PKT_NAK and len(data) >= proto.NAK_HEADER.size:
+                            # Блоки пришли поврежденными - повторяем сразу, не дожидаясь таймаута
+                            tid, chunk_ids = proto.parse_nak(data)
+                            if tid != transfer_id:
+                                continue
+                            now = time.monotonic()
+                            for chunk_id in chunk_ids:
+                                entry = in_flight.get(chunk_id)
+                                if entry:
+                                    self.sock.sendto(entry[0], server)
+                                    pacer.take(len(entry[0]))
+                                    entry[1] = now
+                                    entry[2] += 1
+                                    corrupted += 1
+                            continue
+                        if data[0] != proto.PKT_SACK or len(data) < proto.SACK_HEADER.size:
+                            continue
+                        tid, cum, _, ranges = proto.parse_sack(data)
+                        if tid != transfer_id:
+                            continue
+                        last_reply = time.monotonic()
+                        
+                        # Кумулятивное подтверждение
+                        now = time.monotonic()
+                        newly_acked = 0
+                        rtt = None  # Замер только по блокам без повторов (алгоритм Карна)
+                        if cum > cumulative:
+                            for chunk_id in range(cumulative, min(cum, chunk_count)):
+                                if not acked[chunk_id]:
+                                    acked[chunk_id] = 1
+                                    acked_count += 1
+                                    entry = in_flight.pop(chunk_id, None)
+                                    if entry and not entry[2]:
+                                        rtt = now - entry[1]
+                                    newly_acked += min(chunk_size, file_size - chunk_id * chunk_size)
+                            cumulative = cum
+                        
+                        # Выборочные подтверждения и быстрый повтор дыр перед ними
+                        highest = cumulative
+                        for start, end in ranges:
+                            for chunk_id in range(start, min(end, chunk_count)):
+                                if not acked[chunk_id]:
+                                    acked[chunk_id] = 1
+                                    acked_count += 1
+                                    entry = in_flight.pop(chunk_id, None)
+                                    if entry and not entry[2]:
+                                        rtt = now - entry[1]
+                                    newly_acked += min(chunk_size, file_size - chunk_id * chunk_size)
+                            highest = max(highest, end)
+                        sent += newly_acked
+                        if rtt is not None:
+                            self.rtt.sample(rtt)
+                        if controller is not None and newly_acked:
+                            controller.on_ack(newly_acked, rtt, now)
+                        
+                        if ranges:
+                            for chunk_id in range(cumulative, highest - 3):
+                                entry = in_flight.get(chunk_id)
+                                if not entry or entry[3]:
+                                    continue
+                                if fec:
+                                    # Группа с четностью (отправленной или еще копящейся): блок считается
+                                    # потерянным, только когда после четности дошли еще 3 блока, а он
+                                    # так и не восстановлен - порог повтора не меньше размера группы
+                                    group = chunk_id // fec
+                                    pending = protected[group] or (group == parity_group
+                                                                   and parity_count == next_chunk - group * fec)
+                                    if pending and highest - 3 < min((group + 1) * fec, chunk_count):
+                                        continue
+                                self.sock.sendto(entry[0], server)
+                                pacer.take(len(entry[0]))
+                                entry[1] = now
+                                entry[2] += 1
+                                entry[3] = True
+                                retransmits += 1
+                                if controller is not None:
+                                    controller.on_loss(now)
+                        
+                        if acked_count % 64 == 0 or acked_count == chunk_count:
+                            progress = (sent / file_size) * 100 if file_size else 100
+                            print(f"\rПрогресс: {progress:.1f}% ({sent:,}/{file_size:,} байт)", end="")
+                            if self.progress_callback:
+                                self.progress_callback(sent, file_size)
+                    
+                    # Повтор блоков, для которых истек таймаут
+                    now = time.monotonic()
+                    if in_flight and now - last_reply > self.timeout:
+                        print(f"\nОшибка: сервер не отвечает {self.timeout:.0f} сек")
+                        return False
+                    if now - last_scan >= self.rtt.rto / 2:
+                        last_scan = now
+                        rto = self.rtt.timeout()
+                        expired = False
+                        for chunk_id, entry in in_flight.items():
+                            if now - entry[1] < rto:
+                                continue
+                            if entry[2] >= self.max_chunk_retries:
+                                print(f"\nОшибка: таймаут отправки блока {chunk_id}")
+                                return False
+                            self.sock.sendto(entry[0], server)
+                            pacer.take(len(entry[0]))
+                            entry[1] = now
+                            entry[2] += 1
+                            retransmits += 1
+                            expired = True
+                            if controller is not None:
+                                controller.on_loss(now)
+                        if expired:
+                            # Один откат на проверку: RTO удваивается до следующего замера RTT
+                            self.rtt.backoff()
+            
+                if hasher is not None and next_chunk < chunk_count:
+                    # Хвост файла целиком был у сервера - досчитываем сумму
+                    f.seek(next_chunk * chunk_size)
+                    hashing.update_from_file(hasher, f, file_size - next_chunk * chunk_size)
+            
+            print(f"\nФайл отправлен, жду завершения...")
+            
+            # Шаг 3: Сигнал завершения (с контрольной суммой файла)
+            end_packet = proto.WFIN_PACKET.pack(proto.PKT_WFIN, transfer_id)
+            if hasher is not None:
+                end_packet += hasher.digest()
+            give_up = time.monotonic() + self.timeout
+            while time.monotonic() < give_up:
+                self.sock.sendto(end_packet, server)
+                deadline = min(give_up, time.monotonic() + self.rtt.timeout())
+                while time.monotonic() < deadline:
+                    self.sock.settimeout(max(0.01, deadline - time.monotonic()))
+                    try:
+                        data, _ = self.sock.recvfrom(2048)
+                    except socket.timeout:
+                        break
+                    
+                    if data == b'DONE':
+                        total_time = time.time() - start_time
+                        speed = (file_size / total_time / 1024) if total_time > 0 else 0
+                        
+                        print(f"\n✓ Файл успешно отправлен!")
+                        print(f"  Время: {total_time:.2f} сек")
+                        print(f"  Скорость: {speed:.1f} КБ/с")
+                        print(f"  Блоков отправлено: {chunk_count} (повторов: {retransmits}, "
+                              f"повреждено в пути: {corrupted})")
+                        if fec:
+                            print(f"  Пакетов четности: {parity_sent} (1 на {fec} блоков)")
+                        if codec and raw_bytes:
+                            print(f"  Сжатие {codec}: на проводе {packed_bytes * 100 // raw_bytes}% данных")
+                        if controller is not None and controller.cwnd is not None:
+                            srtt = f", SRTT {controller.srtt * 1000:.2f} мс" if controller.srtt else ""
+                            print(f"  Управление скоростью: {controller.name}, "
+                                  f"окно {int(controller.cwnd) // 1024} КБ{srtt}")
+                        return True
+                    elif data == b'ERROR':
+                        print(f"\nОшибка: сервер отклонил файл")
+                        if self.delta_stream:
+                            # Сервер не собрал файл из изменений или сумма собранного не совпала -
+                            # тот же поток не поможет, следующая попытка отправит файл целиком
+                            print("  Следующая попытка - без изменений, файл целиком")
+                            self.discard_delta_stream()
+                        return False
+                self.rtt.backoff()
+            
+            print(f"\nОшибка: таймаут ожидания завершения")
+            # Блоки подтверждены, но файл сервер не подтвердил: проверка суммы или
+            # фиксация на диске могли не пройти - попытка считается неудачной
+            print("  Сервер не подтвердил прием файла")
+            return False
+        
+        except Exception as e:
+            print(f"\nОшибка отправки: {e}")
+            import traceback
+            traceback.print_exc()
+            return False
+        finally:
+            if self.sock:
+                self.sock.close()
+                self.sock = None
+    
+    def prepare_delta(self, file_path, file_name, file_size, chunk_size):
+        """Поток изменений относительно версии на сервере -> (путь потока, параметры 'delta') или None
+        
+        None - прежней версии нет, сервер не ответил или изменений слишком много
+        """
+        fetched = self.fetch_signature(file_name, chunk_size)
+        if fetched is None:
+            return None
+        signature, tag = fetched
+        hasher = hashing.new_hasher(self.checksum) if self.checksum else None
+        encoder = delta.DeltaEncoder(signature, hasher)
+        fd, stream_path = tempfile.mkstemp(prefix='delta_', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as stream, open(file_path, 'rb') as f, \
+                    mmap.mmap(f.fileno(), file_size, access=mmap.ACCESS_READ) as data:
+                for op, offset, length in encoder.ops(data):
+                    if op == delta.OP_COPY:
+                        stream.write(delta.pack_copy(offset, length))
+                        continue
+                    if encoder.literal_bytes > file_size * DELTA_MAX_LITERAL:
+                        print("Файл сильно изменился, отправка целиком")
+                        os.unlink(stream_path)
+                        return None
+                    stream.write(delta.pack_literal_header(length))
+                    stream.write(data[offset:offset + length])
+                stream.write(delta.OP_HEADER.pack(delta.OP_END))
+        except BaseException:
+            if os.path.exists(stream_path):
+                os.unlink(stream_path)
+            raise
+        info = {'size': file_size, 'base_size': signature.base_size, 'tag': tag}
+        if hasher is not None:
+            info['checksum'] = self.checksum
+            info['digest'] = hasher.hexdigest()
+        print(f"Изменения: новых данных {encoder.literal_bytes:,} байт, "
+              f"поток {os.path.getsize(stream_path):,} байт вместо {file_size:,}")
+        return stream_path, info
+    
+    def discard_delta_stream(self):
+        """Удалить временный файл потока изменений"""
+        if self.delta_stream and os.path.exists(self.delta_stream[0]):
+            os.unlink(self.delta_stream[0])
+        self.delta_stream = False
+    
+    def fetch_signature(self, file_name, chunk_size):
+        """Подписи блоков прежней версии файла на сервере -> (delta.Signature, tag) или None
+        
+        Подписи идут страницами, каждая в одном ответе не больше пакета данных.
+        Несколько запросов в полете, потерянные повторяются по таймауту
+        """
+        server = (self.server_host, self.server_port)
+        request_tag = random.getrandbits(32)
+        name = file_name.encode('utf-8')
+        page = max(1, min(0xFFFF, (chunk_size + proto.WDATA_CRC_HEADER.size - proto.SIG_HEADER.size)
+                          // delta.SIGNATURE_ENTRY.size))
+        pages = {}        # первый блок -> подписи
+        pending = [0]     # страницы, которые еще не запрошены
+        in_flight = {}    # первый блок -> [время запроса, повторы]
+        base = None       # (размер основы, tag, размер блока, блоков всего)
+        answered = False
+        
+        while pending or in_flight:
+            now = time.monotonic()
+            while pending and len(in_flight) < SIGNATURE_WINDOW:
+                first = pending.pop(0)
+                self.sock.sendto(proto.SIG_REQ_HEADER.pack(proto.PKT_SIG_REQ, request_tag, first, page) + name, server)
+                in_flight[first] = [now, 0]
+            
+            self.sock.settimeout(max(0.001, min(entry[0] for entry in in_flight.values())
+                                     + self.rtt.timeout() + SIGNATURE_WAIT - now))
+            try:
+                data, _ = self.sock.recvfrom(65536)
+            except (socket.timeout, ConnectionResetError):
+                data = None
+            
+            if data and data[0] == proto.PKT_SIG and len(data) >= proto.SIG_HEADER.size:
+                _, tag, first, base_size, base_tag, block, count = proto.SIG_HEADER.unpack_from(data)
+                if tag != request_tag or first not in in_flight:
+                    continue
+                answered = True
+                if base_size == 0:
+                    return None
+                if base is None:
+                    total = -(-base_size // block)
+                    if not delta.MIN_BLOCK_SIZE <= block <= delta.MAX_BLOCK_SIZE or count == 0:
+                        return None
+                    base = (base_size, base_tag, block, total)
+                    # Сервер мог ограничить страницу сильнее - дальше запросы по его размеру
+                    page = count
+                    pending = list(range(count, total, page))
+                elif (base_size, base_tag, block) != base[:3]:
+                    print("Прежняя версия файла на сервере изменилась, отправка целиком")
+                    return None
+                entries = data[proto.SIG_HEADER.size:proto.SIG_HEADER.size + count * delta.SIGNATURE_ENTRY.size]
+                if count != min(page, base[3] - first) or len(entries) != count * delta.SIGNATURE_ENTRY.size:
+                    return None
+                pages[first] = entries
+                del in_flight[first]
+                continue
+            
+            now = time.monotonic()
+            timeout = self.rtt.timeout() + SIGNATURE_WAIT
+            for first, entry in list(in_flight.items()):
+                if now - entry[0] < timeout:
+                    continue
+                if entry[1] >= (SIGNATURE_RETRIES if answered else SIGNATURE_FIRST_RETRIES):
+                    if not answered:
+                        print("Сервер не поддерживает передачу изменений")
+                        self.delta_unsupported = True
+                    return None
+                self.sock.sendto(proto.SIG_REQ_HEADER.pack(proto.PKT_SIG_REQ, request_tag, first, page) + name, server)
+                entry[0] = now
+                entry[1] += 1
+        
+        self.sock.settimeout(self.timeout)
+        base_size, base_tag, block, total = base
+        print(f"Подписи прежней версии: {total} блоков по {block} байт")
+        entries = b''.join(pages[first] for first in sorted(pages))
+        return delta.Signature(block, base_size, entries), base_tag
+    
+    def probe_chunk_size(self):
+        """Подбор размера блока: самый большой пробный пакет, на который ответил сервер"""
+        server = (self.server_host, self.server_port)
+        candidates = [size for size in proto.CHUNK_SIZE_CANDIDATES if size <= self.max_chunk_size]
+        if not candidates:
+            return min(self.max_chunk_size, proto.DEFAULT_CHUNK_SIZE)
+        
+        tag = random.getrandbits(32)
+        confirmed = set()
+        for attempt in range(2):
+            # Отправляем все размеры сразу, от большего к меньшему
+            for size in candidates:
+                if size in confirmed:
+                    continue
+                packet = proto.PROBE_HEADER.pack(proto.PKT_PROBE, tag, size) + bytes(size)
+                try:
+                    self.sock.sendto(packet, server)
+                except OSError:
+                    # Пакет больше, чем пропускает ОС или интерфейс
+                    continue
+            
+            sent_at = time.monotonic()
+            deadline = sent_at + 0.3
+            while candidates[0] not in confirmed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.sock.settimeout(remaining)
+                try:
+                    data, _ = self.sock.recvfrom(2048)
+                except (socket.timeout, ConnectionResetError):
+                    break
+                if data and data[0] == proto.PKT_PROBE_ACK and len(data) >= proto.PROBE_HEADER.size:
+                    _, probe_tag, size = proto.PROBE_HEADER.unpack_from(data)
+                    if probe_tag == tag:
+                        if not confirmed and attempt == 0:
+                            # Первый ответ - первый замер RTT для таймаутов передачи
+                            self.rtt.sample(time.monotonic() - sent_at)
+                        confirmed.add(size)
+            
+            if candidates[0] in confirmed:
+                break
+        
+        self.sock.settimeout(self.timeout)
+        if not confirmed:
+            return min(self.max_chunk_size, proto.DEFAULT_CHUNK_SIZE)
+        return max(confirmed)
+    
+    def _exchange(self, packet, expect):
+        """Stop-and-wait: повторять пакет по таймауту RTO, пока не придет один из ответов expect
+        
+        Остальные ответы (запоздавшие повторы) пропускаются. None - сервер не ответил за self.timeout
+        """
+        server = (self.server_host, self.server_port)
+        give_up = time.monotonic() + self.timeout
+        retried = False
+        while time.monotonic() < give_up:
+            sent_at = time.monotonic()
+            self.sock.sendto(packet, server)
+            deadline = min(give_up, sent_at + self.rtt.timeout())
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.sock.settimeout(remaining)
+                try:
+                    data, _ = self.sock.recvfrom(1024)
+                except socket.timeout:
+                    break
+                if data not in expect:
+                    continue
+                if not retried:
+                    self.rtt.sample(time.monotonic() - sent_at)
+                else:
+                    # На повтор сервер ответит еще раз - этот ответ не должен
+                    # подтвердить следующий пакет (в ACK нет номера блока)
+                    self._discard_reply(expect)
+                self.sock.settimeout(self.timeout)
+                return data
+            self.rtt.backoff()
+            retried = True
+        self.sock.settimeout(self.timeout)
+        return None
+    
+    def _discard_reply(self, expect):
+        """Пропустить запоздавший повторный ответ из expect, если он придет за RTO"""
+        deadline = time.monotonic() + self.rtt.rto
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            self.sock.settimeout(remaining)
+            try:
+                data, _ = self.sock.recvfrom(1024)
+            except socket.timeout:
+                return
+            if data in expect:
+                return
+    
+    def _wait_meta_ack(self, transfer_id, timeout):
+        """Ждать подтверждения расширенных метаданных, None при таймауте"""
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            self.sock.settimeout(remaining)
+            try:
+                data, _ = self.sock.recvfrom(2048)
+            except socket.timeout:
+                return None
+            if data and data[0] == proto.PKT_META_ACK and len(data) >= proto.META_ACK_HEADER.size:
+                tid, params = proto.parse_meta_ack(data)
+                if tid == transfer_id:
+                    return params
+    
     # Для обратной совместимости оставляем старый метод
     def send_file_with_retry(self, file_path, max_attempts=3):
         """Алиас для обратной совместимости"""
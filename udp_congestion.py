@@ -0,0 +1,249 @@
+"""
+Управление скоростью отправки UDP клиента (оконный режим)
+
+Контроллер решает, сколько байт может быть в полете (окно перегрузки) и с какой
+скоростью их выпускать. Сигналы - время подтверждений (RTT) и потери (повторы):
+    fixed  - постоянная скорость rate_limit, без окна перегрузки
+    aimd   - как TCP Reno: медленный старт, +1 блок за RTT, окно пополам при потере
+    ledbat - по задержке (LEDBAT, RFC 6817): окно растет, пока очередь в сети меньше
+             целевой задержки, и уменьшается, когда больше - уступает другому трафику
+Отправка выравнивается корзиной токенов (TokenBucket): пакеты выходят равномерно,
+а не пачкой на все окно, и не переполняют буферы коммутаторов и сервера
+
+Таймер повтора (RtoEstimator, RFC 6298): SRTT и RTTVAR по замерам RTT, RTO = SRTT + 4 * RTTVAR,
+удвоение при каждом таймауте и случайная добавка, чтобы повторы разных клиентов не совпадали
+"""
+
+import random
+import time
+
+INITIAL_WINDOW = 10         # блоков в начале передачи (как IW10 у TCP)
+MIN_WINDOW = 2              # меньше окно не уменьшается
+PACING_GAIN = 1.25          # скорость выпуска с запасом над cwnd/RTT, чтобы окно успевало заполняться
+MIN_RTT = 0.0005            # RTT на loopback бывает почти нулевым - не делим на него
+BURST_TIME = 0.002          # корзина копит токены не больше чем на 2 мс отправки
+
+INITIAL_RTO = 1.0           # до первого замера RTT (RFC 6298)
+# RFC 6298 требует минимум 1 с с запасом на задержанные ACK у TCP. Сервер подтверждает
+# каждую пачку сразу, поэтому нижняя граница меньше, и потеря на быстром пути стоит десятки мс
+MIN_RTO = 0.05
+MAX_RTO = 60.0
+CLOCK_GRANULARITY = 0.001   # G из RFC 6298
+RTO_JITTER = 0.1            # таймаут увеличивается на случайные 0-10%
+MAX_RETRY_DELAY = 3.0       # пауза между попытками отправки файла не больше прежних 3 с
+
+
+class TokenBucket:
+    """Корзина токенов: rate байт в секунду, не больше burst байт подряд
+
+    rate = None - без ограничения (try_take всегда успешен)
+    """
+    def __init__(self, rate=None, burst=0):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+
+    def set_rate(self, rate, packet_size):
+        """Новая скорость; корзина вмещает BURST_TIME отправки, но не меньше двух пакетов"""
+        self.rate = rate
+        if rate:
+            self.burst = max(2 * packet_size, rate * BURST_TIME)
+
+    def refill(self, now):
+        if self.rate:
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def try_take(self, size, now):
+        """Забрать size байт, если токенов хватает"""
+        if not self.rate:
+            return True
+        self.refill(now)
+        if self.tokens < size:
+            return False
+        self.tokens -= size
+        return True
+
+    def take(self, size):
+        """Забрать size байт безусловно (повторы): долг отдается ожиданием следующих пакетов"""
+        if self.rate:
+            self.tokens -= size
+
+    def wait_time(self, size):
+        """Через сколько секунд накопится size байт"""
+        if not self.rate:
+            return 0.0
+        return max(0.0, (size - self.tokens) / self.rate)
+
+
+class RtoEstimator:
+    """Таймаут повтора по замерам RTT (RFC 6298) с экспоненциальным откатом"""
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.base_rto = INITIAL_RTO  # RTO по замерам, без откатов
+        self.rto = INITIAL_RTO
+        self.backoffs = 0
+
+    def sample(self, rtt):
+        """Новый замер RTT (только по пакетам без повторов - алгоритм Карна)"""
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+        self.base_rto = min(MAX_RTO, max(MIN_RTO, self.srtt + max(CLOCK_GRANULARITY, 4 * self.rttvar)))
+        self.rto = self.base_rto
+        self.backoffs = 0
+
+    def backoff(self):
+        """Таймаут истек - следующий ждем вдвое дольше (до нового замера)"""
+        self.rto = min(MAX_RTO, self.rto * 2)
+        self.backoffs += 1
+
+    def reset_backoff(self):
+        """Вернуть таймаут к RTO по замерам (новый запрос, а не повтор старого)"""
+        self.rto = self.base_rto
+        self.backoffs = 0
+
+    def timeout(self):
+        """Текущий таймаут со случайной добавкой"""
+        return self.rto * (1 + random.uniform(0, RTO_JITTER))
+
+    def retry_delay(self, attempt):
+        """Пауза перед повторной попыткой отправки файла: растет с номером попытки"""
+        delay = min(MAX_RETRY_DELAY, self.base_rto * 2 ** (attempt + 1))
+        return delay * (1 + random.uniform(0, RTO_JITTER))
+
+
+class RateController:
+    """Окно перегрузки и скорость выпуска пакетов для одной передачи"""
+    name = None
+
+    def __init__(self, chunk_size, max_rate=None):
+        self.chunk_size = chunk_size
+        self.max_rate = max_rate          # байт в секунду, None - без ограничения
+        self.cwnd = INITIAL_WINDOW * chunk_size
+        self.max_cwnd = None              # окно получателя: больше не бывает в полете
+        self.srtt = None
+        self.min_rtt = None
+        self.last_decrease = 0.0
+        self.losses = 0
+
+    def on_ack(self, acked_bytes, rtt, now):
+        """Подтверждены новые блоки; rtt - замер по блоку без повторов или None"""
+        if rtt is not None:
+            rtt = max(rtt, MIN_RTT)
+            self.srtt = rtt if self.srtt is None else 0.875 * self.srtt + 0.125 * rtt
+            self.min_rtt = rtt if self.min_rtt is None else min(self.min_rtt, rtt)
+            self.on_rtt(rtt)
+        self.increase(acked_bytes)
+
+    def on_loss(self, now):
+        """Блок потерян (повтор по таймауту или быстрый повтор)
+
+        Несколько потерь в одном RTT - один сигнал: окно уменьшается один раз
+        """
+        self.losses += 1
+        if now - self.last_decrease < (self.srtt or MIN_RTT):
+            return
+        self.last_decrease = now
+        self.decrease()
+
+    def on_rtt(self, rtt):
+        pass
+
+    def increase(self, acked_bytes):
+        pass
+
+    def decrease(self):
+        pass
+
+    def can_send(self, in_flight_bytes):
+        """Помещается ли еще один блок в окно перегрузки"""
+        return self.cwnd is None or in_flight_bytes + self.chunk_size <= self.cwnd
+
+    @property
+    def pacing_rate(self):
+        """Скорость выпуска пакетов (байт в секунду), None - без выравнивания"""
+        if self.cwnd is None or self.srtt is None:
+            return self.max_rate
+        rate = PACING_GAIN * self.cwnd / self.srtt
+        return min(rate, self.max_rate) if self.max_rate else rate
+
+    def clamp(self):
+        """Окно в пределах [MIN_WINDOW блоков, max_cwnd]"""
+        if self.max_cwnd:
+            self.cwnd = min(self.cwnd, self.max_cwnd)
+        self.cwnd = max(self.cwnd, MIN_WINDOW * self.chunk_size)
+
+
+class FixedRate(RateController):
+    """Постоянная скорость max_rate без окна перегрузки"""
+    name = 'fixed'
+
+    def __init__(self, chunk_size, max_rate=None):
+        if not max_rate:
+            raise ValueError("для постоянной скорости нужен rate_limit")
+        super().__init__(chunk_size, max_rate)
+        self.cwnd = None
+
+
+class AIMD(RateController):
+    """Аддитивное увеличение, мультипликативное уменьшение (TCP Reno)"""
+    name = 'aimd'
+
+    def __init__(self, chunk_size, max_rate=None):
+        super().__init__(chunk_size, max_rate)
+        self.ssthresh = None  # до первой потери - медленный старт
+
+    def increase(self, acked_bytes):
+        if self.ssthresh is None or self.cwnd < self.ssthresh:
+            self.cwnd += acked_bytes
+        else:
+            self.cwnd += self.chunk_size * acked_bytes / self.cwnd
+        self.clamp()
+
+    def decrease(self):
+        self.cwnd /= 2
+        self.clamp()
+        self.ssthresh = self.cwnd
+
+
+class Ledbat(RateController):
+    """Окно по задержке очереди: RTT сверх минимального не должен превышать target"""
+    name = 'ledbat'
+    TARGET = 0.025  # допустимая задержка в очереди, секунд
+    GAIN = 1.0
+
+    def __init__(self, chunk_size, max_rate=None):
+        super().__init__(chunk_size, max_rate)
+        self.queuing_delay = 0.0
+
+    def on_rtt(self, rtt):
+        self.queuing_delay = rtt - self.min_rtt
+
+    def increase(self, acked_bytes):
+        off_target = (self.TARGET - self.queuing_delay) / self.TARGET
+        self.cwnd += self.GAIN * off_target * self.chunk_size * acked_bytes / self.cwnd
+        self.clamp()
+
+    def decrease(self):
+        self.cwnd /= 2
+        self.clamp()
+
+
+CONTROLLERS = {cls.name: cls for cls in (FixedRate, AIMD, Ledbat)}
+
+
+def make_controller(name, chunk_size, max_rate=None):
+    """Контроллер по имени; None - без управления скоростью (только max_rate, если задан)"""
+    if name is None:
+        return FixedRate(chunk_size, max_rate) if max_rate else None
+    try:
+        return CONTROLLERS[name](chunk_size, max_rate)
+    except KeyError:
+        raise ValueError(f"неизвестный алгоритм управления скоростью: {name!r}") from None
+
@@ -0,0 +1,243 @@
+"""
+Общие константы и форматы пакетов UDP протокола
+Используется и клиентом (udp_client.py), и сервером (udp_server.py)
+
+Метаданные v2 (PKT_META_V2): версия, возможности (caps) и 64-битный размер -
+файлы больше 4 ГБ. Сервер отвечает на них META_ACK с {version, caps}; старый сервер
+их не знает и молчит, тогда клиент повторяет метаданные в старом формате (!BI)
+"""
+
+import hashlib
+import json
+import struct
+import zlib
+
+# Пакеты клиента (старый режим stop-and-wait)
+PKT_META = 1    # метаданные: !BI размер + имя файла
+PKT_DATA = 2    # данные: !BI номер блока + содержимое
+PKT_END = 3     # сигнал завершения: !B
+
+# Пакеты клиента (оконный режим)
+PKT_WDATA = 4   # данные: !BII id передачи, номер блока + содержимое
+PKT_WFIN = 5    # завершение: !BI id передачи [+ контрольная сумма файла]
+PKT_PROBE = 6   # пробный пакет размера: !BII метка, размер блока + заполнение
+PKT_WDATA_CRC = 7  # данные с CRC32 блока: !BIII id передачи, номер блока, CRC32 + содержимое
+PKT_FEC = 8     # четность группы блоков: !BIII id передачи, номер группы, CRC32 + XOR блоков группы
+PKT_WDATA_Z = 9 # сжатый блок: !BIII id передачи, номер блока, CRC32 сжатых данных + сжатые данные
+PKT_META_V2 = 10  # метаданные v2: !BBIQ версия, возможности, размер + имя файла [+ JSON параметры]
+PKT_SIG_REQ = 11  # запрос подписей прежней версии: !BIIH метка, первый блок, сколько подписей + имя файла
+
+# Ответы сервера в оконном режиме (не пересекаются с b'OK', b'ACK', b'DONE')
+PKT_META_ACK = 0x10  # подтверждение метаданных: !BI id передачи + JSON параметры
+PKT_SACK = 0x11      # подтверждение: !BIIIH id, кумулятивный номер, номер блока, число диапазонов
+PKT_PROBE_ACK = 0x12 # ответ на пробный пакет: !BII метка, размер блока
+PKT_NAK = 0x13       # блоки с неверной CRC32: !BIH id передачи, число номеров + номера блоков !I
+PKT_SIG = 0x14       # подписи блоков: !BIIQQIH метка, первый блок, размер основы, tag, размер блока,
+                     # число подписей + подписи (delta.SIGNATURE_ENTRY); размер основы 0 - ее нет
+
+META_HEADER = struct.Struct('!BI')
+META_V2_HEADER = struct.Struct('!BBIQ')
+WDATA_HEADER = struct.Struct('!BII')
+WDATA_CRC_HEADER = struct.Struct('!BIII')
+FEC_HEADER = struct.Struct('!BIII')
+WFIN_PACKET = struct.Struct('!BI')
+META_ACK_HEADER = struct.Struct('!BI')
+SACK_HEADER = struct.Struct('!BIIIH')
+SACK_RANGE = struct.Struct('!II')
+PROBE_HEADER = struct.Struct('!BII')
+NAK_HEADER = struct.Struct('!BIH')
+NAK_ID = struct.Struct('!I')
+CRC_IDS = struct.Struct('!II')
+SIG_REQ_HEADER = struct.Struct('!BIIH')
+SIG_HEADER = struct.Struct('!BIIQQIH')
+
+# Размеры блока, которые клиент пробует по очереди (от большего к меньшему):
+# loopback (MTU 65536), промежуточные, jumbo-кадры (MTU 9000), Ethernet (MTU 1500).
+# Каждый кандидат вместе с заголовком WDATA_CRC укладывается в MTU без фрагментации
+CHUNK_SIZE_CANDIDATES = (65000, 32768, 16384, 8952, 1452)
+DEFAULT_CHUNK_SIZE = 1024
+MAX_CHUNK_SIZE = 65507 - WDATA_CRC_HEADER.size  # максимум полезной нагрузки UDP/IPv4
+
+# CRC32 блока (клиент предлагает 'crc' в метаданных, сервер подтверждает в META_ACK):
+# поврежденный блок сервер не записывает, а просит повторить пакетом NAK
+MAX_NAK_IDS = 256
+
+# Упреждающая коррекция ошибок (клиент предлагает 'fec' - размер группы в метаданных,
+# сервер подтверждает в META_ACK): после каждых fec блоков идет пакет четности -
+# XOR блоков группы, дополненных нулями до размера блока. Один потерянный блок группы
+# сервер восстанавливает сам, без повтора. Избыточность трафика - 1/fec
+MAX_FEC_GROUP = 255
+
+# Сжатие (compression.py): клиент перечисляет алгоритмы в метаданных ('compression'),
+# сервер выбирает лучший из общих (compression.PREFERRED) и возвращает его в META_ACK. Каждый блок сжимается
+# отдельно и идет пакетом PKT_WDATA_Z, а блок, который не уменьшился, - обычным пакетом
+
+# Версия метаданных и возможности (caps) - биты, которые сервер возвращает в META_ACK,
+# если поддерживает их сам
+METADATA_VERSION = 2
+CAP_LARGE_FILES = 0x1           # размер файла больше 4 ГБ
+SUPPORTED_CAPS = CAP_LARGE_FILES
+MAX_LEGACY_FILE_SIZE = 0xFFFFFFFF  # больше не помещается в старые метаданные !BI
+MAX_CHUNK_COUNT = 0xFFFFFFFF       # номера блоков в пакетах - !I
+
+# Сколько диапазонов выборочного подтверждения помещается в один ACK
+MAX_SACK_RANGES = 32
+
+# Контрольная сумма: клиент предлагает алгоритм в метаданных ('checksum'), сервер
+# повторяет его в META_ACK, если поддерживает. Тогда сумма файла (hashing.py)
+# идет в пакете завершения после id передачи и сверяется до ответа DONE
+
+# Без дубликатов: клиент передает в метаданных сумму всего файла ('digest', алгоритм - 'checksum').
+# Если у сервера с хранилищем (storage.py) такое содержимое уже есть, он сохраняет файл
+# ссылкой на него и отвечает META_ACK {stored: true} - данные не передаются
+
+# Изменения (delta.py): клиент запрашивает подписи блоков прежней версии файла (PKT_SIG_REQ)
+# страницами, по несколько запросов сразу, и отправляет обычной передачей поток команд вместо файла.
+# В метаданных 'delta': {size, base_size, tag, checksum, digest} - размер нового файла, основа,
+# на которую ссылаются команды, и сумма нового файла. Сервер отвечает META_ACK {delta: true}
+# и собирает файл после приема потока; {delta: false} - основа изменилась, нужен весь файл
+
+# Докачка: клиент передает в метаданных ключ передачи ('key'), сервер отвечает
+# в META_ACK, сколько байт уже принято ('have') и каких блоков нет ('missing').
+# Диапазонов не больше MAX_RESUME_RANGES, последний тогда тянется до конца файла
+MAX_RESUME_RANGES = 48
+
+
+def resume_key(file_name, file_size, mtime_ns):
+    """Постоянный ключ передачи: тот же файл при повторной отправке получает тот же ключ"""
+    key = f"{file_name}\0{file_size}\0{mtime_ns}".encode('utf-8')
+    return hashlib.sha256(key).hexdigest()[:32]
+
+
+def pack_metadata(file_size, file_name, options=None, caps=None):
+    """Пакет метаданных + JSON параметры после нулевого байта
+    
+    caps=None - старый формат (!BI, файлы до 4 ГБ), иначе v2 с возможностями caps
+    """
+    if caps is None:
+        packet = META_HEADER.pack(PKT_META, file_size)
+    else:
+        packet = META_V2_HEADER.pack(PKT_META_V2, METADATA_VERSION, caps, file_size)
+    packet += file_name.encode('utf-8')
+    if options:
+        packet += b'\0' + json.dumps(options, separators=(',', ':')).encode('utf-8')
+    return packet
+
+
+def parse_metadata(data):
+    """Разбор пакета метаданных -> (размер, имя файла, параметры или None, возможности или None)
+    
+    Возможности - None для старого формата; ValueError, если пакет короче заголовка
+    """
+    if data[0] == PKT_META_V2:
+        if len(data) < META_V2_HEADER.size:
+            raise ValueError("короткий заголовок метаданных v2")
+        _, _, caps, file_size = META_V2_HEADER.unpack_from(data)
+        rest = data[META_V2_HEADER.size:]
+    else:
+        if len(data) < META_HEADER.size:
+            raise ValueError("короткий заголовок метаданных")
+        _, file_size = META_HEADER.unpack_from(data)
+        caps = None
+        rest = data[META_HEADER.size:]
+    name_part, sep, options_part = rest.partition(b'\0')
+    filename = name_part.decode('utf-8', errors='ignore').strip('\x00')
+    
+    options = None
+    if sep and options_part:
+        try:
+            options = json.loads(options_part.decode('utf-8'))
+        except ValueError:
+            options = None
+    return file_size, filename, options, caps
+
+
+def pack_meta_ack(transfer_id, params):
+    """Ответ на расширенные метаданные"""
+    body = json.dumps(params, separators=(',', ':')).encode('utf-8')
+    return META_ACK_HEADER.pack(PKT_META_ACK, transfer_id) + body
+
+
+def parse_meta_ack(data):
+    """Разбор ответа на метаданные -> (id передачи, параметры)"""
+    _, transfer_id = META_ACK_HEADER.unpack_from(data)
+    return transfer_id, json.loads(data[META_ACK_HEADER.size:].decode('utf-8'))
+
+
+def pack_sack(transfer_id, cumulative, chunk_id, ranges):
+    """Подтверждение: все блоки < cumulative получены + диапазоны [start, end)"""
+    ranges = ranges[:MAX_SACK_RANGES]
+    packet = SACK_HEADER.pack(PKT_SACK, transfer_id, cumulative, chunk_id, len(ranges))
+    for start, end in ranges:
+        packet += SACK_RANGE.pack(start, end)
+    return packet
+
+
+def parse_sack(data):
+    """Разбор подтверждения -> (id передачи, кумулятивный номер, номер блока, диапазоны)"""
+    _, transfer_id, cumulative, chunk_id, count = SACK_HEADER.unpack_from(data)
+    ranges = []
+    offset = SACK_HEADER.size
+    for _ in range(count):
+        ranges.append(SACK_RANGE.unpack_from(data, offset))
+        offset += SACK_RANGE.size
+    return transfer_id, cumulative, chunk_id, ranges
+
+
+def chunk_crc(transfer_id, chunk_id, content):
+    """CRC32 блока: покрывает id передачи, номер блока и содержимое"""
+    return zlib.crc32(content, zlib.crc32(CRC_IDS.pack(transfer_id, chunk_id)))
+
+
+def pack_wdata_crc(transfer_id, chunk_id, content):
+    """Пакет данных с CRC32 блока"""
+    crc = chunk_crc(transfer_id, chunk_id, content)
+    return WDATA_CRC_HEADER.pack(PKT_WDATA_CRC, transfer_id, chunk_id, crc) + content
+
+
+def pack_wdata_z(transfer_id, chunk_id, packed):
+    """Пакет сжатого блока (CRC32 считается по сжатым данным, как они идут по сети)"""
+    crc = chunk_crc(transfer_id, chunk_id, packed)
+    return WDATA_CRC_HEADER.pack(PKT_WDATA_Z, transfer_id, chunk_id, crc) + packed
+
+
+def xor_into(parity, content):
+    """Четность группы (целое число) с добавленным блоком"""
+    return parity ^ int.from_bytes(content, 'little')
+
+
+def pack_fec(transfer_id, group, parity, chunk_size):
+    """Пакет четности группы блоков (с CRC32, как блок данных)"""
+    content = parity.to_bytes(chunk_size, 'little')
+    crc = chunk_crc(transfer_id, group, content)
+    return FEC_HEADER.pack(PKT_FEC, transfer_id, group, crc) + content
+
+
+def pack_nak(transfer_id, chunk_ids):
+    """Запрос повтора поврежденных блоков"""
+    chunk_ids = chunk_ids[:MAX_NAK_IDS]
+    return NAK_HEADER.pack(PKT_NAK, transfer_id, len(chunk_ids)) + b''.join(NAK_ID.pack(i) for i in chunk_ids)
+
+
+def parse_nak(data):
+    """Разбор NAK -> (id передачи, номера блоков)"""
+    _, transfer_id, count = NAK_HEADER.unpack_from(data)
+    count = min(count, (len(data) - NAK_HEADER.size) // NAK_ID.size)
+    return transfer_id, [NAK_ID.unpack_from(data, NAK_HEADER.size + i * NAK_ID.size)[0] for i in range(count)]
+
+
+def ids_to_ranges(sorted_ids):
+    """Свернуть отсортированные номера блоков в диапазоны [start, end)"""
+    ranges = []
+    start = prev = None
+    for chunk_id in sorted_ids:
+        if start is None:
+            start = prev = chunk_id
+        elif chunk_id == prev + 1:
+            prev = chunk_id
+        else:
+            ranges.append((start, prev + 1))
+            start = prev = chunk_id
+    if start is not None:
+        ranges.append((start, prev + 1))
+    return ranges
@@ -2,158 +2,1078 @@
 import socket
 import struct
 import os
+import queue
 import sys
+import tempfile
+import threading
 import time  # Добавляем этот импорт
 from pathlib import Path
 
+import compression
+import delta
+import disk_writer
+import hashing
+import storage
+import udp_protocol as proto
+import udp_batch
+
+# Размер блока старого клиента (stop-and-wait)
+LEGACY_CHUNK_SIZE = 1024
+
+# Папка незавершенных передач с докачкой (внутри папки загрузок):
+# <ключ>.part - данные, <ключ>.bitmap - размер файла, размер блока и карта полученных блоков
+PARTIAL_DIR = '.partial'
+PARTIAL_TTL = 24 * 3600  # незавершенные передачи старше суток удаляются при запуске
+BITMAP_HEADER = struct.Struct('!QI')
+# Передачу с тем же ключом можно перехватить (клиент перезапустился), если она молчит столько секунд
+RESUME_IDLE = 1.0
+# Ответ на запрос подписей читает и хэширует не больше стольких байт основы
+SIGNATURE_PAGE_BYTES = 8 * 1024 * 1024
+# Таймаут приема, пока файлы ждут фиксации пачкой: ответ DONE уходит сразу после fsync пачки
+COMMIT_POLL = 0.01
+
+
+class ChunkBitmap:
+    """Компактная битовая карта полученных блоков (1 бит на блок)"""
+    def __init__(self, count):
+        self.count = count
+        self.bits = bytearray((count + 7) // 8)
+        self.received = 0
+    
+    def __contains__(self, chunk_id):
+        return (self.bits[chunk_id >> 3] >> (chunk_id & 7)) & 1 == 1
+    
+    def add(self, chunk_id):
+        """Отметить блок, False если он уже был получен (дубликат)"""
+        byte, bit = chunk_id >> 3, 1 << (chunk_id & 7)
+        if self.bits[byte] & bit:
+            return False
+        self.bits[byte] |= bit
+        self.received += 1
+        return True
+    
+    def is_complete(self):
+        return self.received == self.count
+
+    def received_bytes(self, chunk_size, file_size):
+        """Сколько байт файла покрывают полученные блоки"""
+        received = self.received * chunk_size
+        if self.count and (self.count - 1) in self:
+            received -= self.count * chunk_size - file_size
+        return received
+    
+    def missing_ranges(self, limit):
+        """Диапазоны [start, end) неполученных блоков, не больше limit
+        
+        Если диапазонов больше, последний тянется до конца файла
+        """
+        ranges = []
+        start = None
+        chunk_id = 0
+        while chunk_id < self.count:
+            # Целые байты карты без перемен пропускаем сразу
+            if chunk_id & 7 == 0 and chunk_id + 8 <= self.count:
+                byte = self.bits[chunk_id >> 3]
+                if (byte == 0xFF and start is None) or (byte == 0 and start is not None):
+                    chunk_id += 8
+                    continue
+            if chunk_id in self:
+                if start is not None:
+                    ranges.append((start, chunk_id))
+                    start = None
+            elif start is None:
+                start = chunk_id
+            chunk_id += 1
+        if start is not None:
+            ranges.append((start, self.count))
+        
+        if len(ranges) > limit:
+            ranges = ranges[:limit - 1] + [(ranges[limit - 1][0], self.count)]
+        return ranges
+    
+    def regroup(self, chunk_size, new_chunk_size, file_size):
+        """Карта для другого размера блока: новый блок получен, если его целиком покрывают старые"""
+        bitmap = ChunkBitmap((file_size + new_chunk_size - 1) // new_chunk_size)
+        for chunk_id in range(bitmap.count):
+            first = chunk_id * new_chunk_size // chunk_size
+            last = (min((chunk_id + 1) * new_chunk_size, file_size) - 1) // chunk_size
+            if all(old in self for old in range(first, last + 1)):
+                bitmap.add(chunk_id)
+        return bitmap
+    
+    def to_bytes(self):
+        return bytes(self.bits)
+    
+    @classmethod
+    def from_bytes(cls, count, data):
+        """Карта, сохраненная to_bytes"""
+        bitmap = cls(count)
+        if len(data) != len(bitmap.bits):
+            raise ValueError("размер карты блоков не совпадает")
+        bitmap.bits[:] = data
+        bitmap.received = bin(int.from_bytes(data, 'little')).count('1')
+        return bitmap
+
+
+def read_at(f, offset, size):
+    """Позиционное чтение (pread, если есть в ОС)"""
+    if hasattr(os, 'pread'):
+        return os.pread(f.fileno(), size, offset)
+    f.seek(offset)
+    return f.read(size)
+
+
+class ReceiveSession:
+    """Состояние одной передачи файла (ключ - адрес клиента и id передачи)
+    
+    Файл принимается в partial_path (.partial) и в filepath переносится только целиком:
+    с ключом докачки (resume_key) это <ключ>.part, и рядом сохраняется карта полученных
+    блоков, иначе - временный файл.
+    Блоки пишутся в фоне потоками writer (disk_writer.DiskWriter, None - сразу)
+    """
+    def __init__(self, addr, transfer_id, filepath, file_size, chunk_size, windowed,
+                 resume_key=None, partial_path=None, bitmap=None, hasher=None, fec=0, codec=None, delta=None,
+                 writer=None):
+        self.addr = addr
+        self.transfer_id = transfer_id
+        self.filepath = filepath
+        self.file_size = file_size
+        self.chunk_size = chunk_size
+        self.windowed = windowed
+        self.chunk_count = (file_size + chunk_size - 1) // chunk_size
+        self.bitmap = bitmap or ChunkBitmap(self.chunk_count)
+        self.cumulative = 0        # Все блоки с номером < cumulative получены
+        while self.cumulative < self.chunk_count and self.cumulative in self.bitmap:
+            self.cumulative += 1
+        self.out_of_order = set()  # Полученные блоки выше cumulative (для диапазонов SACK)
+        self.received = self.bitmap.received_bytes(chunk_size, file_size)
+        self.last_activity = time.time()
+        self.reply = None          # DONE/ERROR после завершения
+        self.committing = False    # Файл принят и ждет переноса в папку загрузок
+        self.meta_reply = None     # Ответ на метаданные (для повтора)
+        self.resume_key = resume_key
+        self.partial_path = partial_path
+        self.dirty = False         # Есть блоки, не отмеченные в сохраненной карте
+        # Контрольная сумма считается по блокам подряд с начала файла: блоки,
+        # пришедшие не по порядку, ждут в unhashed (их не больше окна клиента)
+        self.hasher = hasher
+        self.hashed = 0
+        self.unhashed = {}
+        self.digest = None         # Сумма из пакета завершения
+        self.corrupted = 0         # Блоков с неверной CRC32 (запрошены повторно)
+        # Упреждающая коррекция: четность групп, в которых еще не хватает блоков
+        self.fec = fec
+        self.parity = {}           # номер группы -> XOR блоков группы
+        self.recovered = 0         # Блоков, восстановленных по четности
+        self.deferred = 0          # Блоков, отброшенных без подтверждения: диск не успевал
+        self.codec = codec         # Алгоритм сжатия блоков PKT_WDATA_Z или None
+        # Принимается поток изменений (delta.py): основа и параметры файла, который из него собирается
+        self.delta = delta
+        # Докачка продолжает запись в уже принятую часть файла. Файл открыт и на чтение:
+        # восстановление по четности читает принятые блоки группы (read_chunk)
+        self.file = open(partial_path or filepath, 'r+b' if bitmap else 'w+b', buffering=0)
+        try:
+            # Место под весь файл выделяется сразу: нехватка места видна до приема
+            disk_writer.preallocate(self.file, file_size)
+        except OSError:
+            self.file.close()
+            if not bitmap:
+                os.unlink(partial_path or filepath)
+            raise
+        self.writer = disk_writer.FileWriter(self.file, writer)
+    
+    @property
+    def finished(self):
+        return self.reply is not None or self.committing
+    
+    def store_chunk(self, chunk_id, content):
+        """Записать блок по его смещению, False для дубликата и блока, отложенного до повтора"""
+        if self.writer.full:
+            # Диск не успевает: блок не подтверждается, и клиент повторит его позже.
+            # Ждать записи здесь нельзя - один цикл приема обслуживает все передачи
+            self.deferred += 1
+            return False
+        if not self.bitmap.add(chunk_id):
+            return False
+        # Пакет лежит в буфере приема, который сразу переиспользуется - в очередь записи идет копия
+        content = bytes(content)
+        self.writer.write(chunk_id * self.chunk_size, content)
+        self.received += len(content)
+        self.dirty = True
+        
+        if self.hasher is not None:
+            if chunk_id == self.hashed:
+                self.hasher.update(content)
+                self.hashed += 1
+            else:
+                self.unhashed[chunk_id] = content
+        
+        if chunk_id == self.cumulative:
+            self.cumulative += 1
+            while self.cumulative < self.chunk_count and self.cumulative in self.bitmap:
+                self.out_of_order.discard(self.cumulative)
+                self.cumulative += 1
+            if self.hasher is not None:
+                self.advance_hash()
+        else:
+            self.out_of_order.add(chunk_id)
+        return True
+    
+    def advance_hash(self):
+        """Досчитать контрольную сумму до cumulative
+        
+        Блоки, принятые до докачки, читаются из файла - остальные уже в памяти
+        """
+        while self.hashed < self.cumulative:
+            content = self.unhashed.pop(self.hashed, None)
+            if content is None:
+                self.writer.flush()
+                offset = self.hashed * self.chunk_size
+                content = read_at(self.file, offset, min(self.chunk_size, self.file_size - offset))
+            self.hasher.update(content)
+            self.hashed += 1
+    
+    def read_chunk(self, chunk_id):
+        """Принятый блок: из памяти, если он ждет контрольной суммы, иначе из файла"""
+        content = self.unhashed.get(chunk_id)
+        if content is None:
+            self.writer.flush()  # блок мог еще стоять в очереди записи
+            offset = chunk_id * self.chunk_size
+            content = read_at(self.file, offset, min(self.chunk_size, self.file_size - offset))
+        return content
+    
+    def recover_chunk(self, group):
+        """Восстановить единственный недостающий блок группы по четности
+        
+        -> (номер блока, содержимое) или None, если блоков не хватает больше одного
+        """
+        parity = self.parity.get(group)
+        if parity is None:
+            return None
+        first = group * self.fec
+        last = min(first + self.fec, self.chunk_count)
+        missing = [i for i in range(first, last) if i not in self.bitmap]
+        if len(missing) != 1:
+            if not missing:
+                del self.parity[group]
+            return None
+        lost = missing[0]
+        value = int.from_bytes(parity, 'little')
+        for chunk_id in range(first, last):
+            if chunk_id != lost:
+                value = proto.xor_into(value, self.read_chunk(chunk_id))
+        del self.parity[group]
+        size = min(self.chunk_size, self.file_size - lost * self.chunk_size)
+        return lost, value.to_bytes(len(parity), 'little')[:size]
+    
+    def digest_matches(self):
+        """Совпала ли контрольная сумма (True, если клиент ее не передавал)"""
+        if self.hasher is None or self.digest is None:
+            return True
+        self.advance_hash()
+        return self.hasher.digest() == self.digest
+    
+    def sack(self, chunk_id=0):
+        """Пакет подтверждения с текущим состоянием приема"""
+        ranges = proto.ids_to_ranges(sorted(self.out_of_order)) if self.out_of_order else []
+        return proto.pack_sack(self.transfer_id, self.cumulative, chunk_id, ranges)
+    
+    def flush(self):
+        """Дождаться записи принятых блоков на диск (OSError, если запись не удалась)"""
+        if self.file:
+            self.writer.flush()
+    
+    def close(self):
+        if self.file:
+            try:
+                self.writer.flush()
+            except OSError as e:
+                print(f"[{time.strftime('%H:%M:%S')}] Ошибка записи {self.filepath.name}: {e}")
+            self.file.close()
+            self.file = None
+
+
 class UDPServerSimple:
-    def __init__(self, host='127.0.0.1', port=9999):
+    def __init__(self, host='127.0.0.1', port=9999, batch_io=True, dedup=False, background_write=True,
+                 durability=disk_writer.SYNC_NONE, group_files=disk_writer.GROUP_FILES, group_ms=disk_writer.GROUP_MS):
         self.host = host
         self.port = port
         self.download_dir = Path("received_files")
         self.download_dir.mkdir(exist_ok=True)
         self.last_activity = time.time()  # Инициализируем здесь
+        self.session_timeout = 30.0  # Сколько ждать пакетов передачи до ее удаления
+        self.max_chunk_size = proto.MAX_CHUNK_SIZE  # Самый большой блок, который примет сервер
+        
+        # Таблица передач: (адрес, id передачи) -> ReceiveSession
+        # У старых клиентов нет id передачи, для них id = 0
+        self.sessions = {}
+        
+        # Хранилище по содержимому (storage.py): одинаковые файлы хранятся один раз,
+        # а файл с уже известной суммой из метаданных сохраняется без передачи данных
+        self.store = storage.ContentStore(self.download_dir / storage.STORE_DIR) if dedup else None
+        # Ответы META_ACK {stored} (адрес, id передачи) -> (ответ, время): повтор метаданных
+        # получает тот же ответ, а не еще одну копию файла
+        self.stored_replies = {}
+        # Запись блоков на диск в фоне (disk_writer.py): цикл приема не ждет диск,
+        # соседние блоки пишутся одной записью. False - запись сразу в цикле приема
+        self.disk_writer = disk_writer.DiskWriter() if background_write else None
+        # Файл принимается во временный в .partial и переносится в папку загрузок проверенным.
+        # durability - fsync при переносе: 'none', 'file' или 'group' (пачкой, см. disk_writer.py)
+        self.committer = disk_writer.Committer(durability, group_files, group_ms)
+        # Результаты переноса из потока фиксации (сессия, временный путь, путь, ошибка):
+        # ответ клиенту отправляет цикл приема
+        self.commits = queue.SimpleQueue()
+        self.committing = 0
+        self.rebuilds = []  # потоки сборки файлов из изменений (rebuild_session)
         
         print("=" * 50)
         print("ПРОСТОЙ UDP СЕРВЕР")
         print("=" * 50)
         print(f"Папка для загрузок: {self.download_dir.absolute()}")
         print(f"Слушаю на: {host}:{port}")
+        if durability != disk_writer.SYNC_NONE:
+            print(f"Надежность записи: {durability}")
+        if self.store is not None:
+            print(f"Хранилище без дубликатов: {self.store.algorithm}"
+                  f"{'' if self.store.hardlinks else ' (без жестких ссылок - копии)'}")
         print("=" * 50)
         
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        # Большой буфер приема: пакеты многих передач приходят одновременно
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        except OSError:
+            pass
         self.sock.bind((host, port))
         self.sock.settimeout(1.0)
         
+        # Пакетный прием/отправка (recvmmsg/sendmmsg, если доступны)
+        self.io = udp_batch.BatchSocket(self.sock, batch_size=64, buffer_size=65536, use_mmsg=batch_io)
+        self.outbox = []        # Ответы, накопленные за одну пачку входящих пакетов
+        self.pending_acks = {}  # (адрес, id передачи) -> (сессия, номер блока) для одного SACK на пачку
+        self.pending_naks = {}  # (адрес, id передачи) -> номера поврежденных блоков для одного NAK на пачку
+        if self.io.use_mmsg:
+            print("Пакетный ввод-вывод: recvmmsg/sendmmsg")
+    
+        self.partial_dir = self.download_dir / PARTIAL_DIR
+        self.partial_dir.mkdir(exist_ok=True)
+        self.cleanup_partials()
+        if self.store is not None:
+            removed = self.store.collect_garbage()
+            if removed:
+                print(f"Хранилище: удалено содержимое удаленных файлов ({removed})")
+    
     def run(self):
         print("Сервер запущен. Ожидание файлов...")
         print("Ctrl+C для остановки\n")
         
+        last_eviction = time.time()
         try:
             while True:
+                self.sock.settimeout(COMMIT_POLL if self.committing else 1.0)
                 try:
-                    # Ждем первый пакет
-                    data, addr = self.sock.recvfrom(65535)
-                    
-                    if not data or len(data) < 1:
-                        # Проверяем, не прошло ли слишком много времени без активности
-                        if time.time() - self.last_activity > 60:  # 1 минута
-                            print(f"Активность: ожидание...")
-                            self.last_activity = time.time()
-                        continue
-                    
-                    self.last_activity = time.time()
-                    
-                    # Первый байт - тип пакета
-                    packet_type = data[0]
-                    
-                    if packet_type == 1:  # Метаданные файла
-                        print(f"\n[{time.strftime('%H:%M:%S')}] Получаю новый файл от {addr[0]}:{addr[1]}")
-                        
-                        if len(data) < 5:
-                            print("Ошибка: неверный формат метаданных")
-                            continue
-                        
-                        # Разбираем метаданные
-                        file_size = struct.unpack('!I', data[1:5])[0]
-                        filename = data[5:].decode('utf-8', errors='ignore').strip('\x00')
-                        
-                        if not filename:
-                            filename = f"file_{int(time.time())}.bin"
-                        
-                        print(f"  Имя файла: {filename}")
-                        print(f"  Размер: {file_size:,} байт")
-                        
-                        # Создаем безопасное имя файла
-                        safe_name = self.make_safe_filename(filename)
-                        filepath = self.download_dir / safe_name
-                        
-                        # Проверяем, не существует ли файл
-                        counter = 1
-                        while filepath.exists():
-                            name, ext = os.path.splitext(safe_name)
-                            filepath = self.download_dir / f"{name}_{counter}{ext}"
-                            counter += 1
-                        
-                        # Отправляем подтверждение метаданных
-                        self.sock.sendto(b'OK', addr)
-                        
-                        # Получаем данные файла
-                        received = 0
-                        expected_chunk_id = 0
-                        
-                        with open(filepath, 'wb') as f:
-                            while received < file_size:
-                                try:
-                                    chunk_data, chunk_addr = self.sock.recvfrom(65535)
-                                    
-                                    if not chunk_data or chunk_addr != addr:
-                                        continue
-                                    
-                                    chunk_type = chunk_data[0]
-                                    
-                                    if chunk_type == 2:  # Данные файла
-                                        if len(chunk_data) < 5:
-                                            continue
-                                        
-                                        chunk_id = struct.unpack('!I', chunk_data[1:5])[0]
-                                        chunk_content = chunk_data[5:]
-                                        
-                                        # Сохраняем данные
-                                        f.write(chunk_content)
-                                        received += len(chunk_content)
-                                        expected_chunk_id += 1
-                                        
-                                        # Показываем прогресс
-                                        if file_size > 0:
-                                            progress = (received / file_size) * 100
-                                            if int(progress) % 25 == 0 or received == file_size:
-                                                print(f"  Прогресс: {int(progress)}% ({received:,}/{file_size:,} байт)")
-                                        
-                                        # Отправляем подтверждение
-                                        self.sock.sendto(b'ACK', addr)
-                                        
-                                    elif chunk_type == 3:  # Завершение
-                                        print("  Получен сигнал завершения")
-                                        break
-                                        
-                                except socket.timeout:
-                                    # Проверяем, не завершилась ли передача
-                                    if received >= file_size:
-                                        break
-                                    continue
-                        
-                        # Проверяем целостность файла
-                        actual_size = os.path.getsize(filepath)
-                        if actual_size == file_size:
-                            print(f"[{time.strftime('%H:%M:%S')}] ✓ Файл успешно сохранен: {filepath.name}")
-                            print(f"  Фактический размер: {actual_size:,} байт")
-                            # Отправляем финальное подтверждение
-                            self.sock.sendto(b'DONE', addr)
-                        else:
-                            print(f"[{time.strftime('%H:%M:%S')}] ✗ Ошибка: несовпадение размеров (ожидалось: {file_size}, получено: {actual_size})")
-                            self.sock.sendto(b'ERROR', addr)
-                    
-                    elif packet_type == 3:  # Сигнал завершения от клиента
-                        print(f"[{time.strftime('%H:%M:%S')}] Клиент {addr[0]}:{addr[1]} завершил передачу")
-                        
+                    # Один сокет принимает пакеты всех передач, сразу пачкой
+                    packets = self.io.recv_batch()
                 except socket.timeout:
                     # Таймаут - нормально, просто продолжаем ждать
-                    continue
-                except KeyboardInterrupt:
-                    raise
-                except Exception as e:
-                    print(f"[{time.strftime('%H:%M:%S')}] Ошибка при обработке пакета: {e}")
-                    continue
+                    packets = []
+                except OSError as e:
+                    # Например, ICMP "порт недоступен" от ушедшего клиента (Windows)
+                    print(f"[{time.strftime('%H:%M:%S')}] Ошибка приема: {e}")
+                    packets = []
+                
+                for data, addr in packets:
+                    try:
+                        if not data or len(data) < 1:
+                            # Проверяем, не прошло ли слишком много времени без активности
+                            if time.time() - self.last_activity > 60:  # 1 минута
+                                print(f"Активность: ожидание...")
+                                self.last_activity = time.time()
+                            continue
+                        
+                        self.last_activity = time.time()
+                        self.handle_packet(data, addr)
+                    except KeyboardInterrupt:
+                        raise
+                    except Exception as e:
+                        print(f"[{time.strftime('%H:%M:%S')}] Ошибка при обработке пакета: {e}")
+                
+                self.complete_commits()
+                try:
+                    self.flush()
+                except OSError as e:
+                    print(f"[{time.strftime('%H:%M:%S')}] Ошибка отправки ответов: {e}")
+                
+                if time.time() - last_eviction >= 1.0:
+                    self.save_partials()
+                    self.evict_sessions()
+                    last_eviction = time.time()
                     
         except KeyboardInterrupt:
             print(f"\n[{time.strftime('%H:%M:%S')}] Сервер остановлен пользователем")
         except Exception as e:
             print(f"\n[{time.strftime('%H:%M:%S')}] Ошибка сервера: {e}")
         finally:
+            for session in self.sessions.values():
+                if not session.finished:
+                    self.save_partial(session)
+                session.close()
+            for thread in self.rebuilds:
+                thread.join()
+            self.committer.close()
+            self.complete_commits()
+            try:
+                self.flush()
+            except OSError:
+                pass
             self.sock.close()
             print(f"[{time.strftime('%H:%M:%S')}] Сокет закрыт")
     
+    def handle_packet(self, data, addr):
+        """Разбор пакета и передача его нужной сессии"""
+        # Первый байт - тип пакета
+        packet_type = data[0]
+        
+        if packet_type in (proto.PKT_META, proto.PKT_META_V2):  # Метаданные файла
+            self.handle_metadata(data, addr)
+        
+        elif packet_type == proto.PKT_DATA:  # Данные файла (старый клиент)
+            if len(data) < 5:
+                return
+            session = self.sessions.get((addr, 0))
+            if session is None:
+                return
+            session.last_activity = time.time()
+            if not session.finished:
+                if session.writer.full:
+                    # Диск не успевает - без ACK старый клиент повторит блок по таймауту
+                    session.deferred += 1
+                    return
+                chunk_id = struct.unpack('!I', data[1:5])[0]
+                if chunk_id < session.chunk_count:
+                    self.store_chunk(session, chunk_id, data[5:])
+        
+            # Отправляем подтверждение
+            self.send(b'ACK', addr)
+            if not session.finished and session.bitmap.is_complete():
+                self.finish_session(session)
+                
+        elif packet_type == proto.PKT_END:  # Сигнал завершения от клиента
+            session = self.sessions.get((addr, 0))
+            if session is None:
+                print(f"[{time.strftime('%H:%M:%S')}] Клиент {addr[0]}:{addr[1]} завершил передачу")
+                return
+            print(f"  Получен сигнал завершения ({session.filepath.name})")
+            if session.finished:
+                if session.reply is not None:  # пока файл фиксируется, ответа еще нет
+                    self.send(session.reply, addr)
+            else:
+                self.finish_session(session)
+                
+        elif packet_type == proto.PKT_WDATA:  # Данные файла (оконный режим)
+            if len(data) < proto.WDATA_HEADER.size:
+                return
+            _, transfer_id, chunk_id = proto.WDATA_HEADER.unpack_from(data)
+            self.handle_window_data(addr, transfer_id, chunk_id, data[proto.WDATA_HEADER.size:])
+        
+        elif packet_type == proto.PKT_WDATA_CRC:  # Данные файла с CRC32 блока (оконный режим)
+            if len(data) < proto.WDATA_CRC_HEADER.size:
+                return
+            _, transfer_id, chunk_id, crc = proto.WDATA_CRC_HEADER.unpack_from(data)
+            content = data[proto.WDATA_CRC_HEADER.size:]
+            if proto.chunk_crc(transfer_id, chunk_id, content) != crc:
+                # Блок поврежден в пути - не записываем, просим повторить только его
+                session = self.sessions.get((addr, transfer_id))
+                if session is not None and not session.finished:
+                    session.corrupted += 1
+                    self.pending_naks.setdefault((addr, transfer_id), []).append(chunk_id)
+                return
+            self.handle_window_data(addr, transfer_id, chunk_id, content)
+                    
+        elif packet_type == proto.PKT_WDATA_Z:  # Сжатый блок данных (оконный режим)
+            if len(data) < proto.WDATA_CRC_HEADER.size:
+                return
+            _, transfer_id, chunk_id, crc = proto.WDATA_CRC_HEADER.unpack_from(data)
+            session = self.sessions.get((addr, transfer_id))
+            if session is None or session.finished or not session.codec or chunk_id >= session.chunk_count:
+                return
+            packed = data[proto.WDATA_CRC_HEADER.size:]
+            content = b''  # Дубликат не распаковываем - store_chunk его все равно пропустит
+            if chunk_id not in session.bitmap:
+                try:
+                    if proto.chunk_crc(transfer_id, chunk_id, packed) != crc:
+                        raise ValueError("неверная CRC32")
+                    size = min(session.chunk_size, session.file_size - chunk_id * session.chunk_size)
+                    content = compression.decompress(session.codec, packed, size)
+                except ValueError:
+                    session.corrupted += 1
+                    self.pending_naks.setdefault((addr, transfer_id), []).append(chunk_id)
+                    return
+            self.handle_window_data(addr, transfer_id, chunk_id, content)
+        
+        elif packet_type == proto.PKT_FEC:  # Четность группы блоков (оконный режим)
+            if len(data) < proto.FEC_HEADER.size:
+                return
+            _, transfer_id, group, crc = proto.FEC_HEADER.unpack_from(data)
+            session = self.sessions.get((addr, transfer_id))
+            if session is None or session.finished or not session.fec:
+                return
+            parity = data[proto.FEC_HEADER.size:]
+            # Поврежденную четность просто отбрасываем: потерянные блоки клиент повторит сам
+            if len(parity) != session.chunk_size or proto.chunk_crc(transfer_id, group, parity) != crc:
+                return
+            session.last_activity = time.time()
+            if group * session.fec < session.chunk_count:
+                session.parity[group] = bytes(parity)
+                if self.recover_group(session, group):
+                    self.pending_acks[(addr, transfer_id)] = (session, group * session.fec)
+        
+        elif packet_type == proto.PKT_SIG_REQ:  # Запрос подписей прежней версии файла
+            if len(data) < proto.SIG_REQ_HEADER.size:
+                return
+            self.handle_signature_request(bytes(data), addr)
+        
+        elif packet_type == proto.PKT_PROBE:  # Пробный пакет для подбора размера блока
+            if len(data) < proto.PROBE_HEADER.size:
+                return
+            _, tag, size = proto.PROBE_HEADER.unpack_from(data)
+            # Подтверждаем только пакет, который дошел целиком
+            if size == len(data) - proto.PROBE_HEADER.size and size <= self.max_chunk_size:
+                self.send(proto.PROBE_HEADER.pack(proto.PKT_PROBE_ACK, tag, size), addr)
+        
+        elif packet_type == proto.PKT_WFIN:  # Завершение (оконный режим)
+            if len(data) < proto.WFIN_PACKET.size:
+                return
+            _, transfer_id = proto.WFIN_PACKET.unpack_from(data)
+            session = self.sessions.get((addr, transfer_id))
+            if session is None:
+                return
+            session.last_activity = time.time()
+            if session.hasher is not None and len(data) > proto.WFIN_PACKET.size:
+                session.digest = bytes(data[proto.WFIN_PACKET.size:])
+            if session.finished:
+                if session.reply is not None:  # пока файл фиксируется, ответа еще нет
+                    self.send(session.reply, addr)
+            elif session.bitmap.is_complete():
+                self.finish_session(session)
+            else:
+                # Не все блоки получены - сообщаем клиенту, чего не хватает
+                self.send(session.sack(), addr)
+    
+    def handle_window_data(self, addr, transfer_id, chunk_id, content):
+        """Блок данных оконного режима"""
+        session = self.sessions.get((addr, transfer_id))
+        if session is None:
+            return
+        session.last_activity = time.time()
+        if not session.finished and chunk_id < session.chunk_count:
+            self.store_chunk(session, chunk_id, content)
+        # Один SACK на сессию за пачку: он кумулятивный, отдельные не нужны
+        self.pending_acks[(addr, transfer_id)] = (session, chunk_id)
+    
+    def send(self, data, addr):
+        """Поставить ответ в очередь отправки текущей пачки"""
+        self.outbox.append((data, addr))
+    
+    def flush(self):
+        """Отправить накопленные ответы одним пакетным вызовом"""
+        for (addr, transfer_id), chunk_ids in self.pending_naks.items():
+            self.outbox.append((proto.pack_nak(transfer_id, chunk_ids), addr))
+        self.pending_naks.clear()
+        for session, chunk_id in self.pending_acks.values():
+            self.outbox.append((session.sack(chunk_id), session.addr))
+        self.pending_acks.clear()
+        if self.outbox:
+            outbox, self.outbox = self.outbox, []
+            self.io.send_batch(outbox)
+                        
+    def handle_metadata(self, data, addr):
+        """Начало новой передачи"""
+        data = bytes(data)
+        try:
+            file_size, filename, options, caps = proto.parse_metadata(data)
+        except ValueError:
+            print("Ошибка: неверный формат метаданных")
+            return
+        windowed = bool(options and options.get('mode') == 'window')
+        transfer_id = int(options['tid']) if windowed else 0
+        resume_key = self.check_resume_key(options.get('key')) if windowed else None
+        key = (addr, transfer_id)
+                    
+        session = self.sessions.get(key)
+        if session is not None and not session.finished:
+            # Подтверждение метаданных потерялось - повторяем
+            session.last_activity = time.time()
+            self.send(session.meta_reply, addr)
+            return
+        if key in self.stored_replies:
+            self.send(self.stored_replies[key][0], addr)
+            return
+                
+        print(f"\n[{time.strftime('%H:%M:%S')}] Получаю новый файл от {addr[0]}:{addr[1]}")
+                
+        if not filename:
+            filename = f"file_{int(time.time())}.bin"
+        
+        print(f"  Имя файла: {filename}")
+        print(f"  Размер: {file_size:,} байт")
+        
+        # Создаем безопасное имя файла
+        safe_name = self.make_safe_filename(filename)
+        
+        delta_info = None
+        if windowed and options.get('delta'):
+            # Вместо файла придет поток изменений, размер файла - в параметрах delta
+            delta_info = self.check_delta(options['delta'], safe_name)
+            if delta_info is None:
+                print("  Прежняя версия файла изменилась, изменения не принимаются")
+                self.send(proto.pack_meta_ack(transfer_id, {'delta': False}), addr)
+                return
+            print(f"  Изменения относительно {delta_info['base'].name}: "
+                  f"файл {delta_info['size']:,} байт, поток {file_size:,} байт")
+        
+        if windowed and self.accept_stored(options, delta_info['size'] if delta_info else file_size, safe_name, key):
+            return
+        
+        if resume_key and not self.release_resume_key(resume_key, addr, transfer_id):
+            # Тот же файл прямо сейчас принимается от другого клиента
+            print("  Передача с тем же ключом уже идет, принимаю без докачки")
+            resume_key = None
+        
+        if windowed:
+            chunk_size = max(1, min(int(options.get('chunk', LEGACY_CHUNK_SIZE)), self.max_chunk_size))
+            window = max(1, int(options.get('window', 64)))
+            if (file_size + chunk_size - 1) // chunk_size > proto.MAX_CHUNK_COUNT:
+                print("  Ошибка: номера блоков не помещаются в 32 бита, нужен блок больше")
+                return
+            params = {'chunk': chunk_size, 'window': window}
+            if caps is not None:
+                params['version'] = proto.METADATA_VERSION
+                params['caps'] = caps & proto.SUPPORTED_CAPS
+            if options.get('crc'):
+                params['crc'] = True
+            codec = compression.choose_algorithm(compression.AUTO, options.get('compression') or ())
+            if codec:
+                params['compression'] = codec
+            fec = max(0, min(int(options.get('fec') or 0), proto.MAX_FEC_GROUP))
+            if fec > 1:
+                params['fec'] = fec
+            else:
+                fec = 0
+            checksum = hashing.choose_algorithm(options.get('checksum'), hashing.available_algorithms())
+            hasher = None
+            if checksum:
+                params['checksum'] = checksum
+                hasher = hashing.new_hasher(checksum)
+            if delta_info:
+                params['delta'] = True
+            if resume_key:
+                # Имя в папке загрузок выбирается, когда файл принят целиком
+                bitmap, chunk_size = self.load_partial(resume_key, file_size, chunk_size)
+                session = ReceiveSession(addr, transfer_id, self.download_dir / safe_name, file_size,
+                                         chunk_size, True, resume_key, self.partial_dir / f"{resume_key}.part",
+                                         bitmap, hasher, fec, codec, delta_info, self.disk_writer)
+                params['chunk'] = chunk_size
+                params['have'] = session.received
+                params['missing'] = session.bitmap.missing_ranges(proto.MAX_RESUME_RANGES)
+                if session.received:
+                    print(f"  Докачка: уже принято {session.received:,} байт")
+            elif delta_info:
+                # Поток изменений не попадает в папку загрузок - там появится только собранный файл
+                stream_path = self.partial_dir / f"delta_{addr[1]}_{transfer_id}.part"
+                session = ReceiveSession(addr, transfer_id, stream_path, file_size, chunk_size, True,
+                                         hasher=hasher, fec=fec, codec=codec, delta=delta_info,
+                                         writer=self.disk_writer)
+            else:
+                session = ReceiveSession(addr, transfer_id, self.download_dir / safe_name, file_size, chunk_size, True,
+                                         partial_path=self.temp_path(), hasher=hasher, fec=fec, codec=codec,
+                                         writer=self.disk_writer)
+            session.meta_reply = proto.pack_meta_ack(transfer_id, params)
+            print(f"  Оконный режим: блок {chunk_size} байт, окно {window}")
+            if fec:
+                print(f"  Четность: 1 пакет на {fec} блоков")
+            if codec:
+                print(f"  Сжатие: {codec}")
+        else:
+            session = ReceiveSession(addr, 0, self.download_dir / safe_name, file_size, LEGACY_CHUNK_SIZE, False,
+                                     partial_path=self.temp_path(), writer=self.disk_writer)
+            session.meta_reply = b'OK'
+        
+        if key in self.sessions:
+            self.sessions[key].close()
+        self.sessions[key] = session
+        print(f"  Активных передач: {sum(1 for s in self.sessions.values() if not s.finished)}")
+        
+        # Отправляем подтверждение метаданных
+        self.send(session.meta_reply, addr)
+        
+        # Пустой файл старого клиента завершен сразу
+        if not windowed and session.bitmap.is_complete():
+            self.finish_session(session)
+    
+    def accept_stored(self, options, file_size, safe_name, key):
+        """Файл с суммой из метаданных уже есть в хранилище -> True, если сохранен без передачи"""
+        if self.store is None or options.get('checksum') != self.store.algorithm:
+            return False
+        blob = self.store.lookup(options.get('digest'), file_size)
+        if blob is None:
+            return False
+        # Ссылка на содержимое готовится в .partial, а имя в папке загрузок занимается
+        # атомарно (link_unique): одно имя не достанется двум передачам
+        temp_path = self.temp_path()
+        try:
+            self.store.link(blob, temp_path)
+            filepath = disk_writer.link_unique(temp_path, self.download_dir, safe_name)
+        except OSError as e:
+            print(f"  Ошибка хранилища: {e}")
+            if temp_path.exists():
+                temp_path.unlink()
+            return False
+        addr, transfer_id = key
+        reply = proto.pack_meta_ack(transfer_id, {'stored': True})
+        self.stored_replies[key] = (reply, time.time())
+        self.send(reply, addr)
+        print(f"  Уже есть в хранилище, данные не нужны: {filepath.name}")
+        return True
+    
+    def handle_signature_request(self, data, addr):
+        """Подписи страницы блоков самой новой версии файла (основы)
+        
+        Запросы не создают состояния: каждая страница читается из основы заново,
+        а ее размер и время изменения (tag) позволяют клиенту заметить, что основа сменилась
+        """
+        _, tag, first, max_count = proto.SIG_REQ_HEADER.unpack_from(data)
+        name = data[proto.SIG_REQ_HEADER.size:].decode('utf-8', errors='ignore')
+        base_name = delta.find_base(self.download_dir, self.make_safe_filename(name))
+        if base_name is None:
+            self.send(proto.SIG_HEADER.pack(proto.PKT_SIG, tag, first, 0, 0, 0, 0), addr)
+            return
+        with open(self.download_dir / base_name, 'rb') as base:
+            stat = os.fstat(base.fileno())
+            block = delta.block_size_for(stat.st_size)
+            total = -(-stat.st_size // block)
+            # Ответ не больше пакета данных клиента и не больше SIGNATURE_PAGE_BYTES чтения
+            count = min(max_count, max(1, SIGNATURE_PAGE_BYTES // block), max(0, total - first),
+                        (self.max_chunk_size - proto.SIG_HEADER.size) // delta.SIGNATURE_ENTRY.size)
+            entries = delta.block_signatures(base, block, first, count) if count else b''
+        if first == 0:
+            print(f"[{time.strftime('%H:%M:%S')}] Подписи {base_name} для {addr[0]}:{addr[1]}: "
+                  f"{total} блоков по {block} байт")
+        count = len(entries) // delta.SIGNATURE_ENTRY.size
+        self.send(proto.SIG_HEADER.pack(proto.PKT_SIG, tag, first, stat.st_size, stat.st_mtime_ns, block, count)
+                  + entries, addr)
+    
+    def check_delta(self, info, safe_name):
+        """Параметры потока изменений из метаданных -> словарь для сессии или None, если основа другая"""
+        base_name = delta.find_base(self.download_dir, safe_name)
+        if base_name is None:
+            return None
+        base_path = self.download_dir / base_name
+        try:
+            stat = base_path.stat()
+        except OSError:
+            return None
+        if stat.st_size != info.get('base_size') or stat.st_mtime_ns != info.get('tag'):
+            return None
+        checksum = hashing.choose_algorithm(info.get('checksum'), hashing.available_algorithms())
+        return {
+            'base': base_path, 'base_size': stat.st_size, 'tag': stat.st_mtime_ns, 'name': safe_name,
+            'size': int(info['size']), 'checksum': checksum if info.get('digest') else None,
+            'digest': str(info.get('digest') or '').lower(), 'hasher': None,
+        }
+    
+    def rebuild_session(self, session, stream_path):
+        """Поток сборки: файл из основы и потока изменений уходит в перенос
+        
+        Поток изменений удаляется, результат (как у обычного переноса) забирает complete_commits
+        """
+        filepath = self.rebuild_file(session, stream_path)
+        stream_path.unlink()
+        if filepath is None:
+            self.commits.put((session, stream_path, None, ValueError("файл не собран из изменений")))
+            return
+        self.committer.commit_async(filepath, self.download_dir, session.delta['name'],
+                                    lambda path, error: self.commits.put((session, filepath, path, error)))
+    
+    def rebuild_file(self, session, stream_path):
+        """Собрать файл из основы и принятого потока изменений -> временный файл или None"""
+        info = session.delta
+        filepath = self.temp_path()
+        hasher = hashing.new_hasher(info['checksum']) if info['checksum'] else None
+        try:
+            with open(info['base'], 'rb') as base, open(stream_path, 'rb') as stream, open(filepath, 'wb') as out:
+                stat = os.fstat(base.fileno())
+                if stat.st_size != info['base_size'] or stat.st_mtime_ns != info['tag']:
+                    raise ValueError(f"основа {info['base'].name} изменилась во время передачи")
+                delta.apply_delta(stream, base, out, info['base_size'], info['size'], hasher)
+            if hasher is not None and hasher.hexdigest() != info['digest']:
+                raise ValueError("контрольная сумма собранного файла не совпала")
+        except (OSError, ValueError) as e:
+            print(f"[{time.strftime('%H:%M:%S')}] ✗ Ошибка сборки файла из изменений: {e}")
+            if filepath.exists():
+                filepath.unlink()
+            return None
+        info['hasher'] = hasher
+        return filepath
+    
+    def store_chunk(self, session, chunk_id, content):
+        """Сохранить блок сессии и показать прогресс"""
+        if not session.store_chunk(chunk_id, content):
+            return
+        if session.parity:
+            # Блок мог оставить в своей группе ровно один недостающий - он восстанавливается
+            self.recover_group(session, chunk_id // session.fec)
+        
+        # Показываем прогресс
+        file_size = session.file_size
+        if file_size > 0:
+            step = max(1, session.chunk_count // 4)
+            if session.bitmap.received % step == 0 or session.bitmap.is_complete():
+                progress = (session.received / file_size) * 100
+                print(f"  {session.filepath.name}: {int(progress)}% ({session.received:,}/{file_size:,} байт)")
+    
+    def recover_group(self, session, group):
+        """Восстановить потерянный блок группы по четности, True если удалось"""
+        if session.writer.full:
+            # Восстановленный блок некуда записать - четность остается, блок придет повтором
+            return False
+        recovered = session.recover_chunk(group)
+        if recovered is None:
+            return False
+        session.recovered += 1
+        self.store_chunk(session, *recovered)
+        return True
+    
+    def finish_session(self, session):
+        """Проверка целостности файла и финальный ответ клиенту"""
+        verified = session.bitmap.is_complete() and session.digest_matches()
+        try:
+            session.flush()
+        except OSError as e:
+            print(f"[{time.strftime('%H:%M:%S')}] ✗ Ошибка записи на диск: {e}")
+            verified = False
+        session.close()
+        received_path = session.partial_path or session.filepath
+        actual_size = os.path.getsize(received_path)
+        if verified and actual_size == session.file_size:
+            # Ответ DONE/ERROR отправит complete_commits после сборки (поток изменений) и переноса
+            self.commit_session(session, received_path)
+            return
+        else:
+            if session.bitmap.is_complete() and not verified:
+                print(f"[{time.strftime('%H:%M:%S')}] ✗ Ошибка: контрольная сумма не совпала ({session.filepath.name})")
+            else:
+                print(f"[{time.strftime('%H:%M:%S')}] ✗ Ошибка: несовпадение размеров (ожидалось: {session.file_size}, получено: {actual_size})")
+            if received_path.exists():
+                received_path.unlink()
+            if session.resume_key:
+                self.remove_partial(session.resume_key)
+            session.reply = b'ERROR'
+        
+        # Отправляем финальное подтверждение
+        session.last_activity = time.time()
+        self.send(session.reply, session.addr)
+    
+    def commit_session(self, session, temp_path):
+        """Перенести принятый файл в папку загрузок под свободным именем
+        
+        Файл докачки сначала уходит из <ключ>.part под временным именем, а карта блоков
+        удаляется: повторная отправка того же файла, пока этот фиксируется, начнется
+        с нового .part. Файл из потока изменений собирается в отдельном потоке (rebuild_session),
+        в пачке (group) перенос завершается в потоке фиксации - ответ клиенту отправляет complete_commits
+        """
+        name = session.delta['name'] if session.delta is not None else session.filepath.name
+        failed = None
+        if session.resume_key:
+            detached = self.temp_path()
+            try:
+                os.replace(temp_path, detached)
+                temp_path = detached
+            except OSError as e:
+                detached.unlink()
+                failed = e
+            self.remove_partial(session.resume_key)
+        
+        session.committing = True
+        self.committing += 1
+        if failed is not None:
+            self.commits.put((session, temp_path, None, failed))
+        elif session.delta is not None:
+            # Сборка читает основу и поток целиком: в цикле приема она остановила бы все передачи
+            self.rebuilds = [thread for thread in self.rebuilds if thread.is_alive()]
+            thread = threading.Thread(target=self.rebuild_session, args=(session, temp_path), daemon=True)
+            self.rebuilds.append(thread)
+            thread.start()
+        else:
+            self.committer.commit_async(temp_path, self.download_dir, name,
+                                        lambda filepath, error: self.commits.put((session, temp_path, filepath, error)))
+        self.complete_commits()
+    
+    def complete_commits(self):
+        """Завершить перенесенные файлы: вывод, хранилище и ответ DONE/ERROR клиенту"""
+        while True:
+            try:
+                session, temp_path, filepath, error = self.commits.get_nowait()
+            except queue.Empty:
+                return
+            self.committing -= 1
+            session.committing = False
+            if error is not None:
+                name = session.delta['name'] if session.delta is not None else session.filepath.name
+                print(f"[{time.strftime('%H:%M:%S')}] ✗ Ошибка сохранения {name}: {error}")
+                if temp_path.exists():
+                    temp_path.unlink()
+                session.reply = b'ERROR'
+            else:
+                session.filepath = filepath
+                print(f"[{time.strftime('%H:%M:%S')}] ✓ Файл успешно сохранен: {filepath.name}")
+                print(f"  Фактический размер: {filepath.stat().st_size:,} байт")
+                if session.delta is not None:
+                    print(f"  Собран из {session.delta['base'].name}, "
+                          f"принято изменений {session.file_size:,} байт")
+                if self.store is not None:
+                    self.store_file(session)
+                if session.corrupted:
+                    print(f"  Поврежденных блоков (повторены): {session.corrupted}")
+                if session.recovered:
+                    print(f"  Восстановлено по четности (без повтора): {session.recovered}")
+                if session.deferred:
+                    print(f"  Отложено до повтора (диск не успевал): {session.deferred}")
+                session.reply = b'DONE'
+            session.last_activity = time.time()
+            self.send(session.reply, session.addr)
+    
+    def store_file(self, session):
+        """Добавить принятый файл в хранилище; ошибка хранилища не отменяет прием"""
+        # Сумма досчитана до конца файла, только если клиент прислал ее для сверки
+        hasher = session.hasher if session.digest is not None else None
+        if session.delta is not None:
+            hasher = session.delta['hasher']  # сумма собранного файла, а не потока изменений
+        try:
+            if self.store.add(session.filepath, hasher):
+                print("  Такое содержимое уже было, файл - ссылка на него")
+        except OSError as e:
+            print(f"  Ошибка хранилища: {e}")
+    
+    def evict_sessions(self):
+        """Удалить передачи без активности дольше session_timeout"""
+        now = time.time()
+        for key, (_, stored_at) in list(self.stored_replies.items()):
+            if now - stored_at > self.session_timeout:
+                del self.stored_replies[key]
+        for key, session in list(self.sessions.items()):
+            if now - session.last_activity <= self.session_timeout:
+                continue
+            if not session.finished:
+                print(f"[{time.strftime('%H:%M:%S')}] ✗ Таймаут передачи {session.filepath.name}: "
+                      f"получено {session.received:,}/{session.file_size:,} байт")
+                if session.resume_key:
+                    # Принятое остается в папке докачки до повторной отправки
+                    self.save_partial(session)
+                    session.close()
+                    print("  Сохранено для докачки")
+                else:
+                    session.close()
+                    received_path = session.partial_path or session.filepath
+                    if received_path.exists():
+                        received_path.unlink()
+            del self.sessions[key]
+    
+    def check_resume_key(self, resume_key):
+        """Ключ докачки из метаданных (становится частью имени файла) или None"""
+        if resume_key is None:
+            return None
+        resume_key = str(resume_key)
+        if not resume_key.isalnum() or len(resume_key) > 64:
+            print(f"  Некорректный ключ докачки: {resume_key!r}")
+            return None
+        return resume_key
+    
+    def release_resume_key(self, resume_key, addr, transfer_id):
+        """Забрать ключ докачки у старой передачи -> False, если она еще активна
+        
+        Клиент после сбоя приходит с новым адресом, а его прошлая передача еще ждет
+        таймаута - ее карта блоков сохраняется и передача удаляется. Повторная попытка
+        того же клиента идет с прежним id передачи и забирает ключ сразу
+        """
+        now = time.time()
+        for key, session in list(self.sessions.items()):
+            if session.resume_key != resume_key or session.finished:
+                continue
+            retry = session.transfer_id == transfer_id and session.addr[0] == addr[0]
+            if not retry and now - session.last_activity < RESUME_IDLE:
+                return False
+            self.save_partial(session)
+            session.close()
+            del self.sessions[key]
+        return True
+    
+    def load_partial(self, resume_key, file_size, chunk_size):
+        """Сохраненная карта блоков передачи -> (карта или None, размер блока)"""
+        bitmap_path = self.partial_dir / f"{resume_key}.bitmap"
+        try:
+            data = bitmap_path.read_bytes()
+            saved_size, saved_chunk = BITMAP_HEADER.unpack_from(data)
+            if saved_size != file_size or saved_chunk < 1 or not (self.partial_dir / f"{resume_key}.part").exists():
+                return None, chunk_size
+            bitmap = ChunkBitmap.from_bytes((file_size + saved_chunk - 1) // saved_chunk, data[BITMAP_HEADER.size:])
+        except (OSError, ValueError, struct.error):
+            return None, chunk_size
+        
+        if saved_chunk > chunk_size:
+            # Клиент просит блоки меньше прежних (большие пакеты терялись) - пересчитываем карту
+            bitmap = bitmap.regroup(saved_chunk, chunk_size, file_size)
+            saved_chunk = chunk_size
+        return bitmap, saved_chunk
+    
+    def save_partial(self, session):
+        """Сохранить карту полученных блоков передачи с докачкой
+        
+        Сначала данные сбрасываются на диск (fsync), потом атомарно заменяется карта,
+        поэтому после сбоя карта никогда не отмечает блоки, которых нет в файле
+        """
+        if not session.resume_key or session.file is None:
+            return
+        try:
+            session.flush()
+            os.fsync(session.file.fileno())
+            bitmap_path = self.partial_dir / f"{session.resume_key}.bitmap"
+            tmp_path = self.partial_dir / f"{session.resume_key}.tmp"
+            tmp_path.write_bytes(BITMAP_HEADER.pack(session.file_size, session.chunk_size) + session.bitmap.to_bytes())
+            os.replace(tmp_path, bitmap_path)
+            session.dirty = False
+        except OSError as e:
+            print(f"[{time.strftime('%H:%M:%S')}] Ошибка сохранения карты блоков: {e}")
+    
+    def save_partials(self):
+        """Сохранить карты блоков передач, получивших новые блоки (раз в секунду)"""
+        for session in self.sessions.values():
+            if session.dirty and session.resume_key and not session.finished:
+                self.save_partial(session)
+    
+    def remove_partial(self, resume_key):
+        """Удалить файлы докачки завершенной передачи"""
+        for suffix in ('.part', '.bitmap', '.tmp'):
+            path = self.partial_dir / f"{resume_key}{suffix}"
+            if path.exists():
+                path.unlink()
+    
+    def cleanup_partials(self):
+        """Удалить заброшенные незавершенные передачи"""
+        now = time.time()
+        for path in self.partial_dir.iterdir():
+            try:
+                if now - path.stat().st_mtime > PARTIAL_TTL:
+                    path.unlink()
+            except OSError:
+                pass
+    
+    def temp_path(self):
+        """Временный файл приема в .partial: в папке загрузок файл появится целым (commit_session)"""
+        fd, path = tempfile.mkstemp(suffix='.part', prefix='recv_', dir=self.partial_dir)
+        os.close(fd)
+        return Path(path)
+    
     def make_safe_filename(self, filename):
         """Создание безопасного имени файла"""
         safe = filename.strip()
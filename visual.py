@@ -11,6 +11,7 @@ import subprocess
 import time
 import socket
 import json
+from collections import deque
 from pathlib import Path
 from datetime import datetime
 from PyQt5.QtWidgets import *
@@ -39,7 +40,8 @@ class ReceivedFilesModel(QAbstractTableModel):
         # TCP файлы
         if self.download_dir_tcp.exists():
             for file_path in self.download_dir_tcp.iterdir():
-                if file_path.is_file():
+                # Скрытые файлы - служебные (временные ссылки хранилища)
+                if file_path.is_file() and not file_path.name.startswith('.'):
                     stat = file_path.stat()
                     size = self.format_size(stat.st_size)
                     mtime = time.strftime('%Y-%m-%d %H:%M', time.localtime(stat.st_mtime))
@@ -60,7 +62,7 @@ class ReceivedFilesModel(QAbstractTableModel):
         # UDP файлы
         if self.download_dir_udp.exists():
             for file_path in self.download_dir_udp.iterdir():
-                if file_path.is_file():
+                if file_path.is_file() and not file_path.name.startswith('.'):
                     stat = file_path.stat()
                     size = self.format_size(stat.st_size)
                     mtime = time.strftime('%Y-%m-%d %H:%M', time.localtime(stat.st_mtime))
@@ -145,11 +147,12 @@ class TCPServerThread(QThread):
     server_started = pyqtSignal()
     server_stopped = pyqtSignal()
     
-    def __init__(self, host, port, download_dir):
+    def __init__(self, host, port, download_dir, engine='threads'):
         super().__init__()
         self.host = host
         self.port = port
         self.download_dir = download_dir
+        self.engine = engine
         self.is_running = False
         self.server = None
         
@@ -159,10 +162,11 @@ class TCPServerThread(QThread):
             sys.path.append(os.path.dirname(os.path.abspath(__file__)))
             from tcp_server import TCPServerFixed
             
-            self.server = TCPServerFixed(host=self.host, port=self.port)
+            self.server = TCPServerFixed(host=self.host, port=self.port, download_dir=self.download_dir,
+                                         engine=self.engine)
             self.is_running = True
             self.server_started.emit()
-            self.log_signal.emit(f"TCP сервер запущен на {self.host}:{self.port}", "success")
+            self.log_signal.emit(f"TCP сервер запущен на {self.host}:{self.port} (движок {self.engine})", "success")
             
             # Запускаем сервер в блокирующем режиме
             self.server.start()
@@ -262,6 +266,7 @@ class FileTransferThread(QThread):
     """Поток для отправки файлов"""
     log_signal = pyqtSignal(str, str)
     transfer_complete = pyqtSignal(bool, str)
+    progress_signal = pyqtSignal(int)
     
     def __init__(self, protocol, file_path, host, port):
         super().__init__()
@@ -269,6 +274,14 @@ class FileTransferThread(QThread):
         self.file_path = file_path
         self.host = host
         self.port = port
+        self.last_percent = -1
+    
+    def report_progress(self, sent, total):
+        """progress_callback клиента: сигнал только при смене процента"""
+        percent = sent * 100 // total if total else 100
+        if percent != self.last_percent:
+            self.last_percent = percent
+            self.progress_signal.emit(percent)
         
     def run(self):
         """Запуск передачи файла"""
@@ -287,7 +300,8 @@ class FileTransferThread(QThread):
             sys.path.append(os.path.dirname(os.path.abspath(__file__)))
             from tcp_client import TCPClientSimple
             
-            client = TCPClientSimple(server_host=self.host, server_port=self.port)
+            client = TCPClientSimple(server_host=self.host, server_port=self.port,
+                                     progress_callback=self.report_progress)
             
             self.log_signal.emit(f"Подключение к TCP серверу {self.host}:{self.port}...", "info")
             
@@ -296,7 +310,8 @@ class FileTransferThread(QThread):
                 self.log_signal.emit(f"Отправка файла {file_name}...", "info")
                 
                 if client.send_file(self.file_path):
-                    self.log_signal.emit(f"Файл успешно отправлен по TCP!", "success")
+                    self.progress_signal.emit(100)
+                    self.log_signal.emit(f"Файл {file_name} успешно отправлен по TCP!", "success")
                     self.transfer_complete.emit(True, "")
                 else:
                     self.log_signal.emit("Ошибка отправки файла по TCP", "error")
@@ -324,12 +339,13 @@ class FileTransferThread(QThread):
             self.log_signal.emit(f"Начинаю отправку {file_name} ({size_str}) по UDP...", "info")
             
             # Создаем клиент и отправляем файл
-            client = UDPClientSimple(self.host, self.port)
+            client = UDPClientSimple(self.host, self.port, progress_callback=self.report_progress)
             
             # Используем send_file, который теперь включает ретраи
             success = client.send_file(self.file_path)
             
             if success:
+                self.progress_signal.emit(100)
                 self.log_signal.emit(
                     f"✓ Файл {file_name} ({size_str}) успешно отправлен по UDP!", 
                     "success"
@@ -357,12 +373,91 @@ class FileTransferThread(QThread):
             size_bytes /= 1024.0
         return f"{size_bytes:.1f} ТБ"
 
+class TransferQueue(QObject):
+    """Очередь отправки: не больше limits[протокол] одновременных передач на протокол"""
+    log_signal = pyqtSignal(str, str)
+    job_started = pyqtSignal(int)
+    job_progress = pyqtSignal(int, int)
+    job_finished = pyqtSignal(int, bool, str)
+    queue_empty = pyqtSignal()
+    
+    def __init__(self, tcp_limit=4, udp_limit=2):
+        super().__init__()
+        self.limits = {"TCP": tcp_limit, "UDP": udp_limit}
+        self.pending = {"TCP": deque(), "UDP": deque()}
+        self.running = {}      # номер задания -> (протокол, поток)
+        self.threads = set()   # ссылки на потоки до их полного завершения
+        self.next_id = 0
+    
+    def add(self, protocol, file_path, host, port):
+        """Поставить файл в очередь -> номер задания (запуск - schedule)"""
+        self.next_id += 1
+        self.pending[protocol].append((self.next_id, file_path, host, port))
+        return self.next_id
+    
+    def set_limit(self, protocol, limit):
+        self.limits[protocol] = limit
+        self.schedule()
+    
+    def active_count(self, protocol):
+        return sum(1 for p, _ in self.running.values() if p == protocol)
+    
+    def schedule(self):
+        """Запустить ожидающие задания, пока есть свободные места"""
+        for protocol, queue in self.pending.items():
+            while queue and self.active_count(protocol) < self.limits[protocol]:
+                job_id, file_path, host, port = queue.popleft()
+                
+                # Слоты - методы очереди: сигналы потока обрабатываются в главном потоке
+                thread = FileTransferThread(protocol, file_path, host, port)
+                thread.job_id = job_id
+                thread.log_signal.connect(self.log_signal)
+                thread.progress_signal.connect(self.on_progress)
+                thread.transfer_complete.connect(self.on_complete)
+                thread.finished.connect(self.on_thread_finished)
+                
+                self.running[job_id] = (protocol, thread)
+                self.threads.add(thread)
+                self.job_started.emit(job_id)
+                thread.start()
+    
+    def on_progress(self, percent):
+        self.job_progress.emit(self.sender().job_id, percent)
+    
+    def on_complete(self, success, error_message):
+        job_id = self.sender().job_id
+        if self.running.pop(job_id, None) is None:
+            return
+        self.job_finished.emit(job_id, success, error_message)
+        self.schedule()
+        if not self.running and not any(self.pending.values()):
+            self.queue_empty.emit()
+    
+    def on_thread_finished(self):
+        self.threads.discard(self.sender())
+    
+    def cancel_pending(self):
+        """Убрать из очереди задания, которые еще не начались -> их номера"""
+        cancelled = [job[0] for queue in self.pending.values() for job in queue]
+        for queue in self.pending.values():
+            queue.clear()
+        return cancelled
+    
+    def stop(self, timeout=2000):
+        """Отменить ожидающие и дождаться текущих передач"""
+        self.cancel_pending()
+        for thread in list(self.threads):
+            thread.wait(timeout)
+
 class TransferApp(QMainWindow):
     def __init__(self):
         super().__init__()
         self.tcp_server_thread = None
         self.udp_worker = None
-        self.transfer_thread = None
+        
+        # Очередь отправки и строки таблицы очереди по номеру задания
+        self.transfer_queue = TransferQueue()
+        self.queue_jobs = {}
         
         # Пути для сохранения файлов
         self.script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -456,11 +551,14 @@ class TransferApp(QMainWindow):
         tcp_form = QFormLayout()
         self.tcp_host = QLineEdit("127.0.0.1")
         self.tcp_port = QLineEdit("8888")
+        self.tcp_engine = QComboBox()
+        self.tcp_engine.addItems(["threads", "asyncio"])
         self.tcp_server_status = QLabel("Сервер остановлен")
         self.tcp_server_status.setStyleSheet("color: #f44336; font-weight: bold;")
         
         tcp_form.addRow("Хост:", self.tcp_host)
         tcp_form.addRow("Порт:", self.tcp_port)
+        tcp_form.addRow("Движок:", self.tcp_engine)
         tcp_form.addRow("Статус:", self.tcp_server_status)
         
         # Кнопки TCP
@@ -577,13 +675,15 @@ class TransferApp(QMainWindow):
         server_stack.addWidget(self.udp_panel)
         
         # === ПАНЕЛЬ ОТПРАВКИ ФАЙЛОВ ===
-        send_group = QGroupBox("Отправка файла")
+        send_group = QGroupBox("Отправка файлов")
         send_layout = QVBoxLayout()
         
-        # Выбор файла
+        # Выбор файлов: несколько путей через ';', можно перетащить файлы в окно
         file_layout = QHBoxLayout()
         self.file_path = QLineEdit()
-        self.file_path.setPlaceholderText("Выберите файл для отправки...")
+        self.file_path.setPlaceholderText("Выберите файлы для отправки или перетащите их в окно...")
+        self.file_path.setAcceptDrops(False)
+        self.setAcceptDrops(True)
         self.btn_browse = QPushButton("📁 Обзор...")
         self.btn_browse.setStyleSheet("padding: 8px;")
         
@@ -601,6 +701,10 @@ class TransferApp(QMainWindow):
         self.tcp_recipient_port = QLineEdit("8888")
         tcp_send_layout.addRow("Хост получателя:", self.tcp_recipient_host)
         tcp_send_layout.addRow("Порт получателя:", self.tcp_recipient_port)
+        self.tcp_concurrency = QSpinBox()
+        self.tcp_concurrency.setRange(1, 16)
+        self.tcp_concurrency.setValue(self.transfer_queue.limits["TCP"])
+        tcp_send_layout.addRow("Одновременно файлов:", self.tcp_concurrency)
         tcp_send_widget.setLayout(tcp_send_layout)
         
         # UDP настройки отправки
@@ -610,13 +714,17 @@ class TransferApp(QMainWindow):
         self.udp_recipient_port = QLineEdit("9999")
         udp_send_layout.addRow("Адрес сервера:", self.udp_recipient_host)
         udp_send_layout.addRow("Порт сервера:", self.udp_recipient_port)
+        self.udp_concurrency = QSpinBox()
+        self.udp_concurrency.setRange(1, 16)
+        self.udp_concurrency.setValue(self.transfer_queue.limits["UDP"])
+        udp_send_layout.addRow("Одновременно файлов:", self.udp_concurrency)
         udp_send_widget.setLayout(udp_send_layout)
         
         send_settings_stack.addWidget(tcp_send_widget)
         send_settings_stack.addWidget(udp_send_widget)
         
         # Кнопка отправки
-        self.btn_send_file = QPushButton("Отправить файл по TCP")
+        self.btn_send_file = QPushButton("Отправить файлы по TCP")
         self.btn_send_file.setStyleSheet("""
             QPushButton {
                 background-color: #4CAF50;
@@ -698,6 +806,28 @@ class TransferApp(QMainWindow):
         files_layout.addLayout(files_control_layout)
         files_layout.addWidget(self.files_table)
         
+        # Вкладка с очередью отправки
+        queue_tab = QWidget()
+        queue_layout = QVBoxLayout(queue_tab)
+        
+        queue_control_layout = QHBoxLayout()
+        self.btn_clear_queue = QPushButton("🧹 Убрать завершенные")
+        self.btn_cancel_queue = QPushButton("⏹ Отменить ожидающие")
+        queue_control_layout.addWidget(self.btn_clear_queue)
+        queue_control_layout.addWidget(self.btn_cancel_queue)
+        queue_control_layout.addStretch()
+        
+        self.queue_table = QTableWidget(0, 6)
+        self.queue_table.setHorizontalHeaderLabels(["Файл", "Протокол", "Получатель", "Размер", "Прогресс", "Статус"])
+        self.queue_table.setSelectionBehavior(QTableView.SelectRows)
+        self.queue_table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.queue_table.horizontalHeader().setStretchLastSection(True)
+        self.queue_table.setColumnWidth(0, 250)
+        self.queue_table.setColumnWidth(4, 150)
+        
+        queue_layout.addLayout(queue_control_layout)
+        queue_layout.addWidget(self.queue_table)
+        
         # Вкладка с логом
         log_tab = QWidget()
         log_layout = QVBoxLayout(log_tab)
@@ -729,6 +859,7 @@ class TransferApp(QMainWindow):
         
         # Добавляем вкладки
         tabs.addTab(files_tab, "📁 Полученные файлы")
+        tabs.addTab(queue_tab, "📤 Очередь отправки")
         tabs.addTab(log_tab, "📝 Журнал событий")
         
         bottom_layout.addWidget(tabs)
@@ -763,6 +894,17 @@ class TransferApp(QMainWindow):
         # Общие сигналы
         self.btn_browse.clicked.connect(self.browse_file)
         self.btn_send_file.clicked.connect(self.send_file)
+        self.btn_clear_queue.clicked.connect(self.clear_finished_jobs)
+        self.btn_cancel_queue.clicked.connect(self.cancel_pending_jobs)
+        self.tcp_concurrency.valueChanged.connect(lambda value: self.transfer_queue.set_limit("TCP", value))
+        self.udp_concurrency.valueChanged.connect(lambda value: self.transfer_queue.set_limit("UDP", value))
+        
+        # Сигналы очереди отправки
+        self.transfer_queue.log_signal.connect(self.log_message_safe)
+        self.transfer_queue.job_started.connect(self.on_job_started)
+        self.transfer_queue.job_progress.connect(self.on_job_progress)
+        self.transfer_queue.job_finished.connect(self.on_job_finished)
+        self.transfer_queue.queue_empty.connect(lambda: self._log_message("Очередь отправки завершена", "success"))
         
         self.btn_refresh_files.clicked.connect(self.refresh_files)
         self.btn_open_tcp_folder.clicked.connect(lambda: self.open_download_folder(self.tcp_download_dir))
@@ -798,7 +940,7 @@ class TransferApp(QMainWindow):
         # Меняем текст кнопки отправки
         protocol_text = "TCP" if is_tcp else "UDP"
         color = "#4CAF50" if is_tcp else "#2196F3"
-        self.btn_send_file.setText(f"Отправить файл по {protocol_text}")
+        self.btn_send_file.setText(f"Отправить файлы по {protocol_text}")
         self.btn_send_file.setStyleSheet(f"""
             QPushButton {{
                 background-color: {color};
@@ -900,15 +1042,45 @@ class TransferApp(QMainWindow):
                 self._log_message(f"Ошибка сохранения: {str(e)}", "error")
     
     def browse_file(self):
-        """Выбор файла для отправки"""
-        file_name, _ = QFileDialog.getOpenFileName(
-            self, "Выберите файл для отправки", "", "Все файлы (*)"
+        """Выбор файлов для отправки"""
+        file_names, _ = QFileDialog.getOpenFileNames(
+            self, "Выберите файлы для отправки", "", "Все файлы (*)"
         )
-        if file_name:
-            self.file_path.setText(file_name)
-            file_size = os.path.getsize(file_name)
-            size_str = self.files_model.format_size(file_size)
-            self._log_message(f"Выбран файл: {os.path.basename(file_name)} ({size_str})", "info")
+        if file_names:
+            self.set_selected_files(file_names)
+    
+    def set_selected_files(self, file_names):
+        """Показать выбранные файлы в поле пути"""
+        self.file_path.setText("; ".join(file_names))
+        total = sum(os.path.getsize(name) for name in file_names)
+        size_str = self.files_model.format_size(total)
+        if len(file_names) == 1:
+            self._log_message(f"Выбран файл: {os.path.basename(file_names[0])} ({size_str})", "info")
+        else:
+            self._log_message(f"Выбрано файлов: {len(file_names)} ({size_str})", "info")
+    
+    def selected_files(self):
+        """Пути из поля выбора файлов"""
+        return [path.strip() for path in self.file_path.text().split(';') if path.strip()]
+    
+    def dragEnterEvent(self, event):
+        """Принимаем перетаскивание файлов в окно"""
+        if event.mimeData().hasUrls():
+            event.acceptProposedAction()
+    
+    def dropEvent(self, event):
+        """Перетащенные файлы (из папок - файлы верхнего уровня) добавляются к выбранным"""
+        file_names = self.selected_files()
+        for url in event.mimeData().urls():
+            path = url.toLocalFile()
+            if os.path.isdir(path):
+                file_names.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                                  if os.path.isfile(os.path.join(path, name)))
+            elif os.path.isfile(path):
+                file_names.append(path)
+        if file_names:
+            self.set_selected_files(file_names)
+        event.acceptProposedAction()
     
     # ===== TCP МЕТОДЫ =====
     def start_tcp_server(self):
@@ -929,7 +1101,8 @@ class TransferApp(QMainWindow):
             return
         
         # Создаем и запускаем поток сервера
-        self.tcp_server_thread = TCPServerThread(host, port, self.tcp_download_dir)
+        self.tcp_server_thread = TCPServerThread(host, port, self.tcp_download_dir,
+                                                 self.tcp_engine.currentText())
         self.tcp_server_thread.log_signal.connect(self.log_message_safe)
         self.tcp_server_thread.server_started.connect(self.on_tcp_server_started)
         self.tcp_server_thread.server_stopped.connect(self.on_tcp_server_stopped)
@@ -939,6 +1112,7 @@ class TransferApp(QMainWindow):
         """Обработка запуска TCP сервера"""
         self.btn_start_tcp_server.setEnabled(False)
         self.btn_stop_tcp_server.setEnabled(True)
+        self.tcp_engine.setEnabled(False)
         self.tcp_server_status.setText("🟢 TCP сервер запущен")
         self.tcp_server_status.setStyleSheet("color: #4CAF50; font-weight: bold;")
     
@@ -946,6 +1120,7 @@ class TransferApp(QMainWindow):
         """Обработка остановки TCP сервера"""
         self.btn_start_tcp_server.setEnabled(True)
         self.btn_stop_tcp_server.setEnabled(False)
+        self.tcp_engine.setEnabled(True)
         self.tcp_server_status.setText("🔴 TCP сервер остановлен")
         self.tcp_server_status.setStyleSheet("color: #f44336; font-weight: bold;")
         self.tcp_server_thread = None
@@ -1004,10 +1179,14 @@ class TransferApp(QMainWindow):
     
     # ===== МЕТОДЫ ОТПРАВКИ ФАЙЛОВ =====
     def send_file(self):
-        """Отправка файла"""
-        file_path = self.file_path.text().strip()
-        
-        if not file_path or not os.path.exists(file_path):
+        """Поставить выбранные файлы в очередь отправки"""
+        file_paths = self.selected_files()
+        existing = [path for path in file_paths if os.path.isfile(path)]
+        for path in file_paths:
+            if path not in existing:
+                self._log_message(f"Файл не найден: {path}", "warning")
+        
+        if not existing:
             self._log_message("Выберите существующий файл!", "error")
             return
         
@@ -1032,35 +1211,77 @@ class TransferApp(QMainWindow):
             self._log_message("Порт должен быть числом от 1 до 65535!", "error")
             return
         
-        # Блокируем кнопку на время отправки
-        self.btn_send_file.setEnabled(False)
         protocol = "TCP" if is_tcp else "UDP"
-        self.btn_send_file.setText(f"⏳ Отправка {protocol}...")
-        
-        # Запускаем поток отправки
-        self.transfer_thread = FileTransferThread(
-            protocol, 
-            file_path, 
-            host, 
-            port
-        )
-        self.transfer_thread.log_signal.connect(self.log_message_safe)
-        self.transfer_thread.transfer_complete.connect(self.on_transfer_complete)
-        self.transfer_thread.start()
+        for file_path in existing:
+            self.add_queue_row(protocol, file_path, host, port)
+        self.transfer_queue.schedule()
+        self._log_message(f"В очередь {protocol} добавлено файлов: {len(existing)}", "info")
+        self.file_path.clear()
+        
+    def add_queue_row(self, protocol, file_path, host, port):
+        """Добавить строку в таблицу очереди и задание в очередь"""
+        row = self.queue_table.rowCount()
+        self.queue_table.insertRow(row)
     
-    def on_transfer_complete(self, success, error_message):
-        """Обработка завершения передачи"""
-        # Восстанавливаем кнопку
-        is_tcp = self.protocol_tcp.isChecked()
-        protocol = "TCP" if is_tcp else "UDP"
-        self.btn_send_file.setEnabled(True)
-        self.btn_send_file.setText(f"Отправить файл по {protocol}")
+        name_item = QTableWidgetItem(os.path.basename(file_path))
+        name_item.setToolTip(file_path)
+        status_item = QTableWidgetItem("Ожидает")
+        progress_bar = QProgressBar()
+        progress_bar.setRange(0, 100)
+        progress_bar.setValue(0)
+        
+        self.queue_table.setItem(row, 0, name_item)
+        self.queue_table.setItem(row, 1, QTableWidgetItem(protocol))
+        self.queue_table.setItem(row, 2, QTableWidgetItem(f"{host}:{port}"))
+        self.queue_table.setItem(row, 3, QTableWidgetItem(self.files_model.format_size(os.path.getsize(file_path))))
+        self.queue_table.setCellWidget(row, 4, progress_bar)
+        self.queue_table.setItem(row, 5, status_item)
+        
+        job_id = self.transfer_queue.add(protocol, file_path, host, port)
+        self.queue_jobs[job_id] = {'item': name_item, 'status': status_item, 'bar': progress_bar, 'done': False}
+    
+    def on_job_started(self, job_id):
+        job = self.queue_jobs.get(job_id)
+        if job:
+            job['status'].setText("Отправка...")
+    
+    def on_job_progress(self, job_id, percent):
+        job = self.queue_jobs.get(job_id)
+        if job:
+            job['bar'].setValue(percent)
+    
+    def on_job_finished(self, job_id, success, error_message):
+        """Обработка завершения одной передачи из очереди"""
+        job = self.queue_jobs.get(job_id)
+        if job:
+            job['done'] = True
+            if success:
+                job['bar'].setValue(100)
+                job['status'].setText("✓ Отправлен")
+            else:
+                job['status'].setText(f"✗ {error_message or 'Ошибка'}")
         
         # Обновляем список файлов если передача успешна
         if success:
             self.refresh_files()
         
-        self.transfer_thread = None
+    def cancel_pending_jobs(self):
+        """Отменить задания, которые еще не начались"""
+        cancelled = self.transfer_queue.cancel_pending()
+        for job_id in cancelled:
+            job = self.queue_jobs.get(job_id)
+            if job:
+                job['done'] = True
+                job['status'].setText("Отменен")
+        if cancelled:
+            self._log_message(f"Отменено заданий: {len(cancelled)}", "warning")
+    
+    def clear_finished_jobs(self):
+        """Убрать из таблицы завершенные и отмененные задания"""
+        for job_id, job in list(self.queue_jobs.items()):
+            if job['done']:
+                self.queue_table.removeRow(self.queue_table.row(job['item']))
+                del self.queue_jobs[job_id]
     
     def clear_log(self):
         """Очистка лога"""
@@ -1079,6 +1300,9 @@ class TransferApp(QMainWindow):
             self.stop_udp_server()
             self.udp_worker.wait(2000)
         
+        # Отменяем ожидающие передачи и ждем текущие
+        self.transfer_queue.stop()
+        
         # Останавливаем таймер
         if hasattr(self, 'update_timer'):
             self.update_timer.stop()